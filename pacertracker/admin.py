@@ -1,5 +1,11 @@
+import datetime
+
 from django.contrib import admin
-from pacertracker.models import Alert, Court, CourtGroup, Case, Entry
+from django.contrib.postgres.search import SearchQuery
+from django.utils import timezone
+from pacertracker.models import Alert, Court, CourtGroup, Case, Entry, FeedHealth
+from pacertracker.paging import EstimatedCountPaginator
+from pacertracker.search import SEARCH_CONFIG
 
 
 class CourtAdmin(admin.ModelAdmin):
@@ -7,18 +13,59 @@ class CourtAdmin(admin.ModelAdmin):
 	list_filter = ('type', 'has_feed','publishes_all',)
 	search_fields = ['name']
 	
+class FeedHealthAdmin(admin.ModelAdmin):
+	list_display = ('court', 'consecutive_failures', 'last_success', 'last_good_build', 'next_attempt',)
+	list_select_related = ('court',)
+	ordering = ('-consecutive_failures',)
+	
 class CourtGroupAdmin(admin.ModelAdmin):
 	filter_horizontal = ('courts',)
 
+class CapturedWithinFilter(admin.SimpleListFilter):
+	"""
+	Recently captured rows, which the captured_time indexes find without reading the whole table
+	"""
+	title = 'captured'
+	parameter_name = 'captured_within'
+	
+	def lookups(self, request, model_admin):
+		return (('1', 'Last 24 hours'), ('7', 'Last 7 days'), ('30', 'Last 30 days'),)
+	
+	def queryset(self, request, queryset):
+		if self.value() not in ('1', '7', '30'):
+			return queryset
+		return queryset.filter(captured_time__gte=timezone.now() - datetime.timedelta(days=int(self.value())))
+
+# Case and entry tables are too big to count or to search with LIKE, so they are
+# paginated with estimated counts and searched through the case full-text index.
+# They have no date hierarchy, whose links are found by reading every row.
 class CaseAdmin(admin.ModelAdmin):
-	list_display = ('court','title',)
+	list_display = ('court','title','entry_count','last_filed',)
+	list_select_related = ('court',)
 	search_fields = ['title']
-	list_filter = ('court',)
+	list_filter = ('court', CapturedWithinFilter,)
+	paginator = EstimatedCountPaginator
+	show_full_result_count = False
+	
+	def get_search_results(self, request, queryset, search_term):
+		if not search_term.strip():
+			return queryset, False
+		return queryset.filter(search_vector=SearchQuery(search_term, config=SEARCH_CONFIG)), False
 	
 class EntryAdmin(admin.ModelAdmin):
 	list_display = ('time_filed', 'case','description',)
-	search_fields = ['case','description']
-	list_filter = ('case__court',)
+	list_select_related = ('case',)
+	search_fields = ['case__title']
+	list_filter = ('case__court', CapturedWithinFilter,)
+	raw_id_fields = ('case',)
+	ordering = ('-captured_time', '-id')
+	paginator = EstimatedCountPaginator
+	show_full_result_count = False
+	
+	def get_search_results(self, request, queryset, search_term):
+		if not search_term.strip():
+			return queryset, False
+		return queryset.filter(case__search_vector=SearchQuery(search_term, config=SEARCH_CONFIG)), False
 
 
 admin.site.register(Court, CourtAdmin)
@@ -26,4 +73,5 @@ admin.site.register(CourtGroup, CourtGroupAdmin)
 admin.site.register(Alert)
 admin.site.register(Case, CaseAdmin)
 admin.site.register(Entry, EntryAdmin)
+admin.site.register(FeedHealth, FeedHealthAdmin)
 
@@ -0,0 +1,34 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
+from django.db.models.signals import post_save, post_delete
+
+#Caches that only the process that set a value can see
+LOCAL_CACHES = ['django.core.cache.backends.locmem.LocMemCache']
+
+
+def check_cache(app_configs, **kwargs):
+    """
+    Warns when the court picker would not be rebuilt in other processes after courts change
+    """
+    backend = getattr(settings, 'CACHES', {}).get('default', {}).get(
+        'BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+    if backend in LOCAL_CACHES:
+        return [checks.Warning(
+            'The default cache is local to each process, so the court picker is not rebuilt '
+            'in other processes when courts change.',
+            hint='Use a cache shared by all processes, such as memcached or the database cache.',
+            id='pacertracker.W001')]
+    return []
+
+
+class PacertrackerConfig(AppConfig):
+    name = 'pacertracker'
+
+    def ready(self):
+        from pacertracker.models import Court
+        from pacertracker.widgets import court_changed
+
+        post_save.connect(court_changed, sender=Court, dispatch_uid='pacertracker_court_saved')
+        post_delete.connect(court_changed, sender=Court, dispatch_uid='pacertracker_court_deleted')
+        checks.register(check_cache)
@@ -0,0 +1,134 @@
+import time
+import datetime
+import logging
+import threading
+
+from concurrent import futures
+
+from django.core import mail
+
+utc = datetime.timezone.utc
+logger = logging.getLogger(__name__)
+
+
+class EmailDelivery(object):
+    """
+    Sends emails as they are produced instead of collecting them first.
+
+    Messages are grouped into chunks of chunk_size and each chunk is handed to one of
+    pool_size worker threads. Every worker opens one SMTP connection and reuses it for
+    all of its chunks. A message that fails is retried on its own with exponential
+    backoff, so messages the server already accepted are never sent twice.
+
+    Each message may carry a payload (anything the caller needs to finish up after
+    delivery). close() returns the payloads of accepted and failed messages.
+    """
+    def __init__(self, pool_size=2, chunk_size=20, retries=3, backoff=5):
+        self.chunk_size = max(1, chunk_size)
+        self.retries = retries
+        self.backoff = backoff
+        self.executor = futures.ThreadPoolExecutor(max_workers=max(1, pool_size))
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.chunk = []
+        self.pending = []
+        self.accepted = []
+        self.failed = []
+
+    def add(self, message, payload=None):
+        self.chunk.append((message, payload))
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.chunk:
+            self.pending.append(self.executor.submit(self.send_chunk, self.chunk))
+            self.chunk = []
+
+        # Collect finished chunks so their results do not pile up
+        for future in [x for x in self.pending if x.done()]:
+            self.collect(future)
+
+    def collect(self, future):
+        self.pending.remove(future)
+        accepted, failed = future.result()
+        self.accepted.extend(accepted)
+        self.failed.extend(failed)
+
+    def get_connection(self):
+        # One connection per worker thread, opened on first use and then reused
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = mail.get_connection()
+            connection.open()
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+
+        return connection
+
+    def reset_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        self.local.connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception: #various smtplib errors
+                pass
+
+    def send_chunk(self, chunk):
+        accepted, failed = [], []
+        for message, payload in chunk:
+            if self.send_message(message):
+                accepted.append(payload)
+            else:
+                failed.append(payload)
+
+        return accepted, failed
+
+    def send_message(self, message):
+        """
+        Sends one message, retrying with backoff. Returns True if it was accepted.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                if self.get_connection().send_messages([message]):
+                    return True
+            except Exception as e: #various smtplib errors
+                warning_msg = 'WARNING - %s - Sendemails could not send email to %s (attempt %s of %s). - %s'
+                warning_msg = (warning_msg % (datetime.datetime.utcnow().replace(tzinfo=utc),
+                               ','.join(message.to),
+                               attempt + 1,
+                               self.retries + 1,
+                               e))
+                logger.warning(warning_msg)
+                self.reset_connection()
+
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+
+        error_msg = 'ERROR - %s - Sendemails gave up sending email to %s.'
+        error_msg = (error_msg % (datetime.datetime.utcnow().replace(tzinfo=utc),
+                     ','.join(message.to)))
+        logger.error(error_msg)
+
+        return False
+
+    def close(self):
+        """
+        Sends anything still buffered, waits for all chunks and closes the connections.
+        """
+        self.flush()
+        for future in list(self.pending):
+            self.collect(future)
+        self.executor.shutdown()
+
+        for connection in self.connections:
+            try:
+                connection.close()
+            except Exception: #various smtplib errors
+                pass
+        self.connections = []
+
+        return self.accepted, self.failed
@@ -0,0 +1,148 @@
+import uuid
+import datetime
+import logging
+
+from collections import OrderedDict
+
+from django.db import transaction
+
+from pacertracker.matching import get_alert_matches
+from pacertracker.models import Alert, Entry, Digest
+
+utc = datetime.timezone.utc
+logger = logging.getLogger(__name__)
+
+#Same limits as the alert email itself
+DIGEST_CASES = 150
+DIGEST_ENTRIES = 25
+
+
+def accumulate_digest(alert):
+    """
+    Adds what a daily alert matched since its digest was last checked to the digest
+
+    Every case gets one row holding a count of its new entries. The first 150 cases
+    stored also hold the ids of their 25 most recently filed new entries, the rest
+    are only counted so the email can say how many cases there were.
+
+    The alert row is locked while its digest is added to, and its digest_checked is
+    saved in the same transaction, so runs adding to the same digest take turns and
+    each only adds what the one before it had not.
+    """
+    with transaction.atomic():
+        #Another run may have added to the digest since the alert was read
+        digest_checked = list(Alert.objects.select_for_update().filter(id=alert.id).values_list(
+                              'digest_checked', flat=True))
+        if not digest_checked:
+            return alert
+        alert.digest_checked = digest_checked[0]
+
+        since = alert.digest_checked or alert.last_checked
+        #Store what will become the alert's digest_checked before the query starts evaluating
+        checked = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+        cases, entries = get_alert_matches(alert, since)
+        case_ids = list(cases.order_by('type').values_list('id', flat=True))
+
+        if case_ids:
+            new_entries = {}
+            for case_id, entry_id in entries.order_by('case', '-time_filed').values_list('case', 'id'):
+                new_entries.setdefault(case_id, []).append(str(entry_id))
+
+            #The rows are locked so the daily run can not clear them while they are added to
+            digests = list(Digest.objects.select_for_update().filter(alert=alert).order_by('id'))
+            shown = set([d.case_id for d in digests[:DIGEST_CASES]])
+            digests = dict([(d.case_id, d) for d in digests])
+            digests_to_create = []
+            digests_to_update = []
+
+            for case_id in case_ids:
+                entry_ids = new_entries.get(case_id, [])
+                if case_id in digests:
+                    digest = digests[case_id]
+                    digest.entry_count += len(entry_ids)
+                    if case_id in shown:
+                        digest.entry_ids = (entry_ids + digest.entry_ids)[:DIGEST_ENTRIES]
+                    digests_to_update.append(digest)
+                else:
+                    is_shown = len(digests) + len(digests_to_create) < DIGEST_CASES
+                    digests_to_create.append(Digest(alert=alert, case_id=case_id,
+                                                    entry_count=len(entry_ids),
+                                                    entry_ids=entry_ids[:DIGEST_ENTRIES] if is_shown else []))
+
+            Digest.objects.bulk_create(digests_to_create)
+            Digest.objects.bulk_update(digests_to_update, ['entry_count', 'entry_ids'])
+
+        Alert.objects.filter(id=alert.id).update(digest_checked=checked)
+        alert.digest_checked = checked
+
+    return alert
+
+
+def accumulate_digests():
+    """
+    Brings the digests of all active users' daily alerts up to date, one alert at a time
+    """
+    alerts = [accumulate_digest(alert) for alert in
+              Alert.objects.filter(live_updates=False, user__is_active=True).prefetch_related('courts')]
+
+    return len(alerts)
+
+
+def get_digest_email_data(alert):
+    """
+    Returns an alert's email data from its digest, in the form used by the alert email, and what was read
+
+    What was read is each digest row's count and entry ids by id, for clear_digests.
+    """
+    rows = dict([(id, (entry_count, entry_ids)) for id, entry_count, entry_ids in
+                 Digest.objects.filter(alert=alert).order_by('id').values_list('id', 'entry_count', 'entry_ids')])
+    if not rows:
+        return None, {}
+
+    #The first cases stored are the ones with entry ids to show
+    digests = list(Digest.objects.filter(id__in=list(rows)[:DIGEST_CASES]).select_related('case__court')
+                   .order_by('case__type'))
+    entries = Entry.objects.in_bulk([x for digest in digests for x in digest.entry_ids])
+
+    alert_data = {'alert' : alert,
+                  'case_count' : len(rows),
+                  'cases' : {}}
+
+    for digest in digests:
+        rows[digest.id] = (digest.entry_count, digest.entry_ids)
+        alert_data['cases'][str(digest.case_id)] = {
+            'case' : digest.case,
+            'entry_count' : digest.entry_count,
+            'entries' : OrderedDict()
+            }
+
+        for entry_id in digest.entry_ids:
+            #Entries might have been removed since they were added to the digest
+            entry = entries.get(uuid.UUID(entry_id))
+            if entry:
+                alert_data['cases'][str(digest.case_id)]['entries'][str(entry.id)] = entry
+
+    return alert_data, rows
+
+
+def clear_digests(rows):
+    """
+    Removes what an email was made from, rows read by get_digest_email_data, from the digests
+
+    Anything live runs added to a row since it was read is kept for the next email.
+    """
+    with transaction.atomic():
+        digests_to_delete = []
+        digests_to_update = []
+        for digest in Digest.objects.select_for_update().filter(id__in=list(rows)):
+            entry_count, entry_ids = rows[digest.id]
+            if digest.entry_count == entry_count:
+                digests_to_delete.append(digest.id)
+            else:
+                digest.entry_count -= entry_count
+                digest.entry_ids = [x for x in digest.entry_ids if x not in entry_ids]
+                digests_to_update.append(digest)
+
+        Digest.objects.filter(id__in=digests_to_delete).delete()
+        Digest.objects.bulk_update(digests_to_update, ['entry_count', 'entry_ids'], batch_size=500)
@@ -0,0 +1,45 @@
+import uuid
+import hashlib
+import datetime
+
+from django.utils import timezone
+
+utc = datetime.timezone.utc
+
+TIME_BITS = 48
+COURT_BITS = 12
+HASH_BITS = 62
+
+
+def get_entry_id(case_id, court_id, description, number, website, time_filed):
+    """
+    Returns the id of a docket entry, the same every time the entry is seen in a feed
+
+    Ids are laid out like version 7 UUIDs: the start of the UTC day the entry was filed,
+    in milliseconds, then the court, then a hash of the entry. Entries are mostly saved
+    in the order they were filed, so new ids land together at the end of the primary key
+    index rather than on random pages of it. The day rather than the exact time is used
+    because entries reach the feeds up to hours after they were filed, and ids that sort
+    by the millisecond would split pages of the index that are never filled again. Only
+    values stored with the entry are hashed, so the id of a saved entry can be worked
+    out again.
+    """
+    if timezone.is_naive(time_filed):
+        # As Django saves it
+        time_filed = timezone.make_aware(time_filed)
+    content = '\n'.join([str(case_id), description, str(number), str(website),
+                         time_filed.astimezone(utc).isoformat()])
+    digest = int(hashlib.md5(content.encode('utf-8')).hexdigest(), 16)
+    day = time_filed.astimezone(utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    milliseconds = int(day.timestamp() * 1000) & (2 ** TIME_BITS - 1)
+
+    return uuid.UUID(int=(milliseconds << 80 | 0x7 << 76 | (court_id & (2 ** COURT_BITS - 1)) << 64 |
+                          0b10 << HASH_BITS | digest >> (128 - HASH_BITS)))
+
+
+def get_legacy_entry_id(case_website, description, number, website, time_filed):
+    """
+    Returns the id entries were given before get_entry_id, a hash of the entry alone
+    """
+    content = case_website + description + str(number) + str(website) + str(time_filed)
+    return uuid.UUID(hashlib.md5(content.encode('utf-8')).hexdigest())
@@ -0,0 +1,118 @@
+import datetime
+
+from django.conf import settings
+
+from pacertracker.models import FeedHealth
+
+utc = datetime.timezone.utc
+
+#Downloads remembered per court
+HEALTH_WINDOW = 50
+#Longest and shortest download timeouts, in seconds
+MAX_TIMEOUT = 30
+MIN_TIMEOUT = 5
+
+
+def get_percentile(values, percentile):
+    """
+    Returns a percentile (0 to 100) of a list of numbers, or None if it is empty
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100.0))]
+
+
+def get_success_rate(health):
+    if not health.results:
+        return None
+    return float(sum([1 for x in health.results if x])) / len(health.results)
+
+
+def get_breaker_failures():
+    return getattr(settings, 'FEED_BREAKER_FAILURES', 3)
+
+
+def is_breaker_open(health, now):
+    """
+    Returns whether a feed has failed too often to be downloaded before its next attempt
+    """
+    return bool(health.next_attempt and health.next_attempt > now)
+
+
+def is_failing(health):
+    return health.consecutive_failures >= get_breaker_failures()
+
+
+def get_timeout(health):
+    """
+    Returns the download timeout for a feed, from how long it usually takes
+
+    A feed gets three times its 95th percentile download time, between 5 and 30
+    seconds. Feeds without enough history, or that are failing, get the longest.
+    """
+    p95 = get_percentile(health.latencies, 95)
+    if p95 is None or len(health.latencies) < 5 or is_failing(health):
+        return MAX_TIMEOUT
+    return max(MIN_TIMEOUT, min(MAX_TIMEOUT, p95 * 3))
+
+
+def get_retries(health):
+    """
+    Returns the retries for a feed, none when it is only being probed after failing
+    """
+    return 0 if is_failing(health) else 2
+
+
+def record_result(results, value):
+    results.append(value)
+    del results[:-HEALTH_WINDOW]
+
+
+def record_success(health, now, latency, build_date=None):
+    record_result(health.results, True)
+    record_result(health.latencies, round(latency, 3))
+    health.consecutive_failures = 0
+    health.next_attempt = None
+    health.last_success = now
+    if build_date:
+        health.last_good_build = build_date
+
+
+def record_failure(health, now, error):
+    """
+    Records a failed download or unreadable feed and backs off if it keeps failing
+
+    Once a feed fails FEED_BREAKER_FAILURES times in a row, it is skipped for
+    FEED_BREAKER_BACKOFF minutes, doubling with every further failure up to
+    FEED_BREAKER_MAX_BACKOFF minutes. It is then tried once, without retries.
+    """
+    record_result(health.results, False)
+    health.consecutive_failures += 1
+    health.last_failure = now
+    health.last_error = str(error)[:500]
+
+    extra_failures = health.consecutive_failures - get_breaker_failures()
+    if extra_failures >= 0:
+        backoff = getattr(settings, 'FEED_BREAKER_BACKOFF', 10) * 2 ** min(extra_failures, 16)
+        backoff = min(backoff, getattr(settings, 'FEED_BREAKER_MAX_BACKOFF', 360))
+        health.next_attempt = now + datetime.timedelta(minutes=backoff)
+
+
+def get_feed_health(courts):
+    """
+    Returns the health of each court's feed keyed by court id, creating any that are missing
+    """
+    healths = dict([(h.court_id, h) for h in FeedHealth.objects.filter(court__in=courts)])
+    missing = [FeedHealth(court=court) for court in courts if court.id not in healths]
+    if missing:
+        FeedHealth.objects.bulk_create(missing, ignore_conflicts=True)
+        healths = dict([(h.court_id, h) for h in FeedHealth.objects.filter(court__in=courts)])
+
+    return healths
+
+
+def save_feed_health(healths):
+    FeedHealth.objects.bulk_update(healths, ['results', 'latencies', 'consecutive_failures',
+                                             'last_success', 'last_failure', 'last_error',
+                                             'last_good_build', 'next_attempt'], batch_size=500)
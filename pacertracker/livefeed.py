@@ -0,0 +1,262 @@
+import re
+import json
+import asyncio
+import datetime
+import logging
+
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+
+from pacertracker.models import Alert, Entry, RecentEntry
+
+utc = datetime.timezone.utc
+logger = logging.getLogger(__name__)
+
+#Entries fetched by one poll at most, the rest are picked up by the next one
+POLL_LIMIT = 2000
+#Entries are only read once they are this old, so that a batch committed a little
+#after a later one is not skipped
+POLL_DELAY = datetime.timedelta(seconds=5)
+#Events held for a slow client before newer ones are dropped
+QUEUE_SIZE = 500
+#Seconds between comments that keep idle connections open
+KEEPALIVE = 15
+
+
+def get_terms(text):
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+def parse_words(words):
+    """
+    Returns an alert's words as a list of alternatives, split on OR
+
+    Each alternative is a pair of lists, the phrases that must be in a title and
+    the phrases that must not be. A phrase is a tuple of terms.
+    """
+    alternatives = []
+    for alternative in re.split(r'\s+OR\s+', words.strip()):
+        required, excluded = [], []
+        exclude = False
+        for token in re.findall(r'-?"[^"]*"|\S+', alternative):
+            if token in ('AND', '&&'):
+                continue
+            if token in ('NOT', '!'):
+                exclude = True
+                continue
+            if token.startswith('-'):
+                exclude, token = True, token[1:]
+            phrase = tuple(get_terms(token))
+            if phrase:
+                (excluded if exclude else required).append(phrase)
+            exclude = False
+        alternatives.append((required, excluded))
+
+    return alternatives
+
+
+def has_phrase(terms, phrase):
+    size = len(phrase)
+    return any(tuple(terms[i:i + size]) == phrase for i in range(len(terms) - size + 1))
+
+
+def match_words(alternatives, terms):
+    """
+    Returns whether the terms of a case title match an alert's parsed words
+
+    This mirrors the default search (all words, in any order) closely enough
+    for the live feed. Stemming is not applied, so the emails remain the
+    complete record of what an alert matched.
+    """
+    for required, excluded in alternatives:
+        if (all(has_phrase(terms, p) for p in required) and
+                not any(has_phrase(terms, p) for p in excluded)):
+            return True
+
+    return False
+
+
+def get_subscription_alerts(user):
+    """
+    Returns the user's alerts in the form the live feed matches entries against
+    """
+    alerts = []
+    for alert in Alert.objects.filter(user=user).prefetch_related('courts').order_by('id'):
+        alerts.append({'id': alert.id,
+                       'words': alert.words,
+                       'parsed_words': parse_words(alert.words),
+                       'courts': set([court.id for court in alert.courts.all()]),
+                       'exclude_type': alert.district_court_filter,
+                       'only_new_cases': alert.only_new_cases})
+
+    return alerts
+
+
+def get_entry_json(entry):
+    """
+    Returns an entry as a JSON object, without the closing brace so alert ids can be added
+    """
+    data = {'id': str(entry.id),
+            'case': {'id': entry.case_id,
+                     'title': entry.case.title,
+                     'court': entry.case.court.name,
+                     'website': entry.case.website},
+            'number': entry.number,
+            'description': entry.description,
+            'website': entry.website,
+            'time_filed': entry.time_filed.isoformat(),
+            'captured_time': entry.captured_time.isoformat()}
+
+    return json.dumps(data)[:-1]
+
+
+def get_event(entry_json, alert_ids):
+    return 'event: entry\ndata: %s, "alerts": %s}\n\n' % (entry_json, json.dumps(alert_ids))
+
+
+class LiveFeed(object):
+    """
+    Pushes newly captured entries to every subscriber whose alerts match them
+
+    One poller per process fetches new entries with a single query, however many
+    clients are connected, and matches them against each subscriber's alerts in
+    memory. The poller starts with the first subscriber and stops after the last.
+    """
+    def __init__(self, interval=None, since=None, delay=POLL_DELAY):
+        self.interval = interval or getattr(settings, 'LIVE_FEED_INTERVAL', 10)
+        self.delay = delay
+        self.since = since
+        self.last_id = None
+        self.subscribers = {}
+        self.task = None
+        self.polls = 0
+
+    def subscribe(self, alerts):
+        queue = asyncio.Queue(QUEUE_SIZE)
+        self.subscribers[queue] = alerts
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.pop(queue, None)
+
+    def get_courts(self):
+        return set([court_id for alerts in list(self.subscribers.values())
+                    for alert in alerts for court_id in alert['courts']])
+
+    def fetch_entries(self):
+        """
+        Returns entries captured since the last poll, oldest first, and the time the poll started from
+        """
+        settled = datetime.datetime.utcnow().replace(tzinfo=utc) - self.delay
+        if self.since is None:
+            self.since = settled
+        #Cases are saved just before their entries
+        window_start = self.since - self.delay
+
+        #Seek past the last entry delivered, on the recent entry table's (captured_time, entry_id)
+        #index, leaving out courts no subscriber follows before any entry is read
+        recent = RecentEntry.objects.filter(captured_time__gte=self.since, captured_time__lt=settled,
+                                            court__in=self.get_courts())
+        if self.last_id is not None:
+            recent = recent.filter(Q(captured_time__gt=self.since) | Q(entry_id__gt=self.last_id))
+        recent = list(recent.order_by('captured_time', 'entry_id').values_list('captured_time', 'entry_id')
+                      [:POLL_LIMIT])
+        entries = list(Entry.objects.filter(id__in=[x[1] for x in recent], captured_time__gte=self.since,
+                                            captured_time__lt=settled)
+                       .select_related('case__court')
+                       .only('id', 'number', 'description', 'website', 'time_filed', 'captured_time',
+                             'case__id', 'case__title', 'case__type', 'case__website',
+                             'case__captured_time', 'case__court__id', 'case__court__name')
+                       .order_by('captured_time', 'id'))
+
+        if recent:
+            self.since, self.last_id = recent[-1]
+        self.polls += 1
+
+        return entries, window_start
+
+    def match(self, alert, entry, terms, window_start):
+        """
+        Returns whether an alert for the entry's court matches an entry
+        """
+        case = entry.case
+        if alert['exclude_type'] and case.type == alert['exclude_type']:
+            return False
+        #A case is new if it was first captured during this poll's window, or just before it
+        if alert['only_new_cases'] and case.captured_time < window_start:
+            return False
+        if alert['words'] and not match_words(alert['parsed_words'], terms):
+            return False
+
+        return True
+
+    def publish(self, entries, window_start):
+        #Index the alerts by court so each entry is only matched against alerts for its court
+        court_alerts = {}
+        for queue, alerts in list(self.subscribers.items()):
+            for alert in alerts:
+                for court_id in alert['courts']:
+                    court_alerts.setdefault(court_id, []).append((queue, alert))
+
+        full_queues = set()
+        for entry in entries:
+            terms = get_terms(entry.case.title)
+            matches = OrderedDict()
+            for queue, alert in court_alerts.get(entry.case.court_id, []):
+                if self.match(alert, entry, terms, window_start):
+                    matches.setdefault(queue, []).append(alert['id'])
+
+            #The entry is serialized once for all of its subscribers
+            entry_json = get_entry_json(entry) if matches else None
+            for queue, alert_ids in matches.items():
+                if queue in full_queues:
+                    continue
+                try:
+                    queue.put_nowait(get_event(entry_json, alert_ids))
+                except asyncio.QueueFull:
+                    full_queues.add(queue)
+                    logger.warning('WARNING - %s - Live feed dropped entries for a slow client.' %
+                                   datetime.datetime.utcnow().replace(tzinfo=utc))
+
+    async def poll(self):
+        entries, window_start = await sync_to_async(self.fetch_entries)()
+        self.publish(entries, window_start)
+
+    async def run(self):
+        while self.subscribers:
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception('ERROR - %s - Live feed poll failed.' %
+                                 datetime.datetime.utcnow().replace(tzinfo=utc))
+            await asyncio.sleep(self.interval)
+
+        #Start from the present again the next time someone subscribes
+        self.since, self.last_id = None, None
+
+    async def stream(self, alerts):
+        """
+        Yields server-sent events for one subscriber until the client disconnects
+        """
+        queue = self.subscribe(alerts)
+        try:
+            yield 'retry: 10000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield event
+        finally:
+            self.unsubscribe(queue)
+
+
+#The feed shared by every connection to this process
+live_feed = LiveFeed()
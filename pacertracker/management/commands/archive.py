@@ -1,8 +1,17 @@
+import io
+import re
 import os
+import gzip
+import zlib
+import shutil
 import datetime
 import timeit
 import time
 import csv
+import json
+import glob
+import uuid
+import hashlib
 import logging
 import zipfile
 
@@ -10,13 +19,17 @@ from os.path import basename
 
 from dateutil import parser
 from dateutil.tz import gettz
-from internetarchive import upload
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.core.management import call_command
 from django.conf import settings
+from django.utils import timezone
+from django.db import connection
+from django.db.models import CharField, F, Func, Q, Value
+from django.db.models.functions import NullIf
 
 import pacertracker
+from pacertracker.uploads import UploadManager, get_upload_target
 from pacertracker.models import Court, Case, Entry
 
 utc = datetime.timezone.utc
@@ -24,31 +37,219 @@ logger = logging.getLogger(__name__)
 
 court_fields = ['id','name','type','has_feed','publishes_all','filing_types','feed_url','website','last_updated']
 cases_fields = ['id','number','name','type','website','captured_time','is_date_filed','court_id']
+cases_delta_fields = cases_fields + ['updated_time']
 entries_fields = ['id','time_filed','captured_time','description','number','website','case_id']
+#Name of a year's entries file
+ENTRIES_FILE = re.compile(r'^(\d{4})entries\.csv\.gz$')
+#Name of the part of a year's entries file added by one run, which is what is uploaded
+ENTRIES_SEGMENT = re.compile(r'^(\d{4})entries-(\d+)\.csv\.gz$')
 
-def get_last_line(file, how_many_last_lines = 1):
-    # open your file using with: safety first, kids!
-    with open(file, 'r') as file:
+# Most bytes read from the end of an entries file to check or rebuild its checkpoint
+TAIL_BYTES = 64 * 1024
+READ_BYTES = 1024 * 1024
+GZIP_MAGIC = b'\x1f\x8b\x08'
+# Compression level of entry gzip members, a little faster than the default for about the same size
+COMPRESS_LEVEL = 6
+# Entries written to each gzip member, and between checkpoints
+BATCH_ROWS = 100000
+# Time in the names of cases delta files and the comment of the cases snapshot
+DELTA_TIME_FORMAT = '%Y%m%d%H%M%S'
+# Writes times in COPY output as Python writes them, in UTC, with microseconds only when there are any
+COPY_TIME_TEMPLATE = ("CASE WHEN date_trunc('second', %(expressions)s) = %(expressions)s "
+                      "THEN to_char(%(expressions)s AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS\"+00:00\"') "
+                      "ELSE to_char(%(expressions)s AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS.US\"+00:00\"') END")
+
+def get_checkpoint_filename(filename):
+    return filename + '.checkpoint'
+
+def write_checkpoint(filename, checkpoint):
+    """
+    Writes the checkpoint of an entries file so that it is either all there or not changed
+    """
+    temp_filename = get_checkpoint_filename(filename) + '.tmp'
+    with open(temp_filename, 'w') as out:
+        json.dump(checkpoint, out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temp_filename, get_checkpoint_filename(filename))
+
+def get_checksum(data):
+    return hashlib.md5(data).hexdigest()
+
+def read_bytes(filename, start, end):
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        return file.read(end - start)
+
+def get_checkpoint(captured_time, id, rows, filename, member_offset):
+    """
+    Returns the checkpoint of an entries file whose last gzip member starts at member_offset
+
+    The checksum covers the end of the compressed file, at most 64 KB of its last member.
+    """
+    offset = os.path.getsize(filename)
+    return {'captured_time': captured_time.isoformat() if captured_time else None,
+            'id': str(id) if id else None,
+            'rows': rows,
+            'offset': offset,
+            'member_offset': member_offset,
+            'checksum': get_checksum(read_bytes(filename, max(member_offset, offset - TAIL_BYTES), offset))}
+
+def get_last_row(tail, is_start):
+    """
+    Returns the captured time and id of the last entry row in the end of a CSV, or None
+    """
+    # Descriptions may contain line breaks, so try each line break from the end
+    # until what follows it is exactly one whole entry row
+    position = len(tail)
+    while position > 0:
+        position = tail.rfind(b'\n', 0, position - 1) + 1
+        if position == 0 and not is_start:
+            break
+        rows = list(csv.reader(io.StringIO(tail[position:].decode('utf-8', 'replace'), newline='')))
+        if len(rows) != 1 or len(rows[0]) != len(entries_fields):
+            continue
+        try:
+            return parser.parse(rows[0][2], tzinfos=get_tzinfos()), uuid.UUID(rows[0][0])
+        except (ValueError, OverflowError):
+            continue # Including the header row
+
+    return None
+
+def read_member_tail(filename, start):
+    """
+    Decompresses the gzip member starting at an offset and returns the end of it
+
+    Returns the last 64 KB decompressed and whether that is the whole member, or None
+    if there is no single member running from the offset to the end of the file.
+    """
+    decompressor = zlib.decompressobj(31)
+    tail, size = b'', 0
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        try:
+            while not decompressor.eof:
+                chunk = file.read(READ_BYTES)
+                if not chunk:
+                    return None
+                data = decompressor.decompress(chunk)
+                size += len(data)
+                tail = (tail + data)[-TAIL_BYTES:]
+        except zlib.error:
+            return None
+        if decompressor.unused_data or file.read(1):
+            return None
+
+    return tail, size <= TAIL_BYTES
+
+def find_last_member(filename):
+    """
+    Returns the offset of the last gzip member of a file, with the end of its contents
+
+    Gzip headers are looked for from the end of the file back. Only the last
+    member, which holds one run's entries, is decompressed.
+    """
+    end = os.path.getsize(filename)
+    while end > 0:
+        start = max(0, end - READ_BYTES)
+        # Overlap the next block so that a header across the boundary is found
+        chunk = read_bytes(filename, start, end + len(GZIP_MAGIC) - 1)
+        position = len(chunk)
+        while True:
+            position = chunk.rfind(GZIP_MAGIC, 0, position)
+            if position < 0:
+                break
+            member = read_member_tail(filename, start + position)
+            if member:
+                return (start + position,) + member
+        end = start
+
+    return None
+
+def rebuild_checkpoint(filename):
+    """
+    Rebuilds the checkpoint of an entries file from the last row of its last gzip member
+
+    The row count can not be known without reading the whole file, so it is left out.
+    """
+    if not os.path.getsize(filename):
+        return get_checkpoint(None, None, 0, filename, 0)
+
+    member = find_last_member(filename)
+    if member is None:
+        raise CommandError('Archive could not find the last gzip member of %s.' % basename(filename))
+    member_offset, tail, is_start = member
+
+    row = get_last_row(tail, is_start)
+    if row is None: # Only the header was written
+        return get_checkpoint(None, None, 0, filename, member_offset)
+
+    return get_checkpoint(row[0], row[1], None, filename, member_offset)
+
+def load_checkpoint(filename):
+    """
+    Returns the checkpoint of an entries file after checking it against the file
+
+    Anything written after the checkpoint, by a run that did not finish, is cut
+    off so that it is exported again. A missing or mismatched checkpoint is rebuilt.
+    """
+    try:
+        with open(get_checkpoint_filename(filename)) as file:
+            checkpoint = json.load(file)
+        valid = (os.path.getsize(filename) >= checkpoint['offset'] and
+                 get_checksum(read_bytes(filename,
+                                         max(checkpoint['member_offset'], checkpoint['offset'] - TAIL_BYTES),
+                                         checkpoint['offset'])) == checkpoint['checksum'])
+    except (IOError, ValueError, KeyError, TypeError):
+        valid = False
+
+    if valid and os.path.getsize(filename) > checkpoint['offset']:
+        logger.warning('WARNING - %s - Archive removed rows after the checkpoint of %s.' % (
+                       datetime.datetime.utcnow().replace(tzinfo=utc), basename(filename)))
+        with open(filename, 'r+b') as file:
+            file.truncate(checkpoint['offset'])
+    elif not valid:
+        logger.warning('WARNING - %s - Archive rebuilt the missing or mismatched checkpoint of %s.' % (
+                       datetime.datetime.utcnow().replace(tzinfo=utc), basename(filename)))
+        checkpoint = rebuild_checkpoint(filename)
+        write_checkpoint(filename, checkpoint)
+
+    return checkpoint
+
+def convert_legacy_file(csv_filename, filename):
+    """
+    Compresses an entries CSV from an earlier version into the first member of its gzip file
+    """
+    with open(csv_filename, 'rb') as source:
+        with gzip.open(filename + '.tmp', 'wb', compresslevel=COMPRESS_LEVEL) as out:
+            shutil.copyfileobj(source, out, READ_BYTES)
+    os.replace(filename + '.tmp', filename)
+    write_checkpoint(filename, rebuild_checkpoint(filename))
+
+    os.remove(csv_filename)
+    if os.path.exists(get_checkpoint_filename(csv_filename)):
+        os.remove(get_checkpoint_filename(csv_filename))
+
+    logger.info('INFO - %s - Archive compressed %s into %s.' % (
+                datetime.datetime.utcnow().replace(tzinfo=utc), basename(csv_filename), basename(filename)))
+
+def write_zipped_csv(zipname, csv_name, fields, rows, comment=''):
+    """
+    Writes rows as a CSV straight into a new zip file, which replaces the old one once complete
+    """
+    # A fixed time stamp keeps the zip the same when the rows are, so it is not uploaded again
+    member = zipfile.ZipInfo(csv_name, date_time=(1980, 1, 1, 0, 0, 0))
+    member.compress_type = zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(zipname + '.tmp', 'w', zipfile.ZIP_DEFLATED) as zfile:
+        zfile.comment = comment.encode('utf-8')
+        with io.TextIOWrapper(zfile.open(member, 'w', force_zip64=True),
+                              encoding='utf-8', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
+    os.replace(zipname + '.tmp', zipname)
 
-        # find the position of the end of the file: end of the file stream
-        end_of_file = file.seek(0,2)
-        
-        # set your stream at the end: seek the final position of the file
-        file.seek(end_of_file)             
-        
-        # trace back each character of your file in a loop
-        n = 0
-        for num in range(end_of_file+1):            
-            file.seek(end_of_file - num)    
-           
-            # save the last characters of your file as a string: last_line
-            last_line = file.read()
-           
-            # count how many '\n' you have in your string: 
-            # if you have 1, you are in the last line; if you have 2, you have the two last lines
-            if last_line.count('\n') == how_many_last_lines +1: 
-                return last_line[2:]
-                
 def get_tzinfos():
     #Necessary for dateutil parser
     tzinfos = {'EDT': gettz("America/New York"),
@@ -64,36 +265,425 @@ def get_tzinfos():
                     
     return tzinfos
 
-def update_entries_file(filename, io_type, fields, filter_from, filter_to=None):
-    with open(filename, io_type, newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        
-        if io_type == 'w':
-            writer.writerow(fields)
-        
-        if filter_to: # Used for last update of prior year
-            entries = Entry.objects.filter(captured_time__gt=filter_from,
-                                           captured_time__year=filter_to
-                                           ).order_by('captured_time'
-                                           ).values_list(*fields).iterator(chunk_size=10000)
-        elif io_type == 'w': # New files contain all entries for current year
-            entries = Entry.objects.filter(captured_time__year=filter_from
-                                           ).order_by('captured_time'
-                                           ).values_list(*fields).iterator(chunk_size=10000)
+def get_rows_after(queryset, checkpoint, time_field='captured_time'):
+    """
+    Returns the rows after the last one in a checkpoint, in (time, id) order
+    """
+    if checkpoint and checkpoint[time_field]:
+        last_time = parser.parse(checkpoint[time_field])
+        queryset = queryset.filter(**{time_field + '__gte': last_time}).filter(
+                                   Q(**{time_field + '__gt': last_time}) | Q(id__gt=checkpoint['id']))
+
+    return queryset.order_by(time_field, 'id')
+
+def copy_entries(entries, fields, out):
+    """
+    Streams entries from PostgreSQL as CSV straight into a binary file and returns the row count
+
+    COPY writes the rows on the server, so no Python objects are made for them.
+    Values are written byte for byte as the csv module writes them on the ORM path:
+    times are formatted the same way, and empty text is written as NULL, since COPY
+    quotes empty strings ("") and csv.writer writes both empty strings and None as nothing.
+    """
+    columns = {}
+    for field in fields:
+        if field in ('time_filed', 'captured_time'):
+            columns['copy_' + field] = Func(F(field), template=COPY_TIME_TEMPLATE, output_field=CharField())
+        elif Entry._meta.get_field(field).get_internal_type() in ('CharField', 'TextField'):
+            columns['copy_' + field] = NullIf(F(field), Value(''))
+    entries = entries.annotate(**columns).values_list(*[('copy_' + f if 'copy_' + f in columns else f)
+                                                        for f in fields])
+
+    sql, params = entries.query.sql_with_params()
+    with connection.cursor() as cursor:
+        sql = cursor.mogrify(sql, params)
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8')
+        cursor.copy_expert('COPY (%s) TO STDOUT WITH CSV' % sql, out)
+        return cursor.rowcount
+
+def can_copy():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        return hasattr(cursor, 'copy_expert')
+
+def get_rows_up_to(queryset, last_row, time_field='captured_time'):
+    """
+    Returns the rows up to and including a (time, id)
+    """
+    return queryset.filter(**{time_field + '__lte': last_row[0]}).filter(
+                           Q(**{time_field + '__lt': last_row[0]}) | Q(id__lte=last_row[1]))
+
+def create_entries_file(filename, fields):
+    """
+    Creates an entries file holding only the header, and returns its checkpoint
+    """
+    with gzip.open(filename + '.tmp', 'wb', compresslevel=COMPRESS_LEVEL) as gzfile:
+        gzfile.write((','.join(fields) + '\n').encode('utf-8'))
+    os.replace(filename + '.tmp', filename)
+
+    checkpoint = get_checkpoint(None, None, 0, filename, 0)
+    write_checkpoint(filename, checkpoint)
+
+    return checkpoint
+
+def append_entries(filename, entries, fields, checkpoint, last_entry, copy):
+    """
+    Appends entries as a new gzip member of an entries file and checkpoints it at the last one
+    """
+    member_offset = os.path.getsize(filename)
+    with gzip.open(filename, 'ab', compresslevel=COMPRESS_LEVEL) as gzfile:
+        if copy:
+            # COPY hands over one row at a time, so gather them into large writes
+            with io.BufferedWriter(gzfile, READ_BYTES) as out:
+                written = copy_entries(entries, fields, out)
         else:
-            entries = Entry.objects.filter(captured_time__gt=filter_from
-                                           ).order_by('captured_time'
-                                           ).values_list(*fields).iterator(chunk_size=10000)
-        
-        for entry in entries:
-            writer.writerow(entry)
+            with io.TextIOWrapper(gzfile, encoding='utf-8', newline='') as csvfile:
+                # Rows end the way COPY ends them, so the file is the same either way
+                writer = csv.writer(csvfile, lineterminator='\n')
+                written = 0
+                for entry in entries.values_list(*fields).iterator(chunk_size=10000):
+                    writer.writerow(entry)
+                    written += 1
+
+    rows = checkpoint['rows'] + written if checkpoint['rows'] is not None else None
+    checkpoint = get_checkpoint(last_entry[0], last_entry[1], rows, filename, member_offset)
+    write_checkpoint(filename, checkpoint)
+
+    return checkpoint
+
+def get_segments_name(filename):
+    return filename[:-len('.csv.gz')] + '-segments'
+
+def get_segment_filenames(filename):
+    return sorted(glob.glob(filename[:-len('.csv.gz')] + '-*.csv.gz'))
+
+def write_segment(filename, fields):
+    """
+    Copies what was added to an entries file since the last segment into a new segment file
+
+    Only segments are uploaded, so each run sends the rows it added instead of
+    the whole year's file again. A segment is the gzip members of those rows,
+    after a header of its own unless it starts the file, so it is a CSV by
+    itself. Returns the segments not yet uploaded, which are removed once they are.
+    """
+    segments = {'offset': 0, 'count': 0}
+    if os.path.exists(get_checkpoint_filename(get_segments_name(filename))):
+        with open(get_checkpoint_filename(get_segments_name(filename))) as file:
+            segments = json.load(file)
+    with open(get_checkpoint_filename(filename)) as file:
+        offset = json.load(file)['offset']
+
+    if offset < segments['offset']:
+        logger.warning('WARNING - %s - Archive found %s shorter than its segments, so all of it is segmented again.' % (
+                       datetime.datetime.utcnow().replace(tzinfo=utc), basename(filename)))
+        segments['offset'] = 0
+    if offset > segments['offset']:
+        segment_filename = '%s-%05d.csv.gz' % (filename[:-len('.csv.gz')], segments['count'])
+        with open(segment_filename + '.tmp', 'wb') as out:
+            if segments['offset']:
+                with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=COMPRESS_LEVEL, mtime=0) as header:
+                    header.write((','.join(fields) + '\n').encode('utf-8'))
+            with open(filename, 'rb') as source:
+                source.seek(segments['offset'])
+                remaining = offset - segments['offset']
+                while remaining:
+                    data = source.read(min(READ_BYTES, remaining))
+                    out.write(data)
+                    remaining -= len(data)
+        os.replace(segment_filename + '.tmp', segment_filename)
+        write_checkpoint(get_segments_name(filename), {'offset': offset, 'count': segments['count'] + 1})
+
+    return get_segment_filenames(filename)
+
+def update_entries_file(filename, io_type, fields, year, checkpoint=None, copy=True):
+    """
+    Writes a year's entries to a gzip file, after those in its checkpoint, and checkpoints it
+
+    Entries are read in (captured_time, id) order from the index on those columns,
+    within [start, end) of the year, in batches that each seek past the last one.
+    Each batch is appended as its own gzip member and checkpointed, so a run only
+    compresses and writes new rows and one that is cut off resumes from its last
+    batch. Decompressing the file gives one CSV. A run stops at the last entry
+    when it started. On PostgreSQL, batches are streamed with COPY unless copy is False.
+    """
+    start = timezone.make_aware(datetime.datetime(year, 1, 1))
+    end = timezone.make_aware(datetime.datetime(year + 1, 1, 1))
+    year_entries = Entry.objects.filter(captured_time__gte=start, captured_time__lt=end)
+    copy = copy and can_copy()
+
+    if io_type == 'w':
+        checkpoint = create_entries_file(filename, fields)
+
+    last_entry = get_rows_after(year_entries, checkpoint).values_list('captured_time', 'id').last()
+    while last_entry:
+        entries = get_rows_after(year_entries, checkpoint)
+        batch_end = list(entries.values_list('captured_time', 'id')[BATCH_ROWS - 1:BATCH_ROWS])
+        batch_end = min(batch_end[0], last_entry) if batch_end else last_entry
+
+        checkpoint = append_entries(filename, get_rows_up_to(entries, batch_end),
+                                    fields, checkpoint, batch_end, copy)
+        if batch_end == last_entry:
+            break
     
-    return None
+    return checkpoint
     
 
+def write_cases_snapshot(zipname):
+    """
+    Writes every case to the cases zip, and checkpoints it with no deltas since
+
+    The zip's comment is the time it was written, in the form delta files are named
+    with, so that deltas it replaces can be told apart wherever it is copied.
+    """
+    # Cases changed while the snapshot is written are in it and in the next delta
+    last_case = Case.objects.order_by('updated_time', 'id').values_list('updated_time', 'id').last()
+    write_zipped_csv(zipname, 'cases.csv', cases_fields,
+                     Case.objects.all().values_list(*cases_fields).iterator(chunk_size=10000),
+                     timezone.now().strftime(DELTA_TIME_FORMAT))
+
+    checkpoint = {'updated_time': last_case[0].isoformat() if last_case else None,
+                  'id': last_case[1] if last_case else None,
+                  'deltas': []}
+    write_checkpoint(zipname, checkpoint)
+
+    return checkpoint
+
+def update_cases_files(feeds_path, compact=False):
+    """
+    Writes cases new or changed since the last run to a delta file, and returns the cases files
+
+    Deltas are read from the (updated_time, id) index after the checkpoint, so a
+    run costs as much as the cases trackcases touched since the last one. Applying
+    the deltas to cases.zip in order, later rows replacing earlier ones with the
+    same id, gives every case. Compacting (or a missing snapshot) writes a new
+    cases.zip instead and removes the deltas it replaces.
+    """
+    zipname = '%s/cases.zip' % feeds_path
+    checkpoint = None
+    if os.path.exists(zipname) and os.path.exists(get_checkpoint_filename(zipname)):
+        with open(get_checkpoint_filename(zipname)) as file:
+            checkpoint = json.load(file)
+
+    if compact or checkpoint is None:
+        write_cases_snapshot(zipname)
+        for delta in checkpoint['deltas'] if checkpoint else []:
+            if os.path.exists('%s/%s' % (feeds_path, delta)):
+                os.remove('%s/%s' % (feeds_path, delta))
+        logger.info('INFO - %s - Archive wrote a new cases snapshot, replacing %s deltas.' % (
+                    datetime.datetime.utcnow().replace(tzinfo=utc),
+                    len(checkpoint['deltas']) if checkpoint else 0))
+        return [zipname]
+
+    cases = get_rows_after(Case.objects.all(), checkpoint, 'updated_time')
+    last_case = cases.values_list('updated_time', 'id').last()
+    if last_case is None:
+        return [zipname] + ['%s/%s' % (feeds_path, delta) for delta in checkpoint['deltas']]
+
+    delta_filename = '%s/cases-%s.csv.gz' % (feeds_path, timezone.now().strftime(DELTA_TIME_FORMAT))
+    with gzip.open(delta_filename + '.tmp', 'wt', compresslevel=COMPRESS_LEVEL,
+                   encoding='utf-8', newline='') as csvfile:
+        writer = csv.writer(csvfile, lineterminator='\n')
+        writer.writerow(cases_delta_fields)
+        for case in get_rows_up_to(cases, last_case, 'updated_time').values_list(
+                                   *cases_delta_fields).iterator(chunk_size=10000):
+            writer.writerow(case)
+    os.replace(delta_filename + '.tmp', delta_filename)
+
+    checkpoint['deltas'].append(basename(delta_filename))
+    write_checkpoint(zipname, {'updated_time': last_case[0].isoformat(),
+                               'id': last_case[1],
+                               'deltas': checkpoint['deltas']})
+
+    return [zipname] + ['%s/%s' % (feeds_path, delta) for delta in checkpoint['deltas']]
+
+def update_parquet_dataset(parquet, path, queryset, schema, dictionary, time_field='captured_time'):
+    """
+    Appends rows saved (or for cases, changed) since a dataset's checkpoint to it as new part files
+
+    Returns the files written. Part files are numbered after the checkpoint they
+    start from, so a run cut off before its checkpoint is written is redone
+    under the same names instead of adding duplicate rows. A dataset written
+    by time_field is partitioned by it too.
+    """
+    checkpoint = {time_field: None, 'id': None, 'part': 0}
+    if os.path.exists(get_checkpoint_filename(path)):
+        with open(get_checkpoint_filename(path)) as file:
+            checkpoint = json.load(file)
+    if time_field not in checkpoint:
+        #Written by another time and with other columns, so it is written again from the start
+        logger.info('INFO - %s - Archive is rewriting %s by %s.' % (
+                    datetime.datetime.utcnow().replace(tzinfo=utc), basename(path), time_field))
+        shutil.rmtree(path, ignore_errors=True)
+        checkpoint = {time_field: None, 'id': None, 'part': 0}
+
+    rows = get_rows_after(queryset, checkpoint, time_field).values_list(*schema.names).iterator(chunk_size=10000)
+    files, last_row = parquet.write_partitioned(path, schema, rows, 'part-%05d.parquet' % checkpoint['part'],
+                                                dictionary, time_field)
+    if last_row:
+        write_checkpoint(path, {time_field: last_row[schema.names.index(time_field)].isoformat(),
+                                'id': str(last_row[0]),
+                                'part': checkpoint['part'] + 1})
+
+    return files
+
+def update_parquet_files(feeds_path):
+    """
+    Writes courts to a Parquet file and appends new cases and entries to Parquet datasets
+
+    Returns the dataset's files, keyed by their path in the archive.
+    """
+    try:
+        from pacertracker import parquet
+    except ImportError:
+        raise CommandError('Archive needs pyarrow to write Parquet files.')
+
+    parquet_path = feeds_path + '/parquet'
+    if not os.path.exists(parquet_path):
+        os.makedirs(parquet_path)
+
+    courts_filename = parquet_path + '/courts.parquet'
+    parquet.write_file(courts_filename, parquet.court_schema,
+                       Court.objects.order_by('id').values_list(*parquet.court_schema.names))
+
+    update_parquet_dataset(parquet, parquet_path + '/cases', Case.objects.all(),
+                           parquet.case_schema, parquet.case_dictionary, 'updated_time')
+    update_parquet_dataset(parquet, parquet_path + '/entries', Entry.objects.all(),
+                           parquet.entry_schema, parquet.entry_dictionary)
+
+    # Every part file, so that any an earlier upload missed are sent again
+    files = [courts_filename]
+    for dataset in ('cases', 'entries'):
+        for root, dirs, names in os.walk(parquet_path + '/' + dataset):
+            files += [os.path.join(root, name) for name in names if name.endswith('.parquet')
+                      and not name.startswith('.')]
+
+    return dict([(os.path.relpath(f, feeds_path), f) for f in files])
+
+def read_archived_time(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as file:
+        captured_time = json.load(file).get('captured_time')
+    return parser.parse(captured_time) if captured_time else None
+
+def get_year_start(year):
+    #As update_entries_file splits entries into years
+    return timezone.make_aware(datetime.datetime(year, 1, 1))
+
+def get_archived_years(feeds_path):
+    """
+    Returns the time up to which each year's entries file holds that year's entries, keyed by year
+
+    A year is only archived to its end once the next year's file has been started,
+    since update_csv_files finishes a year's file before starting the next one.
+    """
+    years = {}
+    for filename in glob.glob(feeds_path + '/*entries.csv.gz'):
+        match = ENTRIES_FILE.match(basename(filename))
+        if match:
+            years[int(match.group(1))] = read_archived_time(get_checkpoint_filename(filename))
+    for year in years:
+        if year + 1 in years:
+            years[year] = get_year_start(year + 1)
+
+    return years
+
+def is_archived(feeds_path, start, end):
+    """
+    Returns whether every entry captured from start until end is archived in each format in use
+
+    For CSV, every year the range spans needs its own file, with a checkpoint at or
+    after the range's end within that year. Entries are archived oldest first,
+    so every one captured before a checkpoint is archived. A format that has never
+    archived an entry is not in use.
+    """
+    years = get_archived_years(feeds_path)
+    parquet_time = read_archived_time(get_checkpoint_filename(feeds_path + '/parquet/entries'))
+    if not years and not parquet_time:
+        return False
+
+    if years:
+        for year in range(timezone.localtime(start).year,
+                          timezone.localtime(end - datetime.timedelta(microseconds=1)).year + 1):
+            archived_until = years.get(year)
+            if archived_until is None or archived_until < min(end, get_year_start(year + 1)):
+                return False
+    if parquet_time and parquet_time < end:
+        return False
+
+    return True
+
+def update_csv_files(feeds_path, copy=True, compact_cases=False):
+    """
+    Writes courts to a zipped CSV and appends new cases and entries to their files
+
+    Returns the files to upload.
+    """
+    # Filename conventions
+    courts_zipname = ('%s/courts.zip' % (feeds_path))
+    entries_filename = ('%s/%sentries.csv.gz' % (feeds_path, datetime.date.today().year))
+    old_entries_filename = ('%s/%sentries.csv.gz' % (feeds_path, datetime.date.today().year -1))
+    
+    # Compress entries files left uncompressed by earlier versions, once
+    for filename in [old_entries_filename, entries_filename]:
+        if os.path.exists(filename[:-3]) and not os.path.exists(filename):
+            convert_legacy_file(filename[:-3], filename)
+    
+    # Create courts file every time, compressing rows as they are read
+    write_zipped_csv(courts_zipname, 'courts.csv', court_fields,
+                     Court.objects.all().values_list(*court_fields).iterator(chunk_size=10000))
+    
+    # Only write the cases changed since the last run, unless compacting
+    cases_filenames = update_cases_files(feeds_path, compact_cases)
+    
+    # If the entries file does not exist for this year, 
+    # check if it exists for the prior year.
+    # If it exists for prior year, make sure the prior file 
+    # has all the entries for that year by using ID and date filters.
+    # Then, create the new file and add to it.
+    # If there is no prior file, just create the new file for this year
+    if not os.path.exists(entries_filename):
+        if not os.path.exists(old_entries_filename): # Old one nonexistent, create current year only
+            update_entries_file(entries_filename, 
+                                'w', 
+                                entries_fields, 
+                                datetime.date.today().year,
+                                copy=copy)
+        else:
+            # If old file exists, first add remaining entries for prior year
+            update_entries_file(old_entries_filename, 
+                                'a', 
+                                entries_fields, 
+                                datetime.date.today().year - 1,
+                                load_checkpoint(old_entries_filename),
+                                copy=copy)
+            
+            # Then, create the file for the new (current) year
+            update_entries_file(entries_filename, 
+                                'w', 
+                                entries_fields, 
+                                datetime.date.today().year,
+                                copy=copy)
+    
+    else: # If file exists, append most recent entries to it...
+        # ...picking up after the last entry in its checkpoint
+        update_entries_file(entries_filename, 
+                            'a', 
+                            entries_fields, 
+                            datetime.date.today().year,
+                            load_checkpoint(entries_filename),
+                            copy=copy)
+    
+    files = [courts_zipname] + cases_filenames + write_segment(entries_filename, entries_fields)
+    if os.path.exists(old_entries_filename):
+        files += write_segment(old_entries_filename, entries_fields)
+    return files
+
 class Command(BaseCommand):
     args = 'No args.'
-    help = 'Send courts, cases and YTD entries to Internet Archive and delete old entries.'
+    help = 'Send courts, cases and YTD entries to Internet Archive.'
     
     def add_arguments(self, parser):
         parser.add_argument(
@@ -103,87 +693,48 @@ class Command(BaseCommand):
             default=False,
             help='Do not upload to the Internet Archive.',
         )
+        parser.add_argument(
+            '--upload-dir',
+            dest='upload_dir',
+            default=None,
+            help='Copy the files to this directory instead of the Internet Archive.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'parquet'],
+            default='csv',
+            help='Write zipped CSVs (the default) or Parquet datasets partitioned by year and month.',
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_false',
+            dest='copy',
+            default=True,
+            help='Export entries through the ORM instead of PostgreSQL\'s COPY.',
+        )
+        parser.add_argument(
+            '--compact-cases',
+            action='store_true',
+            dest='compact_cases',
+            default=False,
+            help='Write all cases to a new cases.zip in place of the deltas since the last one.',
+        )
 
     def handle(self, *args, **options):
         #Used to calculate run time and start time
         time_started = datetime.datetime.utcnow().replace(tzinfo=utc)
         
-        # Get or create the path for storing the CSVs
+        # Get or create the path for storing the archives
         feeds_path = pacertracker.__path__[0].replace('\\','/') + '/archives'
         if not os.path.exists(feeds_path):
             os.makedirs(feeds_path)
 
-        # Filename conventions
-        courts_filename = ('%s/courts.csv' % (feeds_path))
-        cases_filename = ('%s/cases.csv' % (feeds_path))
-        entries_filename = ('%s/%sentries.csv' % (feeds_path, datetime.date.today().year))
-        
-        # Create courts file every time
-        with open(courts_filename, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(court_fields)
-            
-            courts = Court.objects.all().values_list(*court_fields).iterator(chunk_size=10000)
-            
-            for court in courts:
-                writer.writerow(court)
-
-
-        # Create cases file every time
-        with open(cases_filename, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(cases_fields)
-            
-            cases = Case.objects.all().values_list(*cases_fields).iterator(chunk_size=10000)
-            
-            for case in cases:
-                writer.writerow(case)
-        
-        # If the entries file does not exist for this year, 
-        # check if it exists for the prior year.
-        # If it exists for prior year, make sure the prior file 
-        # has all the entries for that year by using ID and date filters.
-        # Then, create the new file and add to it.
-        # If there is no prior file, just create the new file for this year
-        old_file = False # For keeping track of whether there is an old file to be uploaded
-        if not os.path.exists(entries_filename):
-            old_entries_filename = ('%s/%sentries.csv' % (feeds_path, datetime.date.today().year -1))
-            old_file = True
-            
-            if not os.path.exists(old_entries_filename): # Old one nonexistent, create current year only
-                old_file = False
-                update_entries_file(entries_filename, 
-                                    'w', 
-                                    entries_fields, 
-                                    datetime.date.today().year)
-            else:
-                # If old file exists, first add remaining entries for prior year
-                last_time = get_last_line(old_entries_filename, 1).split(',')[2]
-                last_time = parser.parse(last_time, tzinfos=get_tzinfos())
-                
-                update_entries_file(old_entries_filename, 
-                                    'a', 
-                                    entries_fields, 
-                                    filter_from=last_time, 
-                                    filter_to=datetime.date.today().year - 1)
-                
-                # Then, create the file for the new (current) year
-                update_entries_file(entries_filename, 
-                                    'w', 
-                                    entries_fields, 
-                                    datetime.date.today().year)
-        
-        else: # If file exists, append most recent entries to it...
-            # First, get the last ID in the CSV...
-            last_time = get_last_line(entries_filename, 1).split(',')[2]
-            last_time = parser.parse(last_time, tzinfos=get_tzinfos())
-            
-            update_entries_file(entries_filename, 
-                                'a', 
-                                entries_fields, 
-                                filter_from=last_time)
+        if options['format'] == 'parquet':
+            files = update_parquet_files(feeds_path)
+        else:
+            files = update_csv_files(feeds_path, options['copy'], options['compact_cases'])
         
-        # Used for tracking time it takes to create files, zip and then upload
+        # Used for tracking time it takes to create files and then upload
         time_elapsed = datetime.datetime.utcnow().replace(tzinfo=utc) - time_started
         time_elapsed = str(time_elapsed).split(':')
         time_ended = datetime.datetime.utcnow().replace(tzinfo=utc)
@@ -191,51 +742,18 @@ class Command(BaseCommand):
         logger.info('INFO - %s - Archive finished creating files after %s' % ( 
                     time_ended, 
                     time_elapsed[1] + ' minutes and ' + time_elapsed[2] + ' seconds'))
-                    
-                    
-        # ZIP the files for upload
-        # ZIP Filename conventions
-        courts_zipname = ('%s/courts.zip' % (feeds_path))
-        cases_zipname = ('%s/cases.zip' % (feeds_path))
-        entries_zipname = ('%s/%sentries.zip' % (feeds_path, datetime.date.today().year))
-        old_entries_zipname = ('%s/%sentries.zip' % (feeds_path, datetime.date.today().year))
-        
-        
-        with zipfile.ZipFile(courts_zipname, "w", zipfile.ZIP_DEFLATED) as zfile:
-            zfile.write(courts_filename, basename(courts_filename))
-        
-        with zipfile.ZipFile(cases_zipname, "w", zipfile.ZIP_DEFLATED) as zfile:
-            zfile.write(cases_filename, basename(cases_filename))
-        
-        with zipfile.ZipFile(entries_zipname, "w", zipfile.ZIP_DEFLATED) as zfile:
-            zfile.write(entries_filename, basename(entries_filename))
-       
-        if old_file:
-            with zipfile.ZipFile(old_entries_zipname, "w", zipfile.ZIP_DEFLATED) as zfile:
-                zfile.write(old_entries_filename, basename(old_entries_filename))
-            
-        # Used for tracking time it takes to create files, zip and then upload
-        time_elapsed = datetime.datetime.utcnow().replace(tzinfo=utc) - time_started
-        time_elapsed = str(time_elapsed).split(':')
-        time_ended = datetime.datetime.utcnow().replace(tzinfo=utc)
-        
-        logger.info('INFO - %s - Archive finished zipping files after %s' % ( 
-                    time_ended, 
-                    time_elapsed[1] + ' minutes and ' + time_elapsed[2] + ' seconds'))
         
-        # Now, we upload to Internet Archive
-        if old_file and not options['noupload']:
-            r = upload(settings.IA_IDENTIFIER, 
-                       files=[courts_zipname,cases_zipname,entries_zipname,old_entries_zipname], 
-                       access_key=settings.IA_ACCESS_KEY, 
-                       secret_key=settings.IA_SECRET_KEY)
-            r[0].status_code
-        elif not options['noupload']:
-            r = upload(settings.IA_IDENTIFIER, 
-                       files=[courts_zipname,cases_zipname,entries_zipname], 
-                       access_key=settings.IA_ACCESS_KEY, 
-                       secret_key=settings.IA_SECRET_KEY)
-            r[0].status_code
+        # Now, we upload the files that changed since the last upload
+        failed = []
+        if not options['noupload']:
+            manager = UploadManager(get_upload_target(options['upload_dir']), feeds_path + '/uploads.json')
+            uploaded, skipped, failed = manager.upload(files)
+            logger.info('INFO - %s - Archive uploaded %s files and skipped %s unchanged ones.' % (
+                        datetime.datetime.utcnow().replace(tzinfo=utc), len(uploaded), len(skipped)))
+            # The year's entries file holds the same rows, so segments are only kept until they are uploaded
+            for filename in files:
+                if ENTRIES_SEGMENT.match(basename(filename)) and basename(filename) in uploaded:
+                    os.remove(filename)
 
         # Log stuff
         time_elapsed = datetime.datetime.utcnow().replace(tzinfo=utc) - time_started
@@ -245,4 +763,8 @@ class Command(BaseCommand):
         logger.info('INFO - %s - Archive finished uploading after %s' % ( 
                     time_ended, 
                     time_elapsed[1] + ' minutes and ' + time_elapsed[2] + ' seconds'))
+        
+        if failed:
+            raise CommandError('Archive could not upload %s. They will be tried again on the next run.' %
+                               ', '.join(failed))
 
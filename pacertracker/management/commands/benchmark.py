@@ -0,0 +1,685 @@
+import os
+import gzip
+import json
+import shutil
+import asyncio
+import datetime
+import tempfile
+import random
+import timeit
+import logging
+import statistics
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from asgiref.sync import sync_to_async
+from haystack import connections as haystack_connections
+
+from pacertracker import views
+from pacertracker.entryids import get_entry_id, get_legacy_entry_id
+from pacertracker.management.commands import archive
+from pacertracker.livefeed import LiveFeed, POLL_LIMIT, parse_words
+from pacertracker.models import Alert, Court, CourtGroup, Case, Entry, RecentEntry
+from pacertracker.recent import fill_recent_entries, get_recent_cutoff, save_recent_entries
+from pacertracker.search import HaystackCaseSearch, PostgresCaseSearch, get_search_vector
+from pacertracker.search_indexes import CaseIndex
+
+utc = datetime.timezone.utc
+logger = logging.getLogger(__name__)
+
+# Synthetic rows use their own id range and court names so they are easy to remove
+SYNTHETIC_CASE_ID = 900000000000000000
+SYNTHETIC_COURT = 'Synthetic Court'
+
+# Most queries each view may run, no matter how many alerts or groups a user has
+VIEW_QUERY_BUDGET = {
+    'alerts': 4,
+    'groups': 3,
+}
+
+# Sequential scans of the case, entry or recent entry tables may read at most this many rows in a hot query
+SEQ_SCAN_ROWS = 10000
+
+# Words that show up in party names, used to build synthetic case titles
+WORDS = ['acme', 'smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis',
+         'rodriguez', 'martinez', 'hernandez', 'lopez', 'wilson', 'anderson', 'thomas', 'taylor',
+         'moore', 'jackson', 'martin', 'lee', 'thompson', 'white', 'harris', 'clark', 'lewis',
+         'robinson', 'walker', 'young', 'allen', 'king', 'wright', 'scott', 'green', 'baker',
+         'adams', 'nelson', 'hill', 'campbell', 'mitchell', 'roberts', 'carter', 'phillips',
+         'evans', 'turner', 'torres', 'parker', 'collins', 'edwards', 'stewart', 'bank',
+         'insurance', 'county', 'city', 'school', 'district', 'hospital', 'corporation',
+         'company', 'holdings', 'national', 'american', 'first', 'united', 'states', 'america',
+         'department', 'police', 'board', 'education', 'trust', 'financial', 'energy', 'health',
+         'services', 'group', 'partners', 'capital', 'motors', 'airlines', 'pharmaceuticals',
+         'technologies', 'university', 'church', 'union', 'association', 'federal', 'credit',
+         'mortgage', 'properties', 'realty', 'construction', 'transport', 'logistics', 'foods',
+         'restaurants', 'hotels', 'casino', 'oil', 'gas', 'steel', 'chemical', 'retail']
+
+
+def time_it(function, *args, **kwargs):
+    start = timeit.default_timer()
+    function(*args, **kwargs)
+    return timeit.default_timer() - start
+
+
+def summarize(times):
+    """
+    Returns the median and 95th percentile of a list of timings, in milliseconds
+    """
+    times = sorted(times)
+    return (statistics.median(times) * 1000,
+            times[min(len(times) - 1, int(len(times) * .95))] * 1000)
+
+
+def create_synthetic_courts(count):
+    courts = [Court(name='%s %s' % (SYNTHETIC_COURT, i), type='D', website='http://synthetic.invalid/%s/' % i)
+              for i in range(count)]
+    Court.objects.bulk_create(courts)
+
+    return list(Court.objects.filter(name__startswith=SYNTHETIC_COURT).order_by('id'))
+
+
+def create_synthetic_cases(courts, count, days=365):
+    """
+    Inserts synthetic cases spread over the courts and the past few days, server-side
+
+    Titles are made of random words so that keyword searches match a realistic share
+    of cases. Search vectors are filled the same way trackcases fills them.
+    """
+    court_ids = [court.id for court in courts]
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO pacertracker_case (id, court_id, title, number, name, type, website,
+                                           captured_time, updated_time, is_date_filed, search_vector,
+                                           entry_count)
+            SELECT %(start)s + n, c.court_id, c.number || ' ' || c.name, c.number, c.name,
+                   CASE WHEN n %% 3 = 0 THEN '2CR' ELSE '1CV' END,
+                   'https://synthetic.invalid/cgi-bin/DktRpt.pl?' || n,
+                   c.captured_time, c.captured_time + (random() * interval '1 day'), false,
+                   to_tsvector('english', c.number || ' ' || c.name), 0
+            FROM generate_series(1, %(count)s) AS n
+            CROSS JOIN LATERAL (
+                SELECT (%(courts)s::int[])[1 + (n %% %(court_count)s)] AS court_id,
+                       '1:26-' || CASE WHEN n %% 3 = 0 THEN 'cr' ELSE 'cv' END || '-' || n AS number,
+                       initcap((%(words)s::text[])[1 + floor(random() * %(word_count)s)::int] || ' ' ||
+                               (%(words)s::text[])[1 + floor(random() * %(word_count)s)::int] || ' v. ' ||
+                               (%(words)s::text[])[1 + floor(random() * %(word_count)s)::int] || ' ' ||
+                               (%(words)s::text[])[1 + floor(random() * %(word_count)s)::int]) AS name,
+                       now() - (random() * %(days)s * interval '1 day') AS captured_time
+                ) AS c
+            """, {'start': SYNTHETIC_CASE_ID, 'count': count, 'courts': court_ids,
+                  'court_count': len(court_ids), 'words': WORDS, 'word_count': len(WORDS),
+                  'days': days})
+        cursor.execute('ANALYZE pacertracker_case')
+
+
+def delete_synthetic_data():
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM pacertracker_entry WHERE case_id >= %s', [SYNTHETIC_CASE_ID])
+        cursor.execute('DELETE FROM pacertracker_recententry WHERE case_id >= %s', [SYNTHETIC_CASE_ID])
+        cursor.execute('DELETE FROM pacertracker_digest WHERE case_id >= %s', [SYNTHETIC_CASE_ID])
+        cursor.execute('DELETE FROM pacertracker_case WHERE id >= %s', [SYNTHETIC_CASE_ID])
+    Court.objects.filter(name__startswith=SYNTHETIC_COURT).delete()
+
+
+def index_synthetic_cases(using, batch_size=1000):
+    """
+    Adds the synthetic cases to the Haystack index and returns the time it took
+    """
+    backend = haystack_connections[using].get_backend()
+    index = haystack_connections[using].get_unified_index().get_index(Case)
+    cases = Case.objects.filter(id__gte=SYNTHETIC_CASE_ID).select_related('court').order_by('id')
+
+    start = timeit.default_timer()
+    batch = []
+    for case in cases.iterator(chunk_size=batch_size):
+        batch.append(case)
+        if len(batch) == batch_size:
+            backend.update(index, batch)
+            batch = []
+    if batch:
+        backend.update(index, batch)
+
+    return timeit.default_timer() - start
+
+
+def unindex_synthetic_cases(using, courts):
+    backend = haystack_connections[using].get_backend()
+    if hasattr(backend, 'conn'): # Solr, delete by query
+        backend.conn.delete(q='court:(%s)' % ' OR '.join([str(court.id) for court in courts]))
+    else:
+        for case in Case.objects.filter(id__gte=SYNTHETIC_CASE_ID).iterator():
+            backend.remove(case)
+
+
+def bench_search(command, options):
+    """
+    Compares query latency and ingest overhead of the Haystack (Solr) and Postgres case search backends
+    """
+    if connection.vendor != 'postgresql':
+        raise CommandError('The search benchmark needs PostgreSQL.')
+
+    courts = create_synthetic_courts(options['courts'])
+    try:
+        load_time = time_it(create_synthetic_cases, courts, options['cases'])
+        command.stdout.write('Created %s synthetic cases in %.1f seconds.' % (options['cases'], load_time))
+
+        backends = [('postgres', PostgresCaseSearch())]
+        if not options['no_haystack']:
+            index_time = index_synthetic_cases(options['using'])
+            command.stdout.write('Indexed %s synthetic cases with Haystack in %.1f seconds.' % (
+                                 options['cases'], index_time))
+            backends.append(('haystack', HaystackCaseSearch()))
+
+        # Query latency, with the filters sendemails and case_lookup use
+        court_ids = [court.id for court in courts]
+        since = datetime.datetime.utcnow().replace(tzinfo=utc) - datetime.timedelta(days=1)
+        for name, search in backends:
+            random.seed(options['seed'])
+            alert_times, lookup_times = [], []
+            for run in range(options['runs']):
+                alert_courts = random.sample(court_ids, min(5, len(court_ids)))
+                words = random.choice(WORDS)
+                alert_times.append(time_it(search.case_ids, alert_courts, words, '2CR', updated_since=since))
+                alert_times.append(time_it(search.case_ids, alert_courts, '', '', captured_since=since))
+                lookup_times.append(time_it(search.lookup, words, court_ids, '1CV'))
+
+            command.stdout.write('%s: sendemails queries %.1f ms median, %.1f ms p95' % ((name,) + summarize(alert_times)))
+            command.stdout.write('%s: case_lookup queries %.1f ms median, %.1f ms p95' % ((name,) + summarize(lookup_times)))
+
+        # Ingest overhead of a trackcases batch of 500 cases, rolled back afterwards
+        next_id = SYNTHETIC_CASE_ID + options['cases'] + 1
+        plain_times, vector_times, haystack_times = [], [], []
+        for run in range(options['ingest_batches']):
+            for times in (plain_times, vector_times, haystack_times):
+                if times is haystack_times and options['no_haystack']:
+                    continue
+                with transaction.atomic():
+                    cases = [Case(id=next_id + i, court=courts[i % len(courts)], number='1:26-cv-%s' % i,
+                                  name='%s v. %s' % (random.choice(WORDS), random.choice(WORDS)),
+                                  type='1CV', website='https://synthetic.invalid/') for i in range(500)]
+                    for case in cases:
+                        case.title = case.number + ' ' + case.name
+                    start = timeit.default_timer()
+                    Case.objects.bulk_create(cases)
+                    now = datetime.datetime.utcnow().replace(tzinfo=utc)
+                    if times is vector_times:
+                        Case.objects.filter(id__in=[x.id for x in cases]).update(updated_time=now,
+                                                                                  search_vector=get_search_vector())
+                    else:
+                        Case.objects.filter(id__in=[x.id for x in cases]).update(updated_time=now)
+                    if times is haystack_times:
+                        haystack_connections[options['using']].get_backend().update(CaseIndex(), cases)
+                    times.append(timeit.default_timer() - start)
+                    if times is haystack_times:
+                        for case in cases:
+                            haystack_connections[options['using']].get_backend().remove(case)
+                    transaction.set_rollback(True)
+
+        command.stdout.write('Saving 500 cases: %.1f ms median without search, %.1f ms with search vectors%s' % (
+                             summarize(plain_times)[0], summarize(vector_times)[0],
+                             '' if options['no_haystack'] else
+                             ', %.1f ms with Haystack indexing' % summarize(haystack_times)[0]))
+    finally:
+        if not options['keep']:
+            if not options['no_haystack']:
+                unindex_synthetic_cases(options['using'], courts)
+            delete_synthetic_data()
+
+
+def render_view(view, user):
+    """
+    Renders a view for a user and returns the number of queries and the time it took
+    """
+    request = RequestFactory().get('/')
+    request.user = user
+    with CaptureQueriesContext(connection) as queries:
+        start = timeit.default_timer()
+        response = view(request)
+        elapsed = timeit.default_timer() - start
+    if response.status_code != 200:
+        raise CommandError('%s returned status %s.' % (view.__name__, response.status_code))
+
+    return len(queries), elapsed
+
+
+def bench_views(command, options):
+    """
+    Checks that the alerts and groups pages run a constant number of queries as a user's alerts grow
+    """
+    with transaction.atomic():
+        courts = create_synthetic_courts(options['courts'])
+        user = User.objects.create_user('synthetic-benchmark-user', 'synthetic@synthetic.invalid')
+        random.seed(options['seed'])
+
+        for group_number in range(5):
+            group = CourtGroup.objects.create(user=user, name='Group %s' % group_number)
+            group.courts.set(random.sample(courts, min(20, len(courts))))
+
+        results = {}
+        for alert_count in (1, options['alerts']):
+            while Alert.objects.filter(user=user).count() < alert_count:
+                alert = Alert.objects.create(user=user, words=random.choice(WORDS))
+                alert.courts.set(random.sample(courts, min(10, len(courts))))
+
+            for view in (views.alerts, views.groups):
+                render_view(view, user) # Warm up caches, such as the court picker
+                query_counts, times = [], []
+                for run in range(options['view_runs']):
+                    query_count, elapsed = render_view(view, user)
+                    query_counts.append(query_count)
+                    times.append(elapsed)
+                results[(view.__name__, alert_count)] = (max(query_counts), summarize(times)[0])
+                command.stdout.write('%s view with %s alert(s): %s queries, %.1f ms median' % (
+                                     view.__name__, alert_count, max(query_counts), summarize(times)[0]))
+
+        transaction.set_rollback(True)
+
+    for view in (views.alerts, views.groups):
+        query_count = results[(view.__name__, options['alerts'])][0]
+        if query_count > results[(view.__name__, 1)][0]:
+            raise CommandError('%s view queries grow with the number of alerts.' % view.__name__)
+        if query_count > VIEW_QUERY_BUDGET[view.__name__]:
+            raise CommandError('%s view ran %s queries, over its budget of %s.' % (
+                               view.__name__, query_count, VIEW_QUERY_BUDGET[view.__name__]))
+        if results[(view.__name__, options['alerts'])][1] > options['max_ms']:
+            raise CommandError('%s view took %.1f ms, over the limit of %s ms.' % (
+                               view.__name__, results[(view.__name__, options['alerts'])][1], options['max_ms']))
+
+
+def create_synthetic_entries(count):
+    cases = list(Case.objects.filter(id__gte=SYNTHETIC_CASE_ID).order_by('?').only('id', 'court', 'type')[:count])
+    now = datetime.datetime.utcnow().replace(tzinfo=utc)
+    entries = Entry.objects.bulk_create([Entry(case_id=random.choice(cases).id, time_filed=now,
+                                               description='Synthetic entry %s' % i) for i in range(count)])
+    save_recent_entries(entries, dict([(case.id, case) for case in cases]))
+
+
+async def run_live_feed(feed, subscriptions, polls):
+    """
+    Subscribes to a feed until it has polled a number of times, and returns the
+    queries the poller ran and the events delivered
+    """
+    queries = []
+    counter = lambda execute, sql, params, many, context: queries.append(sql) or execute(sql, params, many, context)
+    # The poller's queries run in the thread shared by sync_to_async calls
+    await sync_to_async(lambda: connection.execute_wrappers.append(counter))()
+    try:
+        queues = [feed.subscribe(alerts) for alerts in subscriptions]
+        while feed.polls < polls:
+            await asyncio.sleep(feed.interval)
+        for queue in queues:
+            feed.unsubscribe(queue)
+        await feed.task
+    finally:
+        await sync_to_async(lambda: connection.execute_wrappers.remove(counter))()
+
+    return len(queries), sum([queue.qsize() for queue in queues])
+
+
+def bench_livefeed(command, options):
+    """
+    Checks that the live feed's database load does not grow with the number of subscribers
+    """
+    if connection.vendor != 'postgresql':
+        raise CommandError('The live feed benchmark needs PostgreSQL.')
+
+    courts = create_synthetic_courts(options['courts'])
+    try:
+        create_synthetic_cases(courts, options['cases'], days=30)
+        random.seed(options['seed'])
+        court_ids = [court.id for court in courts]
+
+        results = {}
+        for subscriber_count in (1, 10, 100, options['subscribers']):
+            # Three alerts per subscriber, like a typical user
+            subscriptions = []
+            for subscriber in range(subscriber_count):
+                subscriptions.append([{'id': subscriber * 3 + i, 'words': random.choice(WORDS),
+                                       'courts': set(random.sample(court_ids, min(10, len(court_ids)))),
+                                       'exclude_type': '', 'only_new_cases': False} for i in range(3)])
+                for alert in subscriptions[-1]:
+                    alert['parsed_words'] = parse_words(alert['words'])
+
+            since = datetime.datetime.utcnow().replace(tzinfo=utc)
+            create_synthetic_entries(options['entries'])
+            feed = LiveFeed(interval=.01, since=since, delay=datetime.timedelta(0))
+            start = timeit.default_timer()
+            query_count, events = asyncio.run(run_live_feed(feed, subscriptions, options['runs']))
+            elapsed = timeit.default_timer() - start
+
+            results[subscriber_count] = query_count
+            command.stdout.write('%s subscriber(s): %s queries in %s polls, %s events delivered, %.1f ms per poll' % (
+                                 subscriber_count, query_count, feed.polls, events,
+                                 (elapsed - feed.polls * feed.interval) / feed.polls * 1000))
+    finally:
+        if not options['keep']:
+            delete_synthetic_data()
+
+    if results[options['subscribers']] > results[1]:
+        raise CommandError('Live feed queries grow with the number of subscribers.')
+
+
+def insert_synthetic_entries(count, cases):
+    """
+    Inserts synthetic entries for the synthetic cases, captured since the start of the year, server-side
+
+    Times filed are whole seconds, as they are in court feeds. Some descriptions and
+    websites are empty, and some websites and numbers are NULL, as feeds leave them.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO pacertracker_entry (id, case_id, time_filed, captured_time, description,
+                                            number, website)
+            SELECT md5(random()::text || n)::uuid, %(start)s + 1 + (n %% %(cases)s),
+                   date_trunc('second', time), time,
+                   CASE WHEN n %% 50 = 0 THEN ''
+                        ELSE 'Synthetic entry ' || n || CASE WHEN n %% 10 = 0 THEN ', "quoted"' ELSE '' END END,
+                   CASE WHEN n %% 4 = 0 THEN NULL ELSE n %% 200 END,
+                   CASE WHEN n %% 6 = 0 THEN NULL WHEN n %% 6 = 1 THEN ''
+                        ELSE 'https://synthetic.invalid/doc1/' || n END
+            FROM (SELECT n, date_trunc('year', now()) + random() * (now() - date_trunc('year', now())) AS time
+                  FROM generate_series(1, %(count)s) AS n) AS t
+            """, {'start': SYNTHETIC_CASE_ID, 'cases': cases, 'count': count})
+        cursor.execute('ANALYZE pacertracker_entry')
+    # As trackcases would have saved them
+    fill_recent_entries(get_recent_cutoff())
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE pacertracker_recententry')
+
+
+def read_archive(filename):
+    with gzip.open(filename, 'rb') as file:
+        return file.read()
+
+
+def bench_archive(command, options):
+    """
+    Compares the rows per second archive writes through COPY and through the ORM
+    """
+    if not archive.can_copy():
+        raise CommandError('The archive benchmark needs PostgreSQL.')
+
+    courts = create_synthetic_courts(options['courts'])
+    path = tempfile.mkdtemp()
+    try:
+        create_synthetic_cases(courts, options['cases'])
+        insert_synthetic_entries(options['rows'], options['cases'])
+
+        contents = {}
+        year = datetime.date.today().year
+        for name, copy in (('ORM', False), ('COPY', True)):
+            filename = '%s/%s.csv.gz' % (path, name)
+            start = timeit.default_timer()
+            checkpoint = archive.update_entries_file(filename, 'w', archive.entries_fields, year, copy=copy)
+            elapsed = timeit.default_timer() - start
+            contents[name] = read_archive(filename)
+            command.stdout.write('%-5s %s rows in %.1f s, %.0f rows per second, %.1f MB' % (
+                                 name, checkpoint['rows'], elapsed, checkpoint['rows'] / elapsed,
+                                 os.path.getsize(filename) / 1024.0 / 1024))
+    finally:
+        shutil.rmtree(path)
+        if not options['keep']:
+            delete_synthetic_data()
+
+    # The files are compared byte for byte, so a year's file is the same whichever path wrote it
+    if contents['COPY'] != contents['ORM']:
+        raise CommandError('COPY and the ORM archived different entries.')
+
+
+def get_insert_sql(table, rows):
+    return ('INSERT INTO %s (id, case_id, time_filed, captured_time, description, number, website) VALUES %s' % (
+            table, ', '.join(['(%s::uuid, %s, %s, %s, %s, %s, %s)'] * len(rows))),
+            [value for row in rows for value in row])
+
+
+def bench_entryids(command, options):
+    """
+    Compares saving entries with hashed and with time ordered ids
+
+    Each scheme saves the entries in batches of 500, as trackcases does, and reports
+    how fast that went and how big the primary key grew. Then, after a checkpoint,
+    it reports how many pages saving one more batch dirtied: each is written to disk,
+    and to the WAL in full, so hashed ids, which land on a different page of the
+    primary key each, cost far more I/O once the index no longer fits in memory.
+    """
+    if connection.vendor != 'postgresql':
+        raise CommandError('The entry id benchmark needs PostgreSQL.')
+
+    # Entries filed over the past month, reaching the feeds up to an hour after they were filed
+    random.seed(options['seed'])
+    now = datetime.datetime.utcnow().replace(tzinfo=utc)
+    start = now - datetime.timedelta(days=30)
+    entries = []
+    for n in range(options['rows']):
+        court_id = random.randint(1, options['courts'])
+        case_id = int('%s0%s' % (court_id, random.randint(1, 1000000)))
+        time_filed = (start + datetime.timedelta(days=30) * n / options['rows'] -
+                      datetime.timedelta(seconds=random.randint(0, 3600))).replace(microsecond=0)
+        entries.append((court_id, case_id, 'Synthetic entry %s' % n, n % 200,
+                        'https://synthetic.invalid/doc1/%s' % n, time_filed))
+
+    schemes = [
+        ('hashed', lambda court_id, case_id, description, number, website, time_filed: get_legacy_entry_id(
+            'https://synthetic.invalid/cgi-bin/DktRpt.pl?%s' % case_id, description, number, website, time_filed)),
+        ('time ordered', lambda court_id, case_id, description, number, website, time_filed: get_entry_id(
+            case_id, court_id, description, number, website, time_filed)),
+    ]
+    table = 'synthetic_entry_ids'
+    batch_size, measured_batches = 500, 10
+    for name, get_id in schemes:
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE %s (LIKE pacertracker_entry INCLUDING DEFAULTS)' % table)
+            cursor.execute('ALTER TABLE %s ADD PRIMARY KEY (id)' % table)
+            try:
+                start = timeit.default_timer()
+                rows = [(str(get_id(*entry)), entry[1], entry[5], now, entry[2], entry[3], entry[4])
+                        for entry in entries]
+                saved = len(rows) - batch_size * measured_batches
+                for batch in range(0, saved, batch_size):
+                    cursor.execute(*get_insert_sql(table, rows[batch:min(batch + batch_size, saved)]))
+                elapsed = timeit.default_timer() - start
+
+                dirtied = []
+                for batch in range(saved, len(rows), batch_size):
+                    cursor.execute('CHECKPOINT')
+                    sql, params = get_insert_sql(table, rows[batch:batch + batch_size])
+                    cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+                    result = cursor.fetchone()[0]
+                    result = (json.loads(result) if isinstance(result, str) else result)[0]
+                    dirtied.append(result['Plan'].get('Shared Dirtied Blocks', 0))
+
+                cursor.execute("SELECT pg_relation_size('%s_pkey')" % table)
+                command.stdout.write('%-12s %s rows in %.1f s, %.0f rows per second, primary key %.1f MB, '
+                                     '%.0f pages dirtied per batch' % (
+                                     name, saved, elapsed, saved / elapsed, cursor.fetchone()[0] / 1024.0 / 1024,
+                                     statistics.mean(dirtied)))
+            finally:
+                cursor.execute('DROP TABLE %s' % table)
+
+
+def get_sql(queryset):
+    sql, params = queryset.query.sql_with_params()
+    return sql, list(params)
+
+
+def get_plan_nodes(plan, depth=0):
+    yield depth, plan
+    for child in plan.get('Plans', []):
+        for node in get_plan_nodes(child, depth + 1):
+            yield node
+
+
+def explain(command, name, sql, params):
+    """
+    Runs EXPLAIN ANALYZE on a query, writes its plan and returns whether it read the case,
+    entry or recent entry table sequentially
+
+    The query is rolled back, so updates can be explained too.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+            result = cursor.fetchone()[0]
+        transaction.set_rollback(True)
+    result = (json.loads(result) if isinstance(result, str) else result)[0]
+
+    plan = result['Plan']
+    command.stdout.write('%s: %.1f ms, %s buffers' % (name, result['Execution Time'],
+                         plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0)))
+    seq_scan = False
+    for depth, node in get_plan_nodes(plan):
+        relation = node.get('Relation Name', '')
+        rows = (node['Actual Rows'] + node.get('Rows Removed by Filter', 0)) * node['Actual Loops']
+        if (node['Node Type'] == 'Seq Scan' and rows > SEQ_SCAN_ROWS and
+                relation.startswith((Case._meta.db_table, Entry._meta.db_table, RecentEntry._meta.db_table))):
+            seq_scan = True
+        command.stdout.write('  %s%s%s%s  rows=%s loops=%s' % (
+                             '  ' * depth, node['Node Type'],
+                             ' on %s' % relation if relation else '',
+                             ' using %s' % node['Index Name'] if 'Index Name' in node else '',
+                             node['Actual Rows'], node['Actual Loops']))
+
+    return seq_scan
+
+
+def bench_plans(command, options):
+    """
+    Explains the queries sendemails, trackcases, archive and the live feed run most, on synthetic data
+
+    Fails if any of them reads the case, entry or recent entry table with a large sequential scan.
+    """
+    if connection.vendor != 'postgresql':
+        raise CommandError('The query plan benchmark needs PostgreSQL.')
+
+    courts = create_synthetic_courts(options['courts'])
+    users = []
+    try:
+        create_synthetic_cases(courts, options['cases'], days=30)
+        insert_synthetic_entries(options['rows'], options['cases'])
+        random.seed(options['seed'])
+
+        # Three alerts per user, a third of them live
+        for user_number in range(max(1, options['alerts'] // 3)):
+            users.append(User.objects.create_user('synthetic-benchmark-user-%s' % user_number,
+                                                  'synthetic@synthetic.invalid'))
+        Alert.objects.bulk_create([Alert(user=random.choice(users), words=random.choice(WORDS),
+                                         live_updates=random.random() < .3)
+                                   for alert in range(options['alerts'])])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE pacertracker_alert')
+
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        since = now - datetime.timedelta(hours=1)
+        # Cases with entries since the last check, as an alert would match them
+        case_ids = list(Entry.objects.filter(captured_time__gte=since, case__gte=SYNTHETIC_CASE_ID)
+                        .values_list('case', flat=True).distinct()[:160])
+        if not case_ids:
+            raise CommandError('No synthetic entries were captured in the last hour. Use more --rows.')
+        case = case_ids[0]
+        # As get_alert_matches finds them, through the recent entry table
+        recent = RecentEntry.objects.filter(captured_time__gte=since, case__in=case_ids)
+        entries = Entry.objects.filter(captured_time__gte=since, id__in=recent.values('entry_id'))
+        entry_ids = list(Entry.objects.filter(case__gte=SYNTHETIC_CASE_ID).values_list('id', flat=True)[:500])
+        year_start = datetime.datetime(now.year, 1, 1, tzinfo=utc)
+        checkpoint = {'captured_time': (year_start + (now - year_start) / 2).isoformat(), 'id': str(entry_ids[0])}
+        count_sql, count_params = get_sql(entries.filter(case=case))
+
+        queries = [
+            ('sendemails users', get_sql(Alert.objects.filter(live_updates=True).distinct('user'))),
+            ('sendemails alerts', get_sql(Alert.objects.filter(user=users[0], live_updates=True).order_by('words'))),
+            ('daily sendemails users', get_sql(Alert.objects.filter(live_updates=False).distinct('user'))),
+            ('daily sendemails alerts', get_sql(Alert.objects.filter(user=users[0], live_updates=False)
+                                                .order_by('words'))),
+            ('alert cases', get_sql(Case.objects.filter(id__in=recent.values('case')).order_by('type'))),
+            ('alert new case entries', get_sql(entries)),
+            ('email entry count', ('SELECT COUNT(*) FROM (%s) AS entries' % count_sql, count_params)),
+            ('email entries', get_sql(entries.filter(case=case).order_by('-time_filed')[:25])),
+            ('digest entries', get_sql(entries.order_by('case', '-time_filed').values_list('case', 'id'))),
+            ('trackcases known entries', get_sql(Entry.objects.filter(id__in=entry_ids))),
+            ('trackcases case update', ('UPDATE pacertracker_case SET updated_time = %s, '
+                                        'entry_count = entry_count + 1, last_filed = GREATEST(last_filed, %s), '
+                                        'last_captured = GREATEST(last_captured, %s) WHERE id = ANY(%s)',
+                                        [now, now, now, case_ids])),
+            ('archive entry batch', get_sql(archive.get_rows_after(
+                Entry.objects.filter(captured_time__gte=year_start), checkpoint)
+                .values_list('captured_time', 'id')[archive.BATCH_ROWS - 1:archive.BATCH_ROWS])),
+            ('archive case deltas', get_sql(archive.get_rows_after(
+                Case.objects.filter(id__gte=SYNTHETIC_CASE_ID), {'updated_time': since.isoformat(), 'id': 0},
+                'updated_time').values_list(*archive.cases_delta_fields))),
+            ('live feed poll', get_sql(RecentEntry.objects.filter(captured_time__gte=since, captured_time__lt=now,
+                                                                  court__in=[court.id for court in courts])
+                                       .order_by('captured_time', 'entry_id')
+                                       .values_list('captured_time', 'entry_id')[:POLL_LIMIT])),
+            ('live feed entries', get_sql(Entry.objects.filter(id__in=entry_ids, captured_time__gte=since,
+                                                               captured_time__lt=now)
+                                          .select_related('case__court').order_by('captured_time', 'id'))),
+            ('trim recent entries', ('DELETE FROM pacertracker_recententry WHERE captured_time < %s',
+                                     [get_recent_cutoff(now)])),
+            ('case docket page', get_sql(Entry.objects.filter(case=case).order_by('-time_filed', '-id')
+                                         [:views.BROWSE_PAGE_SIZE + 1])),
+        ]
+        seq_scans = [name for name, (sql, params) in queries if explain(command, name, sql, params)]
+    finally:
+        User.objects.filter(id__in=[user.id for user in users]).delete()
+        if not options['keep']:
+            delete_synthetic_data()
+
+    if seq_scans:
+        raise CommandError('These queries read the case, entry or recent entry table sequentially: %s.' %
+                           ', '.join(seq_scans))
+
+
+BENCHMARKS = {
+    'archive': bench_archive,
+    'entryids': bench_entryids,
+    'livefeed': bench_livefeed,
+    'plans': bench_plans,
+    'search': bench_search,
+    'views': bench_views,
+}
+
+
+class Command(BaseCommand):
+    args = '<benchmark>'
+    help = 'Benchmark PACER Tracker against synthetic data. Do not run during a trackcases run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+        parser.add_argument('--cases', type=int, default=1000000, help='Synthetic cases to create.')
+        parser.add_argument('--courts', type=int, default=200, help='Synthetic courts to create.')
+        parser.add_argument('--runs', type=int, default=200, help='Queries to time per backend.')
+        parser.add_argument('--ingest-batches', type=int, default=20, dest='ingest_batches',
+                            help='Batches of 500 cases to time when measuring ingest overhead.')
+        parser.add_argument('--alerts', type=int, default=100, help='Alerts to give the synthetic user.')
+        parser.add_argument('--view-runs', type=int, default=10, dest='view_runs',
+                            help='Times to render each view.')
+        parser.add_argument('--max-ms', type=float, default=1000, dest='max_ms',
+                            help='Slowest acceptable median render time of a view, in milliseconds.')
+        parser.add_argument('--subscribers', type=int, default=500,
+                            help='Most live feed subscribers to connect at once.')
+        parser.add_argument('--entries', type=int, default=1000,
+                            help='Synthetic entries for the live feed to deliver.')
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Synthetic entries to archive.')
+        parser.add_argument('--using', default='default', help='Haystack connection to use.')
+        parser.add_argument('--no-haystack', action='store_true', dest='no_haystack', default=False,
+                            help='Skip the Haystack (Solr) backend.')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the queries.')
+        parser.add_argument('--keep', action='store_true', default=False,
+                            help='Keep the synthetic data afterwards.')
+
+    def handle(self, *args, **options):
+        time_started = datetime.datetime.utcnow().replace(tzinfo=utc)
+        BENCHMARKS[options['benchmark']](self, options)
+
+        time_elapsed = datetime.datetime.utcnow().replace(tzinfo=utc) - time_started
+        time_elapsed = str(time_elapsed).split(':')
+        logger.info('INFO - %s - Benchmark %s finished after %s' % (
+                    time_started,
+                    options['benchmark'],
+                    time_elapsed[1] + ' minutes and ' + time_elapsed[2] + ' seconds'))
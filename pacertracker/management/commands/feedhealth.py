@@ -0,0 +1,53 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from pacertracker.health import get_percentile, get_success_rate, is_breaker_open, is_failing
+from pacertracker.models import FeedHealth
+
+utc = datetime.timezone.utc
+
+
+def format_time(value):
+    return value.strftime('%Y-%m-%d %H:%M') if value else '-'
+
+
+class Command(BaseCommand):
+    args = 'No args.'
+    help = 'Report the health of each court feed, worst first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failing', action='store_true', default=False,
+                            help='Only report feeds that are failing now.')
+
+    def handle(self, *args, **options):
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        healths = list(FeedHealth.objects.select_related('court').filter(court__has_feed=True))
+        if options['failing']:
+            healths = [h for h in healths if h.consecutive_failures]
+        healths.sort(key=lambda h: (-h.consecutive_failures, get_success_rate(h) or 0))
+
+        row = '%-45s %8s %7s %7s %8s %-16s %-16s %s'
+        self.stdout.write(row % ('Court', 'Success', 'p50 s', 'p95 s', 'Failures',
+                                 'Last good build', 'Next attempt', 'Last error'))
+        for health in healths:
+            success_rate = get_success_rate(health)
+            p50, p95 = get_percentile(health.latencies, 50), get_percentile(health.latencies, 95)
+            if is_breaker_open(health, now):
+                next_attempt = format_time(health.next_attempt)
+            else:
+                next_attempt = 'next run'
+            self.stdout.write(row % (
+                str(health.court)[:45],
+                '-' if success_rate is None else '%.0f%%' % (success_rate * 100),
+                '-' if p50 is None else '%.1f' % p50,
+                '-' if p95 is None else '%.1f' % p95,
+                health.consecutive_failures,
+                format_time(health.last_good_build),
+                next_attempt,
+                health.last_error[:60] if is_failing(health) else ''))
+
+        self.stdout.write('%s feeds, %s failing, %s skipped until their next attempt.' % (
+                          len(healths),
+                          len([h for h in healths if is_failing(h)]),
+                          len([h for h in healths if is_breaker_open(h, now)])))
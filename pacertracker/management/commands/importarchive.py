@@ -0,0 +1,493 @@
+import io
+import os
+import re
+import csv
+import gzip
+import json
+import uuid
+import timeit
+import zipfile
+import datetime
+import logging
+
+from concurrent import futures
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from pacertracker.management.commands.archive import (court_fields, cases_delta_fields, entries_fields,
+                                                      ENTRIES_SEGMENT, can_copy, get_checkpoint_filename,
+                                                      write_checkpoint)
+from pacertracker.models import Court, Case, Entry
+from pacertracker.recent import fill_recent_entries, get_recent_cutoff
+from pacertracker.search import SEARCH_CONFIG, get_search_backend
+
+utc = datetime.timezone.utc
+logger = logging.getLogger(__name__)
+
+#Rows loaded in each transaction, after which the import's progress is saved
+BATCH_ROWS = 50000
+#Invalid rows logged per file, the rest are only counted
+LOGGED_INVALID_ROWS = 10
+
+ENTRIES_FILE = re.compile(r'^(\d{4})entries\.(csv\.gz|zip|csv)$')
+CASES_DELTA_FILE = re.compile(r'^cases-(\d+)\.csv\.gz$')
+
+
+def parse_text(value):
+    return value
+
+
+def parse_int(value):
+    return int(value) if value != '' else None
+
+
+def parse_bool(value):
+    if value in ('True', 'true', 't', '1'):
+        return True
+    if value in ('False', 'false', 'f', '0', ''):
+        return False
+    raise ValueError('%r is not a boolean' % value)
+
+
+def parse_time(value):
+    if value == '':
+        return None
+    value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        raise ValueError('%s has no time zone' % value)
+    return value
+
+
+def parse_uuid(value):
+    return uuid.UUID(value)
+
+
+#How to read each column of the archive's files, and whether it may be empty
+COLUMNS = {
+    'id': parse_int, 'name': parse_text, 'type': parse_text, 'has_feed': parse_bool,
+    'publishes_all': parse_bool, 'filing_types': parse_text, 'feed_url': parse_text,
+    'website': parse_text, 'last_updated': parse_time, 'number': parse_text,
+    'captured_time': parse_time, 'is_date_filed': parse_bool, 'court_id': parse_int,
+    'updated_time': parse_time, 'time_filed': parse_time, 'description': parse_text,
+    'case_id': parse_int,
+}
+NULLABLE = {
+    'courts': ['last_updated'],
+    'cases': ['updated_time'],
+    'entries': ['number', 'website'],
+}
+TABLES = {
+    'courts': (Court, court_fields),
+    'cases': (Case, cases_delta_fields),
+    'entries': (Entry, entries_fields),
+}
+#Rows whose parent is not in the database are left out
+PARENTS = {
+    'cases': (Court, 'court_id'),
+    'entries': (Case, 'case_id'),
+}
+
+
+def get_parser(kind, column):
+    if kind == 'entries' and column == 'id':
+        return parse_uuid
+    if kind == 'entries' and column == 'number':
+        return parse_int
+    return COLUMNS[column]
+
+
+def get_snapshot_time(filename):
+    """
+    Returns the time the cases snapshot was written, from its comment, or '' if it does not say
+    """
+    with zipfile.ZipFile(filename) as zfile:
+        comment = zfile.comment.decode('utf-8', 'replace')
+    return comment if comment.isdigit() else ''
+
+
+def find_archive_files(path):
+    """
+    Returns the files of an archive in the order they are loaded, as (kind, filename) pairs
+
+    Courts come first, then the cases snapshot and its deltas, then each year's entries.
+    Deltas written before the snapshot, which it replaces, are left out. A year's entries
+    are read from its uploaded segments, in order, unless the directory is the one
+    archive writes to, which holds the whole year's file and its checkpoint.
+    """
+    names = set(os.listdir(path))
+    files = []
+    for kind, choices in (('courts', ['courts.zip', 'courts.csv']), ('cases', ['cases.zip', 'cases.csv'])):
+        found = [name for name in choices if name in names]
+        if found:
+            files.append((kind, found[0]))
+    snapshot_time = get_snapshot_time(os.path.join(path, 'cases.zip')) if 'cases.zip' in names else ''
+    files += [('cases', name) for name in sorted(names) if CASES_DELTA_FILE.match(name)
+              and CASES_DELTA_FILE.match(name).group(1) > snapshot_time]
+
+    #Entries written by different versions of archive, newest format first
+    years, segments = {}, {}
+    for name in names:
+        match = ENTRIES_FILE.match(name)
+        if match:
+            years.setdefault(match.group(1), []).append(name)
+        match = ENTRIES_SEGMENT.match(name)
+        if match:
+            segments.setdefault(match.group(1), []).append(name)
+    for year in sorted(set(years) | set(segments)):
+        whole = sorted(years.get(year, []), key=lambda n: ['csv.gz', 'zip', 'csv'].index(
+                                                    ENTRIES_FILE.match(n).group(2)))
+        if year in segments and not (whole and get_checkpoint_filename(whole[0]) in names):
+            files += [('entries', name) for name in sorted(segments[year],
+                                                           key=lambda n: int(ENTRIES_SEGMENT.match(n).group(2)))]
+        else:
+            files.append(('entries', whole[0]))
+
+    return [(kind, os.path.join(path, name)) for kind, name in files]
+
+
+def open_archive_file(filename):
+    """
+    Opens a CSV from the archive as text, whether it is zipped, gzipped or not
+    """
+    if filename.endswith('.zip'):
+        zfile = zipfile.ZipFile(filename)
+        names = [name for name in zfile.namelist() if name.endswith('.csv')]
+        if len(names) != 1:
+            raise CommandError('Importarchive expected one CSV in %s.' % filename)
+        return io.TextIOWrapper(zfile.open(names[0]), encoding='utf-8', newline='')
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', encoding='utf-8', newline='')
+
+    return open(filename, encoding='utf-8', newline='')
+
+
+def read_rows(filename, kind, skip=0):
+    """
+    Yields each row of an archive file, after skipping some, as a tuple of values
+
+    Rows that are not valid are logged and yielded as None, so that every row is counted.
+    """
+    fields = TABLES[kind][1]
+    with open_archive_file(filename) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, [])
+        missing = [f for f in fields if f not in header and f not in NULLABLE[kind]]
+        if missing:
+            raise CommandError('Importarchive found no %s column in %s.' % (', '.join(missing), filename))
+        columns = [(header.index(f) if f in header else None, get_parser(kind, f), f in NULLABLE[kind])
+                   for f in fields]
+
+        invalid = 0
+        for line, row in enumerate(reader, 2):
+            if line - 2 < skip:
+                continue
+            try:
+                values = []
+                for index, parse, nullable in columns:
+                    value = parse(row[index]) if index is not None else None
+                    if value is None and not nullable:
+                        raise ValueError('a required value is empty')
+                    values.append(value)
+                yield tuple(values)
+            except (ValueError, IndexError) as e:
+                invalid += 1
+                if invalid <= LOGGED_INVALID_ROWS:
+                    logger.warning('WARNING - %s - Importarchive skipped line %s of %s - %s' % (
+                                   datetime.datetime.utcnow().replace(tzinfo=utc),
+                                   line, os.path.basename(filename), e))
+                yield None
+
+
+class CopyLoader(object):
+    """
+    Loads batches of rows on PostgreSQL with COPY into a temporary table and one INSERT
+
+    Cases and courts already in the database are updated and entries already in
+    it are left out, as are cases and entries whose court or case is missing.
+    The foreign keys Django creates are deferred to the end of each batch's
+    transaction.
+    """
+    def __init__(self, kind):
+        self.kind = kind
+        model, self.fields = TABLES[kind]
+        self.table = connection.ops.quote_name(model._meta.db_table)
+        self.staging = connection.ops.quote_name('import_' + model._meta.db_table)
+        columns = ', '.join(self.fields)
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS %s' % self.staging)
+            cursor.execute('CREATE TEMPORARY TABLE %s ON COMMIT DELETE ROWS AS SELECT %s FROM %s WITH NO DATA' % (
+                           self.staging, columns, self.table))
+
+        # Empty text is text, not NULL, in the columns that can not be NULL
+        not_null = [f for f in self.fields if get_parser(kind, f) is parse_text and f not in NULLABLE[kind]]
+        self.copy_sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (%s))' % (
+                        self.staging, columns, ', '.join(not_null))
+        self.insert_sql = self.get_insert_sql()
+
+    def get_insert_sql(self):
+        columns = ', '.join(self.fields)
+        where = ''
+        if self.kind in PARENTS:
+            parent, field = PARENTS[self.kind]
+            where = ' WHERE EXISTS (SELECT 1 FROM %s p WHERE p.id = s.%s)' % (
+                    connection.ops.quote_name(parent._meta.db_table), field)
+        if self.kind == 'entries':
+            # A partitioned entry table's key also has the capture time, so any conflict will do
+            return 'INSERT INTO %s (%s) SELECT %s FROM %s s%s ON CONFLICT DO NOTHING' % (
+                   self.table, columns, columns, self.staging, where)
+
+        select = columns
+        insert_columns = list(self.fields)
+        if self.kind == 'cases':
+            # Titles are a case's number and name, and snapshots have no updated time
+            insert_columns += ['title', 'search_vector']
+            select = (', '.join([f for f in self.fields if f != 'updated_time']) +
+                      ", COALESCE(updated_time, captured_time), number || ' ' || name, "
+                      "to_tsvector('%s', number || ' ' || name)" % SEARCH_CONFIG)
+        updates = ', '.join(['%s = EXCLUDED.%s' % (f, f) for f in insert_columns if f != 'id'])
+        if self.kind == 'cases':
+            # New cases start with no entries, and existing ones keep their counts
+            insert_columns.append('entry_count')
+            select += ', 0'
+
+        # The same row can not be updated twice by one INSERT
+        return ('INSERT INTO %s (%s) SELECT DISTINCT ON (id) %s FROM %s s%s ORDER BY id '
+                'ON CONFLICT (id) DO UPDATE SET %s' % (
+                self.table, ', '.join(insert_columns), select, self.staging, where, updates))
+
+    def load(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        for row in rows:
+            writer.writerow(['' if value is None else {True: 't', False: 'f'}.get(value, value)
+                             if isinstance(value, bool) else value for value in row])
+        buffer.seek(0)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.copy_expert(self.copy_sql, buffer)
+            cursor.execute(self.insert_sql)
+            return cursor.rowcount
+
+
+class ModelLoader(object):
+    """
+    Loads batches of rows with the ORM, on databases without COPY
+    """
+    def __init__(self, kind):
+        self.kind = kind
+        self.model, self.fields = TABLES[kind]
+
+    def load(self, rows):
+        objects = [self.model(**dict(zip(self.fields, row))) for row in rows]
+        with transaction.atomic():
+            if self.kind in PARENTS:
+                parent, field = PARENTS[self.kind]
+                parent_ids = set(parent.objects.filter(id__in=set([getattr(o, field) for o in objects]))
+                                 .values_list('id', flat=True))
+                objects = [o for o in objects if getattr(o, field) in parent_ids]
+            if self.kind == 'entries':
+                self.model.objects.bulk_create(objects, ignore_conflicts=True)
+                return len(objects)
+
+            objects = list(dict([(o.id, o) for o in objects]).values())
+            if self.kind == 'cases':
+                for case in objects:
+                    case.title = case.number + ' ' + case.name
+                    case.updated_time = case.updated_time or case.captured_time
+            existing = set(self.model.objects.filter(id__in=[o.id for o in objects])
+                           .values_list('id', flat=True))
+            update_fields = [f for f in self.fields if f not in ('id', 'updated_time')]
+            if self.kind == 'cases':
+                update_fields.append('title')
+            self.model.objects.bulk_update([o for o in objects if o.id in existing], update_fields)
+            self.model.objects.bulk_create([o for o in objects if o.id not in existing])
+
+        return len(objects)
+
+
+def import_file(kind, filename, loader, state, save_progress):
+    """
+    Loads an archive file in batches from where an earlier import stopped, saving progress after each
+    """
+    start = timeit.default_timer()
+    read, loaded, invalid = 0, 0, 0
+    batch, consumed = [], 0
+    for row in read_rows(filename, kind, state['rows']):
+        consumed += 1
+        if row is None:
+            invalid += 1
+        else:
+            batch.append(row)
+        if consumed >= BATCH_ROWS:
+            loaded += loader.load(batch) if batch else 0
+            state['rows'] += consumed
+            read += consumed
+            save_progress()
+            batch, consumed = [], 0
+
+    loaded += loader.load(batch) if batch else 0
+    state['rows'] += consumed
+    read += consumed
+    state['done'] = True
+    save_progress()
+
+    elapsed = timeit.default_timer() - start
+    logger.info('INFO - %s - Importarchive loaded %s of %s rows from %s (%s not valid) in %.1f seconds, '
+                '%.0f rows per second.' % (datetime.datetime.utcnow().replace(tzinfo=utc),
+                loaded, read, os.path.basename(filename), invalid, elapsed, read / elapsed if elapsed else 0))
+
+    return read, loaded
+
+
+def drop_secondary_indexes(tables):
+    """
+    Drops the indexes of tables that no constraint uses, and returns the statements to rebuild them
+
+    The index of a table partitioned by partitionentries is defined ON ONLY the table,
+    which would leave it invalid and its partitions unindexed, so it is rebuilt on all of them.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT i.indexname, i.indexdef FROM pg_indexes i
+            WHERE i.schemaname = current_schema() AND i.tablename = ANY(%s)
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint c
+                            WHERE c.conindid = (quote_ident(i.schemaname) || '.' || quote_ident(i.indexname))::regclass)
+            """, [tables])
+        indexes = cursor.fetchall()
+        for name, definition in indexes:
+            cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+
+    return [definition.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1).replace(' ON ONLY ', ' ON ', 1)
+            for name, definition in indexes]
+
+
+def run_in_thread(function, *args):
+    """
+    Runs a function on its own database connection, returning how long it took
+    """
+    start = timeit.default_timer()
+    try:
+        function(*args)
+    finally:
+        connection.close()
+
+    return timeit.default_timer() - start
+
+
+def refresh_case_activity():
+    """
+    Counts the entries of every case again, along with when the last of them was filed and saved
+    """
+    entries = Entry.objects.filter(case=OuterRef('pk')).order_by().values('case')
+    Case.objects.update(
+        entry_count=Coalesce(Subquery(entries.annotate(count=Count('id')).values('count'),
+                                      output_field=IntegerField()), 0),
+        last_filed=Subquery(entries.annotate(last=Max('time_filed')).values('last')),
+        last_captured=Subquery(entries.annotate(last=Max('captured_time')).values('last')))
+
+
+def create_index(definition):
+    with connection.cursor() as cursor:
+        cursor.execute(definition)
+
+
+def rebuild_indexes(definitions, workers, search_index):
+    """
+    Rebuilds dropped indexes, and the case search index, at the same time
+    """
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        jobs = dict([(executor.submit(run_in_thread, create_index, d), d) for d in definitions])
+        if search_index:
+            jobs[executor.submit(run_in_thread, get_search_backend().update_index,
+                                 datetime.datetime(1970, 1, 1, tzinfo=utc))] = 'the case search index'
+        for job in futures.as_completed(jobs):
+            logger.info('INFO - %s - Importarchive rebuilt %s in %.1f seconds.' % (
+                        datetime.datetime.utcnow().replace(tzinfo=utc), jobs[job], job.result()))
+
+
+class Command(BaseCommand):
+    args = '<path>'
+    help = 'Load the courts, cases and entries in a directory of archive files into the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Directory holding the files written by archive.')
+        parser.add_argument('--restart', action='store_true', default=False,
+                            help='Ignore the progress of an earlier import of the same directory.')
+        parser.add_argument('--keep-indexes', action='store_true', dest='keep_indexes', default=False,
+                            help='Do not drop indexes while loading, even into empty tables.')
+        parser.add_argument('--no-search-index', action='store_false', dest='search_index', default=True,
+                            help='Do not rebuild the case search index afterwards.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Indexes rebuilt at the same time.')
+
+    def handle(self, *args, **options):
+        time_started = datetime.datetime.utcnow().replace(tzinfo=utc)
+        start = timeit.default_timer()
+        path = options['path']
+        if not os.path.isdir(path):
+            raise CommandError('Importarchive could not find the directory %s.' % path)
+        files = find_archive_files(path)
+        if not files:
+            raise CommandError('Importarchive found no archive files in %s.' % path)
+
+        #The progress file lets an interrupted import pick up where it stopped
+        progress_name = os.path.join(path, 'importarchive')
+        progress = {'files': {}, 'indexes': None, 'activity': False}
+        if os.path.exists(get_checkpoint_filename(progress_name)) and not options['restart']:
+            with open(get_checkpoint_filename(progress_name)) as file:
+                progress = json.load(file)
+        save_progress = lambda: write_checkpoint(progress_name, progress)
+
+        use_copy = can_copy()
+        #Loading into empty tables is much faster without their indexes
+        if progress['indexes'] is None:
+            progress['indexes'] = []
+            if use_copy and not options['keep_indexes'] and not Case.objects.exists():
+                progress['indexes'] = drop_secondary_indexes([Case._meta.db_table, Entry._meta.db_table])
+            save_progress()
+
+        total_read, total_loaded = 0, 0
+        for kind, filename in files:
+            state = progress['files'].setdefault(os.path.basename(filename), {'rows': 0, 'done': False})
+            if state['done']:
+                continue
+            loader = CopyLoader(kind) if use_copy else ModelLoader(kind)
+            if kind == 'entries' and not progress.get('activity'):
+                #Remembered until the cases are counted again, in case the import stops before then
+                progress['activity'] = True
+                save_progress()
+            read, loaded = import_file(kind, filename, loader, state, save_progress)
+            total_read += read
+            total_loaded += loaded
+
+            if kind == 'courts':
+                with connection.cursor() as cursor:
+                    for sql in connection.ops.sequence_reset_sql(no_style(), [Court]):
+                        cursor.execute(sql)
+
+        load_time = timeit.default_timer() - start
+        rebuild_indexes(progress['indexes'], options['workers'], options['search_index'])
+        progress['indexes'] = []
+        save_progress()
+
+        #Trackcases keeps the cases' entry counts and the recent entries up to date, but loaded entries skip it
+        if progress.get('activity'):
+            refresh_case_activity()
+            fill_recent_entries(get_recent_cutoff())
+            progress['activity'] = False
+            save_progress()
+
+        if use_copy:
+            with connection.cursor() as cursor:
+                for model in (Court, Case, Entry):
+                    cursor.execute('ANALYZE %s' % connection.ops.quote_name(model._meta.db_table))
+
+        time_elapsed = datetime.datetime.utcnow().replace(tzinfo=utc) - time_started
+        time_elapsed = str(time_elapsed).split(':')
+        logger.info('INFO - %s - Importarchive loaded %s of %s rows at %.0f rows per second, and finished after %s' % (
+                    time_started, total_loaded, total_read, total_read / load_time if load_time else 0,
+                    time_elapsed[1] + ' minutes and ' + time_elapsed[2] + ' seconds'))
@@ -5,20 +5,31 @@ import datetime
 import logging
 import json
 
-from bs4 import BeautifulSoup
 from concurrent import futures
+from lxml import etree
 from timeit import default_timer as timer
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
-from pacertracker.models import Court
+from pacertracker.health import get_feed_health, is_failing
+from pacertracker.models import Court, FeedHealth
+from pacertracker.widgets import invalidate_court_picker
 
 utc = datetime.timezone.utc
 logger = logging.getLogger(__name__)
 
+# Feeds are probed by reading their channel header only, at most this many bytes of it
+PROBE_BYTES = 64 * 1024
+PROBE_CHUNK = 4096
+# Most bytes read past the header so its connection can be reused, beyond which it is dropped
+DRAIN_BYTES = 64 * 1024
+# Probing threads, which share one pool of connections
+PROBE_THREADS = 15
+
 def get_type(raw_name, ecf_url):
     if 'Supreme Court' in raw_name:
         type = 'S'
@@ -62,6 +73,7 @@ def requests_retry_session(
     retries=3,
     backoff_factor=0.1,
     session=None,
+    pool_size=10,
 ):
     # https://urllib3.readthedocs.io/en/latest/reference/urllib3.util.html
     # https://www.peterbe.com/plog/best-practice-with-retries-with-requests
@@ -72,37 +84,96 @@ def requests_retry_session(
         connect=retries,
         backoff_factor=backoff_factor,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_size)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     
     return session
     
-def check_feed(json_check, feed_url):
+def read_feed_header(response):
+    """
+    Parses a streamed feed only as far as its channel's title and description
+
+    Returns a dict saying whether there was a channel and holding the title and
+    description text, which are None if they were not found. Reading stops at the
+    first item or after PROBE_BYTES, so the rest of the feed is never downloaded.
+    """
+    header = {'channel': False, 'title': None, 'description': None}
+    parser = etree.XMLPullParser(events=('start', 'end'), recover=True)
+    path = []
+    bytes_read = 0
+    for chunk in response.iter_content(chunk_size=PROBE_CHUNK):
+        bytes_read += len(chunk)
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            name = etree.QName(element).localname
+            if event == 'start':
+                path.append(name)
+                if name == 'channel':
+                    header['channel'] = True
+                elif name == 'item':
+                    return header
+            else:
+                path.pop()
+                # The first title anywhere counts, as in an HTML error page
+                if name == 'title' and header['title'] is None:
+                    header['title'] = element.text or ''
+                elif name == 'description' and path and path[-1] == 'channel':
+                    header['description'] = element.text or ''
+                if header['channel'] and header['title'] is not None and header['description'] is not None:
+                    return header
+        if bytes_read >= PROBE_BYTES:
+            break
+
+    return header
+
+def drain_response(response):
+    """
+    Reads what is left of a response, up to DRAIN_BYTES, and returns whether it was all read
+
+    A response read to the end hands its connection back to the pool when it is
+    closed. One closed part way has its connection dropped, which is cheaper than
+    downloading the rest of a large feed.
+    """
+    bytes_read = 0
+    while bytes_read < DRAIN_BYTES:
+        data = response.raw.read(PROBE_CHUNK, decode_content=False)
+        if not data:
+            return True
+        bytes_read += len(data)
+
+    return False
+
+def check_feed(json_check, feed_url, session):
     if feed_url != '':
-        # Try to download the feed and see if it has entries
+        # Try to download the start of the feed and see if it is configured
         try:
-            response = requests_retry_session().get(
+            response = session.get(
                 feed_url,
                 verify=False,
-                timeout=5
+                timeout=5,
+                stream=True
             )
-            feed = BeautifulSoup(response.content, "lxml-xml")
+            try:
+                feed = read_feed_header(response)
+                drain_response(response)
+            finally:
+                response.close()
         except requests.exceptions.ConnectionError as e:
             # Max Retries Exceeded
             feed = None
 
-        if feed and (not feed.channel or not feed.title or '404' in feed.title.text):
+        if feed and (not feed['channel'] or feed['title'] is None or '404' in feed['title']):
             feed_check = False
             publishes_all = False
             filing_types = ''
-        elif feed and feed.channel.description and 'not configured' in feed.channel.description.text:
+        elif feed and feed['description'] and 'not configured' in feed['description']:
             feed_check = False
             publishes_all = False
             filing_types = ''
-        elif feed and feed.channel.description:
+        elif feed and feed['description']:
             feed_check = True
-            filing_types = feed.channel.description.text
+            filing_types = feed['description']
             
             if (len(filing_types) > 24 and 'all' in filing_types[24:].lower()
                 and 'entries of type' in filing_types):
@@ -138,15 +209,24 @@ def check_feed(json_check, feed_url):
 
     return feed_check, publishes_all, filing_types
     
-def update_court(metadata):
-    raw_name = metadata['title']
-    if 'Supreme Court' in raw_name:
+def get_base_ecf_url(metadata):
+    if 'Supreme Court' in metadata['title']:
         # Supreme Court has no base_ecf_url so we just give it a fake one...
-        base_ecf_url = 'https://ecf.supremecourt.gov/'
-    else:
-        base_ecf_url = metadata['login_url']
-        if base_ecf_url[-1] != '/':
-            base_ecf_url += '/'
+        return 'https://ecf.supremecourt.gov/'
+    base_ecf_url = metadata['login_url']
+    if base_ecf_url[-1] != '/':
+        base_ecf_url += '/'
+    return base_ecf_url
+
+def get_website(base_ecf_url):
+    return base_ecf_url.replace('https://ecf','http://www')
+
+def probe_court(metadata, session):
+    """
+    Returns what a court's metadata and feed say about it, without touching the database
+    """
+    raw_name = metadata['title']
+    base_ecf_url = get_base_ecf_url(metadata)
     
     type = get_type(raw_name, base_ecf_url)
     
@@ -176,67 +256,114 @@ def update_court(metadata):
     else:
         feed_url = ''
     
-    has_feed, publishes_all, filing_types = check_feed(json_check, feed_url)
-    
-    website = base_ecf_url.replace('https://ecf','http://www')
+    has_feed, publishes_all, filing_types = check_feed(json_check, feed_url, session)
     
-    court_check = Court.objects.filter(website=website)
+    website = get_website(base_ecf_url)
     
-    if court_check.exists() and court_check.count() == 1:
-        if has_feed and not court_check[0].has_feed and 'nyed' not in feed_url:
-            info_msg = 'INFO - %s - Loadcourts found this court now has a feed: %s - %s.'
-            info_msg = (info_msg % (datetime.datetime.utcnow().replace(tzinfo=utc),
-                         name,
-                         court_check[0].get_type_display()
-                         ))
-            logger.info(info_msg)
-            
-        elif not has_feed and court_check[0].has_feed and 'nyed' not in feed_url: # See below about NYED
-            warning_msg = 'WARNING - %s - Loadcourts found this court no longer has a feed: %s - %s.'
-            warning_msg = (warning_msg % (datetime.datetime.utcnow().replace(tzinfo=utc),
-                         name,
-                         court_check[0].get_type_display()
-                         ))
-            logger.warning(warning_msg)
-        
-        # New York Eastern District Court has a different feed URL from all other courts
-        # https://ecf.nyed.uscourts.gov/cgi-bin/readyDockets.pl
-        # As such, we use the below code to overwrite the above checks
-        if 'nyed' not in feed_url: # This ensures the NYED keeps its fancy one-off URL
-            court_check.update(name=name, type=type, has_feed=has_feed, feed_url=feed_url, website=website,
-                                publishes_all=publishes_all, filing_types=filing_types)
-            
-    else:
-        #To ensure all entries from current RSS files are retrieved when first scraped for new courts,
-        #we set the last_updated to one year ago (roughly).
-        last_updated = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc) - datetime.timedelta(days=365)
-        court, new = Court.objects.get_or_create(name=name, type=type, 
-                    has_feed=has_feed, feed_url=feed_url, website=website,
-                    last_updated=last_updated, publishes_all=publishes_all, 
-                    filing_types=filing_types)
-        if not new:
-            info_msg = 'INFO - %s - Loadcourts found this court was already entered, possibly more than once: %s - %s.'
-            info_msg = (info_msg % (datetime.datetime.utcnow().replace(tzinfo=utc),
-                         type,
-                         name
-                         ))
-            logger.info(info_msg)
-        elif new and not has_feed:
-            info_msg = 'INFO - %s - Loadcourts added this court, but it has no feed: %s - %s.'
-            info_msg = (info_msg % (datetime.datetime.utcnow().replace(tzinfo=utc),
-                         type,
-                         name
-                         ))
-            logger.info(info_msg)
+    return {'name': name, 'type': type, 'has_feed': has_feed, 'feed_url': feed_url,
+            'website': website, 'publishes_all': publishes_all, 'filing_types': filing_types}
+
+def log_court(level, message, court):
+    message = '%s - %s - Loadcourts ' + message + ': %s - %s.'
+    getattr(logger, level.lower())(message % (level,
+                                               datetime.datetime.utcnow().replace(tzinfo=utc),
+                                               court.name,
+                                               court.get_type_display()))
+
+def update_courts(probes):
+    """
+    Applies the probe results to the courts in one transaction and returns the number added and changed
+
+    All courts are loaded at once and compared in memory, so only courts that
+    actually changed are written.
+    """
+    courts = {}
+    for court in Court.objects.all():
+        courts.setdefault(court.website, []).append(court)
+    healths = dict([(h.court_id, h) for h in FeedHealth.objects.all()])
+
+    courts_to_create, courts_to_update = [], []
+    fields_changed = set()
+    seen = set()
+    for probe in probes:
+        website = probe['website']
+        court_check = courts.get(website, [])
+
+        if website in seen or len(court_check) > 1:
+            log_court('INFO', 'found this court was already entered, possibly more than once',
+                      Court(**probe))
+            continue
+        seen.add(website)
+
+        if court_check:
+            court = court_check[0]
+            if probe['has_feed'] and not court.has_feed and 'nyed' not in probe['feed_url']:
+                log_court('INFO', 'found this court now has a feed', court)
+            elif (not probe['has_feed'] and court.has_feed and court.id in healths
+                  and not is_failing(healths[court.id])):
+                # One failed probe is not enough to drop a feed trackcases has been reading
+                log_court('INFO', 'kept the feed of this court, which failed a probe but not trackcases', court)
+                probe = dict(probe, has_feed=True, publishes_all=court.publishes_all,
+                             filing_types=court.filing_types)
+            elif not probe['has_feed'] and court.has_feed and 'nyed' not in probe['feed_url']: # See below about NYED
+                log_court('WARNING', 'found this court no longer has a feed', court)
+
+            # New York Eastern District Court has a different feed URL from all other courts
+            # https://ecf.nyed.uscourts.gov/cgi-bin/readyDockets.pl
+            # As such, we use the below code to overwrite the above checks
+            if 'nyed' in probe['feed_url']: # This ensures the NYED keeps its fancy one-off URL
+                continue
+
+            changes = []
+            for field, value in probe.items():
+                if getattr(court, field) != value:
+                    changes.append('%s %r -> %r' % (field, getattr(court, field), value))
+                    setattr(court, field, value)
+                    fields_changed.add(field)
+            if changes:
+                courts_to_update.append(court)
+                logger.info('INFO - %s - Loadcourts changed %s - %s: %s.' % (
+                            datetime.datetime.utcnow().replace(tzinfo=utc),
+                            court.name,
+                            court.get_type_display(),
+                            ', '.join(changes)))
         else:
-            info_msg = 'INFO - %s - Loadcourts added this court: %s - %s.'
-            info_msg = (info_msg % (datetime.datetime.utcnow().replace(tzinfo=utc),
-                         type,
-                         name
-                         ))
-            logger.info(info_msg)
-    
-    return None
+            #To ensure all entries from current RSS files are retrieved when first scraped for new courts,
+            #we set the last_updated to one year ago (roughly).
+            last_updated = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc) - datetime.timedelta(days=365)
+            court = Court(last_updated=last_updated, **probe)
+            courts_to_create.append(court)
+            if not court.has_feed:
+                log_court('INFO', 'added this court, but it has no feed', court)
+            else:
+                log_court('INFO', 'added this court', court)
+
+    with transaction.atomic():
+        Court.objects.bulk_create(courts_to_create)
+        if courts_to_update:
+            Court.objects.bulk_update(courts_to_update, sorted(fields_changed))
+
+    return len(courts_to_create), len(courts_to_update)
+
+def record_probe_failures(failures, now):
+    """
+    Notes the error of each known court whose probe failed in its feed health
+
+    Only the error and its time are kept, so a failed probe does not count
+    towards backing off a feed that trackcases is still reading.
+    """
+    errors = {}
+    for metadata, error in failures:
+        try:
+            errors[get_website(get_base_ecf_url(metadata))] = error
+        except (KeyError, IndexError, TypeError):
+            continue # Not enough metadata to tell which court it is
+    courts = list(Court.objects.filter(website__in=errors))
+    healths = get_feed_health(courts)
+    for court in courts:
+        healths[court.id].last_failure = now
+        healths[court.id].last_error = ('Loadcourts probe failed. - %s' % errors[court.website])[:500]
+    FeedHealth.objects.bulk_update(list(healths.values()), ['last_failure', 'last_error'])
 
 
 class Command(BaseCommand):
@@ -252,20 +379,43 @@ class Command(BaseCommand):
         json_metadata = json.loads(response.text)
         json_metadata = json_metadata['data']
         
-        # Add or update courts
-        with futures.ThreadPoolExecutor(max_workers=15) as executor:
-            results = []
+        # Probe the courts' feeds, reusing connections across probes
+        session = requests_retry_session(pool_size=PROBE_THREADS)
+        probes = []
+        failures = []
+        with futures.ThreadPoolExecutor(max_workers=PROBE_THREADS) as executor:
+            results = {}
             for metadata in json_metadata:
-                results.append(
-                    executor.submit(
-                        update_court, metadata
-                    )
-                )
+                results[executor.submit(probe_court, metadata, session)] = metadata
             for result in futures.as_completed(results):
                 try:
                     the_result = result.result(timeout=16) # Needed to trickle down exception
                 except Exception as exc:
-                    raise exc
+                    # The court is left as it was, rather than stopping every other probe
+                    logger.warning('WARNING - %s - Loadcourts could not probe %s. - %s' % (
+                                   datetime.datetime.utcnow().replace(tzinfo=utc),
+                                   results[result].get('title'),
+                                   repr(exc)))
+                    failures.append((results[result], repr(exc)))
+                    continue
+                if the_result:
+                    probes.append(the_result)
+        
+        # Add or update courts
+        added, changed = update_courts(probes)
+        if failures:
+            record_probe_failures(failures, time_started)
+        logger.info('INFO - %s - Loadcourts added %s courts, changed %s, left %s unchanged '
+                    'and could not probe %s.' % (
+                    datetime.datetime.utcnow().replace(tzinfo=utc),
+                    added,
+                    changed,
+                    len(probes) - added - changed,
+                    len(failures)))
+        
+        # Courts were updated in bulk, so the court picker has to be told to rebuild
+        if added or changed:
+            invalidate_court_picker()
         
         time_elapsed = datetime.datetime.utcnow().replace(tzinfo=utc) - time_started
         time_elapsed = str(time_elapsed).split(':')
@@ -0,0 +1,128 @@
+import datetime
+import logging
+
+from dateutil import parser
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+from pacertracker.entryids import get_entry_id
+from pacertracker.management.commands.archive import get_rows_after
+from pacertracker.models import Case, Digest, Entry, RecentEntry
+
+utc = datetime.timezone.utc
+logger = logging.getLogger(__name__)
+
+fields = ['id', 'case_id', 'case__court_id', 'description', 'number', 'website', 'time_filed', 'captured_time']
+
+
+def rewrite_batch(rows, digest_ids):
+    """
+    Gives a batch of entries their time ordered ids, and returns how many were changed,
+    how many were removed as duplicates and the new ids of any that are in digests
+
+    An entry whose new id is already taken was saved twice, so it is removed.
+    """
+    new_ids, case_ids = {}, {}
+    for id, case_id, court_id, description, number, website, time_filed, captured_time in rows:
+        new_id = get_entry_id(case_id, court_id, description, number, website, time_filed)
+        if new_id != id:
+            new_ids[id] = new_id
+            case_ids[id] = case_id
+    if not new_ids:
+        return 0, 0, {}
+
+    with transaction.atomic():
+        taken = set(Entry.objects.filter(id__in=list(new_ids.values())).values_list('id', flat=True))
+        changes, duplicates = [], []
+        for old_id, new_id in new_ids.items():
+            if new_id in taken:
+                duplicates.append(old_id)
+            else:
+                taken.add(new_id)
+                changes.append((old_id, new_id))
+
+        if duplicates:
+            Entry.objects.filter(id__in=duplicates).delete()
+            RecentEntry.objects.filter(entry_id__in=duplicates).delete()
+            # The copy kept has the same times, so only the counts change
+            counts = {}
+            for old_id in duplicates:
+                counts[case_ids[old_id]] = counts.get(case_ids[old_id], 0) + 1
+            for case_id, count in counts.items():
+                Case.objects.filter(id=case_id).update(entry_count=F('entry_count') - count)
+        if changes:
+            with connection.cursor() as cursor:
+                # Recent entries are looked up by their entry's id, so they change with it
+                for model, column in ((Entry, 'id'), (RecentEntry, 'entry_id')):
+                    cursor.execute('UPDATE %s AS e SET %s = v.new_id FROM (VALUES %s) AS v (old_id, new_id) '
+                                   'WHERE e.%s = v.old_id' % (
+                                   connection.ops.quote_name(model._meta.db_table), column,
+                                   ', '.join(['(%s::uuid, %s::uuid)'] * len(changes)), column),
+                                   [str(x) for change in changes for x in change])
+
+    return (len(changes), len(duplicates),
+            dict([(str(old_id), str(new_id)) for old_id, new_id in new_ids.items() if str(old_id) in digest_ids]))
+
+
+def update_digests(digest_ids):
+    """
+    Replaces the old ids in digests with the new ones
+    """
+    digests = []
+    for digest in Digest.objects.all():
+        entry_ids = [digest_ids.get(x, x) for x in digest.entry_ids]
+        if entry_ids != digest.entry_ids:
+            digest.entry_ids = entry_ids
+            digests.append(digest)
+    Digest.objects.bulk_update(digests, ['entry_ids'], batch_size=500)
+
+    return len(digests)
+
+
+class Command(BaseCommand):
+    args = 'No args.'
+    help = 'Give entries saved before ids were time ordered their new ids, oldest first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None,
+                            help='Only rewrite entries captured since this time, to pick up after an earlier run.')
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=10000,
+                            help='Entries rewritten in each transaction.')
+
+    def handle(self, *args, **options):
+        time_started = datetime.datetime.utcnow().replace(tzinfo=utc)
+        entries = Entry.objects.all()
+        if options['since']:
+            entries = entries.filter(captured_time__gte=parser.parse(options['since']))
+
+        # Digests hold the ids of the entries they will email
+        digest_ids = dict([(x, x) for entry_ids in Digest.objects.values_list('entry_ids', flat=True)
+                           for x in entry_ids])
+
+        checkpoint, total_changed, total_duplicates = None, 0, 0
+        while True:
+            rows = list(get_rows_after(entries, checkpoint).values_list(*fields)[:options['batch_size']])
+            if not rows:
+                break
+            changed, duplicates, new_digest_ids = rewrite_batch(rows, digest_ids)
+            digest_ids.update(new_digest_ids)
+            total_changed += changed
+            total_duplicates += duplicates
+            # The old id still orders the batches, whatever the entry's id is now
+            checkpoint = {'captured_time': rows[-1][-1].isoformat(), 'id': rows[-1][0]}
+            logger.info('INFO - %s - Migrateentryids rewrote %s entries and removed %s duplicates, '
+                        'up to those captured at %s.' % (
+                        datetime.datetime.utcnow().replace(tzinfo=utc), total_changed, total_duplicates,
+                        rows[-1][-1]))
+
+        digests = update_digests(digest_ids)
+
+        time_elapsed = datetime.datetime.utcnow().replace(tzinfo=utc) - time_started
+        time_elapsed = str(time_elapsed).split(':')
+        logger.info('INFO - %s - Migrateentryids finished after %s, rewriting %s entries, removing %s '
+                    'duplicates and updating %s digests.' % (
+                    datetime.datetime.utcnow().replace(tzinfo=utc),
+                    time_elapsed[1] + ' minutes and ' + time_elapsed[2] + ' seconds',
+                    total_changed, total_duplicates, digests))
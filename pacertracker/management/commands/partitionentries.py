@@ -0,0 +1,253 @@
+import re
+import datetime
+import logging
+
+from dateutil import parser
+from dateutil.relativedelta import relativedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection, transaction
+
+import pacertracker
+from pacertracker.models import Entry
+from pacertracker.management.commands.archive import is_archived
+
+utc = datetime.timezone.utc
+logger = logging.getLogger(__name__)
+
+TABLE = Entry._meta.db_table
+# Holds the entries captured before the table was partitioned
+LEGACY_TABLE = TABLE + '_legacy'
+# Catches entries captured after the last monthly partition, if partitionentries stops running
+DEFAULT_TABLE = TABLE + '_default'
+LEGACY_RANGE = 'entry_legacy_range'
+LEGACY_KEY = 'entry_legacy_id_captured'
+BOUND_PATTERN = re.compile(r'FROM \((.+)\) TO \((.+)\)')
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+def get_month(value, months=0):
+    """
+    Returns the start of the month a time falls in, moved on (or back) a number of months
+    """
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0) + relativedelta(months=months)
+
+
+def is_partitioned(cursor):
+    cursor.execute('SELECT relkind FROM pg_class WHERE oid = %s::regclass', [TABLE])
+    return cursor.fetchone()[0] == 'p'
+
+
+def parse_bound(value):
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return parser.parse(value.strip("'")).astimezone(utc)
+
+
+def get_partitions(cursor):
+    """
+    Returns the name, start and end of each partition of the entry table, oldest first
+
+    The start of the legacy partition, and both ends of the default one, are None.
+    """
+    cursor.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass
+        """, [TABLE])
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = BOUND_PATTERN.search(bound)
+        if match:
+            partitions.append((name, parse_bound(match.group(1)), parse_bound(match.group(2))))
+        else:
+            partitions.append((name, None, None))
+
+    return sorted(partitions, key=lambda p: (p[2] is None, p[2]))
+
+
+def get_legacy_name(name):
+    return name[:56] + '_legacy'
+
+
+def convert_table(cursor, end):
+    """
+    Turns the entry table into one partitioned by capture month, its rows becoming the legacy partition
+
+    No rows are copied, and none are read while the table is locked: the unique
+    index the partitioned primary key needs is built concurrently first, and a
+    validated constraint shows that every row was captured before end.
+    """
+    logger.info('INFO - %s - Partitionentries is preparing %s to be partitioned.' % (
+                datetime.datetime.utcnow().replace(tzinfo=utc), TABLE))
+
+    # An index left invalid by an interrupted run has to be built again
+    cursor.execute('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)', [LEGACY_KEY])
+    row = cursor.fetchone()
+    if row and not row[0]:
+        cursor.execute('DROP INDEX %s' % quote(LEGACY_KEY))
+    cursor.execute('CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s (id, captured_time)' % (
+                   quote(LEGACY_KEY), quote(TABLE)))
+
+    # Adding the constraint takes a brief lock, validating it reads every row without blocking writes
+    cursor.execute('ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s' % (quote(TABLE), quote(LEGACY_RANGE)))
+    cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s CHECK (captured_time < %%s) NOT VALID' % (
+                   quote(TABLE), quote(LEGACY_RANGE)), [end])
+    cursor.execute('ALTER TABLE %s VALIDATE CONSTRAINT %s' % (quote(TABLE), quote(LEGACY_RANGE)))
+
+    with transaction.atomic():
+        cursor.execute('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % quote(TABLE))
+        cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [TABLE])
+        cursor.execute('ALTER TABLE %s DROP CONSTRAINT %s' % (quote(TABLE), quote(cursor.fetchone()[0])))
+        cursor.execute('ALTER TABLE %s ADD PRIMARY KEY USING INDEX %s' % (quote(TABLE), quote(LEGACY_KEY)))
+        cursor.execute("""
+            SELECT i.indexname, i.indexdef, EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid =
+                   (quote_ident(i.schemaname) || '.' || quote_ident(i.indexname))::regclass)
+            FROM pg_indexes i WHERE i.schemaname = current_schema() AND i.tablename = %s
+            """, [TABLE])
+        indexes = cursor.fetchall()
+        cursor.execute("""
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f'
+            """, [TABLE])
+        foreign_keys = cursor.fetchall()
+
+        # Index names are shared by the whole schema, so the partitioned table's can only be
+        # made once the legacy table's are out of the way
+        for name, definition, is_constraint in indexes:
+            if name == LEGACY_KEY:
+                continue
+            cursor.execute('ALTER INDEX %s RENAME TO %s' % (quote(name), quote(get_legacy_name(name))))
+        cursor.execute('ALTER TABLE %s RENAME TO %s' % (quote(TABLE), quote(LEGACY_TABLE)))
+
+        cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY RANGE (captured_time)' % (
+                       quote(TABLE), quote(LEGACY_TABLE)))
+        # Unique keys of a partitioned table have to include the partition key
+        cursor.execute('ALTER TABLE %s ADD PRIMARY KEY (id, captured_time)' % quote(TABLE))
+        for name, definition in foreign_keys:
+            cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (quote(TABLE), quote(name), definition))
+        for name, definition, is_constraint in indexes:
+            if not is_constraint:
+                cursor.execute(definition)
+
+        # The legacy table's matching indexes and foreign keys are attached rather than built again
+        cursor.execute('ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (MINVALUE) TO (%%s)' % (
+                       quote(TABLE), quote(LEGACY_TABLE)), [end])
+
+    logger.info('INFO - %s - Partitionentries partitioned %s, keeping entries captured before %s in %s.' % (
+                datetime.datetime.utcnow().replace(tzinfo=utc), TABLE, end, LEGACY_TABLE))
+
+
+def create_partition(cursor, start, end, has_default):
+    """
+    Adds the partition for the entries captured from start until end
+
+    Any of them already caught by the default partition are moved into it first.
+    """
+    name = '%s_%s' % (TABLE, start.strftime('%Y%m'))
+    with transaction.atomic():
+        cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)' % (quote(name), quote(TABLE)))
+        if has_default:
+            cursor.execute("""
+                WITH moved AS (DELETE FROM %s WHERE captured_time >= %%s AND captured_time < %%s RETURNING *)
+                INSERT INTO %s SELECT * FROM moved
+                """ % (quote(DEFAULT_TABLE), quote(name)), [start, end])
+            if cursor.rowcount:
+                logger.warning('WARNING - %s - Partitionentries moved %s entries out of %s.' % (
+                               datetime.datetime.utcnow().replace(tzinfo=utc), cursor.rowcount, DEFAULT_TABLE))
+        cursor.execute('ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (%%s) TO (%%s)' % (
+                       quote(TABLE), quote(name)), [start, end])
+
+    logger.info('INFO - %s - Partitionentries created %s.' % (
+                datetime.datetime.utcnow().replace(tzinfo=utc), name))
+
+
+def create_partitions(cursor, now, months_ahead):
+    """
+    Adds monthly partitions after the last one until months_ahead months after this one
+    """
+    partitions = get_partitions(cursor)
+    has_default = DEFAULT_TABLE in [p[0] for p in partitions]
+    ends = [p[2] for p in partitions if p[2]]
+    start = max(ends) if ends else get_month(now)
+    last = get_month(now, months_ahead + 1)
+    while start < last:
+        create_partition(cursor, start, get_month(start, 1), has_default)
+        start = get_month(start, 1)
+
+    if not has_default:
+        cursor.execute('CREATE TABLE %s PARTITION OF %s DEFAULT' % (quote(DEFAULT_TABLE), quote(TABLE)))
+
+
+def get_earliest_captured(cursor, name):
+    cursor.execute('SELECT min(captured_time) FROM %s' % quote(name))
+    return cursor.fetchone()[0]
+
+
+def drop_partitions(cursor, cutoff, feeds_path, detach_only=False):
+    """
+    Detaches, and drops unless detach_only, the partitions of entries all captured before cutoff
+
+    A partition is only dropped once every entry in it has been archived. The legacy
+    partition has no start, so it is checked from its earliest entry.
+    """
+    for name, start, end in get_partitions(cursor):
+        if end is None or end > cutoff:
+            continue
+        if start is None:
+            start = get_earliest_captured(cursor, name)
+        if start is not None and not is_archived(feeds_path, start, end):
+            logger.warning('WARNING - %s - Partitionentries kept %s because not all its entries are archived.' % (
+                           datetime.datetime.utcnow().replace(tzinfo=utc), name))
+            continue
+
+        with transaction.atomic():
+            cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (quote(TABLE), quote(name)))
+            if not detach_only:
+                cursor.execute('DROP TABLE %s' % quote(name))
+
+        logger.info('INFO - %s - Partitionentries %s %s.' % (
+                    datetime.datetime.utcnow().replace(tzinfo=utc),
+                    'detached' if detach_only else 'dropped', name))
+
+
+class Command(BaseCommand):
+    args = 'No args.'
+    help = ('Create the coming months\' entry partitions and drop archived ones older than '
+            'the retention.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', default=False,
+                            help='Partition the entry table by month if it is not already.')
+        parser.add_argument('--months-ahead', type=int, dest='months_ahead', default=3,
+                            help='Months after this one to create partitions for.')
+        parser.add_argument('--retention-months', type=int, dest='retention_months', default=None,
+                            help='Months of entries to keep before this one. Defaults to '
+                                 'ENTRIES_RETENTION_MONTHS, or keeping them all.')
+        parser.add_argument('--detach-only', action='store_true', dest='detach_only', default=False,
+                            help='Detach expired partitions as tables of their own instead of dropping them.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitionentries needs PostgreSQL.')
+
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        retention = options['retention_months']
+        if retention is None:
+            retention = getattr(settings, 'ENTRIES_RETENTION_MONTHS', None)
+
+        with connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                if not options['convert']:
+                    raise CommandError('The entry table is not partitioned. Run partitionentries '
+                                       '--convert to partition it.')
+                convert_table(cursor, get_month(now, 1))
+
+            create_partitions(cursor, now, options['months_ahead'])
+
+            if retention is not None:
+                feeds_path = pacertracker.__path__[0].replace('\\','/') + '/archives'
+                drop_partitions(cursor, get_month(now, -retention), feeds_path, options['detach_only'])
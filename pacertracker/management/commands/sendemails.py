@@ -2,7 +2,6 @@ import datetime
 import operator
 import logging
 
-from time import sleep
 from collections import OrderedDict
 from html2text import html2text
 from optparse import make_option
@@ -16,13 +15,59 @@ from django.contrib.auth.models import User
 from django.conf import settings
 from django.contrib.sites.models import Site
 
-from haystack.query import SearchQuerySet
-
-from pacertracker.models import Court, Case, Entry, Alert
+from pacertracker.models import Alert
+from pacertracker.delivery import EmailDelivery
+from pacertracker.digests import accumulate_digests, clear_digests, get_digest_email_data
+from pacertracker.matching import get_alert_matches
 
 utc = datetime.timezone.utc
 logger = logging.getLogger(__name__)
 
+def get_live_email_data(alert):
+    """
+    Returns an alert's email data and the time it was checked
+    """
+    cases, entries = get_alert_matches(alert, alert.last_checked)
+
+    #Store what will become the alert's last_checked before the query starts evaluating
+    last_checked = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+    #The search backend returns at most 160 cases, so they are counted as they are read
+    cases = list(cases.order_by('type'))
+
+    #If there are no cases, there is nothing to send
+    if not cases:
+        return None, last_checked
+
+    #Add the first alert to the email_data dictionary
+    alert_data = {'alert' : alert,
+                  'case_count' : len(cases),
+                  'cases' : {}}
+
+    for case in cases[:150]:
+        #One more entry than is shown tells whether the case has any more to count
+        case_entries = list(entries.filter(case=case).order_by('-time_filed')[:26])
+        if len(case_entries) <= 25:
+            entry_count = len(case_entries)
+        elif alert.only_new_cases:
+            #A new case's entries were all captured since the alert was last checked,
+            #so the count trackcases keeps on the case is the one to show
+            entry_count = case.entry_count
+        else:
+            entry_count = entries.filter(case=case).count()
+
+        alert_data['cases'][str(case.id)] = {
+            'case' : case,
+            'entry_count' : entry_count,
+            'entries' : OrderedDict()
+            }
+
+        for entry in case_entries[:25]:
+            alert_data['cases'][str(case.id)]['entries'][str(entry.id)] = entry
+
+    return alert_data, last_checked
+
+
 class Command(BaseCommand):
     help = 'Send PACER Tracker email alerts.'
 
@@ -43,16 +88,40 @@ class Command(BaseCommand):
             help='Run, but do not send the emails.'
         )
 
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            dest='chunk_size',
+            default=getattr(settings, 'ALERTS_EMAIL_CHUNK_SIZE', 20),
+            help='Number of emails handed to an SMTP connection at a time.'
+        )
+
 
     def handle(self, *args, **options):
-        messages = [] #prepare messages list
         subject, from_email = 'PACER Tracker Alert Email', settings.ALERTS_FROM_EMAIL
 
         time_started = datetime.datetime.utcnow().replace(tzinfo=utc)
         
+        #Emails are sent as soon as they are rendered
+        if not(options['nosend']):
+            delivery = EmailDelivery(pool_size=getattr(settings, 'ALERTS_EMAIL_CONNECTIONS', 2),
+                                     chunk_size=options['chunk_size'],
+                                     retries=getattr(settings, 'ALERTS_EMAIL_RETRIES', 3),
+                                     backoff=getattr(settings, 'ALERTS_EMAIL_BACKOFF', 5))
+        else:
+            delivery = None
+        messages_count = 0
+        
         #These are used to store the time the alerts were checked (just before the query runs).
-        alert_ids = []
+        #Alerts without results can always be updated. The others are only updated once
+        #their user's email has been accepted.
         alert_times = {}
+        #The digest rows read for daily emails, cleared once their email has been accepted
+        digest_rows = {}
+
+        #Catch the daily digests up on anything matched since the last live run
+        if options['daily']:
+            accumulate_digests()
 
         #Get Queryset containing users who have alerts needing live or daily updates
         users = [alert.user for alert in Alert.objects.filter(live_updates=not(options['daily'])).distinct('user')]
@@ -63,64 +132,26 @@ class Command(BaseCommand):
 
             to_email = user.email
             email_data = {}
+            email_alert_times = {}
+            email_digest_rows = {}
 
             for alert in Alert.objects.filter(user=user, live_updates=not(options['daily'])).order_by('words'):
-                #Start by filtering to cases in courts selected
-                court_list = alert.courts.values_list('id', flat=True)
-                cases = SearchQuerySet().models(Case).filter(court__in=court_list)
-
-                #If there are alerts to filter by, filter by them...
-                if alert.words:
-                    cases = cases.filter(content=alert.words)
-
-                #If there is a district_court_filter, apply it...
-                if alert.district_court_filter:
-                    cases = cases.exclude(type=alert.district_court_filter)
-
-                #Only get cases or entries if they were captured after the last time this alert was searched.
-                if alert.only_new_cases:
-                    #Send alerts for any new cases in the database, even if the case wasn't just filed
-                    #this is necessary because courts may not publish the typical first filing in a case, such as
-                    #a complaint. Or, the first public filing after a seal is lifted may not be a complaint.
-                    cases = cases.filter(captured_time__gte=alert.last_checked).order_by('type').values_list('pk', flat=True)[:160]
-                    entries = Entry.objects.filter(case__in=cases)
-                    cases = Case.objects.filter(id__in=cases)
+                #Daily alerts were matched during the day, so only their digests need to be read
+                if options['daily']:
+                    alert_data, rows = get_digest_email_data(alert)
+                    email_digest_rows.update(rows)
+                    last_checked = alert.digest_checked or time_started
                 else:
-                    #Updated time is set after any entries are saved. So, this will alert to any cases with entries that have
-                    #been saved since the last time the alert was checked, even if the alert is checked during a trackcases run
-                    cases = cases.filter(updated_time__gte=alert.last_checked).order_by('type').values_list('pk', flat=True)[:160]
-                    entries = Entry.objects.filter(captured_time__gte=alert.last_checked, case__in=cases)
-                    cases = Case.objects.filter(id__in=entries.values('case'))
+                    alert_data, last_checked = get_live_email_data(alert)
 
                 #If there are no cases, go to the next alert
-                if not cases:
-                    last_checked = datetime.datetime.utcnow().replace(tzinfo=utc)
-                    alert_ids.append(alert.id)
-                    alert_times['%s' % alert.id] = last_checked
+                if not alert_data:
+                    alert_times[alert.id] = last_checked
                     continue
 
-                #Add the first alert to the email_data dictionary
-                email_data[str(alert.id)] = {'alert' : alert,
-                                                'case_count' : cases.count(),
-                                                'cases' : {}}
-
-                #Store what will become the alert's last_checked before the query starts evaluating
-                last_checked = datetime.datetime.utcnow().replace(tzinfo=utc)
-                
-                for case in cases.order_by('type')[:150]:
-
-                    email_data[str(alert.id)]['cases'][str(case.id)] = {
-                        'case' : case,
-                        'entry_count' : entries.filter(case=case).count(),
-                        'entries' : OrderedDict()
-                        }
-
-                    for entry in entries.filter(case=case).order_by('-time_filed')[:25]:
-                        email_data[str(alert.id)]['cases'][str(case.id)]['entries'][str(entry.id)] = entry
-
-                #Save the alert's id to a list and its last_checked to a dict for later updating
-                alert_ids.append(alert.id)
-                alert_times['%s' % alert.id] = last_checked
+                #Save the alert's last_checked for updating once the email is accepted
+                email_data[str(alert.id)] = alert_data
+                email_alert_times[alert.id] = last_checked
 
             if len(email_data) > 0:
                 htmly = get_template('pacertracker/alert_email.html')
@@ -139,46 +170,52 @@ class Command(BaseCommand):
 
                 email = mail.EmailMultiAlternatives(subject, text_content, from_email, [to_email])
                 email.attach_alternative(html_content, "text/html") #Send both text and html emails
-                messages.append(email)
+                messages_count += 1
+                if delivery:
+                    delivery.add(email, (to_email, email_alert_times, email_digest_rows))
 
-        if not(options['nosend']):
-            try:
-                connection = mail.get_connection() # Use default email connection
-                connection.send_messages(messages)
-                connection.close()
-            except: #various smtplib errors
-                sleep(5)
-                connection = mail.get_connection() # Use default email connection
-                connection.send_messages(messages)
-                connection.close()
+        recipients = ''
+        if delivery:
+            accepted, failed = delivery.close()
             
-            for alert in Alert.objects.filter(id__in=alert_ids):
-                alert.last_checked = alert_times['%s' % alert.id]
-                alert.save(update_fields=['last_checked'])
-                #OVERIDING THE ABOVE FOR TESTING PURPOSES 2/2
-                #alert.last_checked = datetime.datetime(2015,1,12).replace(tzinfo=utc)
-                #alert.save(update_fields=['last_checked'])
+            for to_email, email_alert_times, email_digest_rows in accepted:
+                alert_times.update(email_alert_times)
+                digest_rows.update(email_digest_rows)
+                recipients += to_email + ','
+            
+            if failed:
+                error_msg = 'ERROR - %s - Sendemails could not send %s email(s). Their alerts will be checked again next run.'
+                error_msg = (error_msg % (time_started, str(len(failed))))
+                logger.error(error_msg)
+            
+            Alert.objects.bulk_update([Alert(id=alert_id, last_checked=last_checked) 
+                                       for alert_id, last_checked in alert_times.items()],
+                                      ['last_checked'], batch_size=500)
+            messages_count = len(accepted)
+            
+            #Sent digests start over, keeping anything matched since they were read
+            clear_digests(digest_rows)
         else:
             print('DID NOT SEND EMAILS OR UPDATE ALERTS!')
 
+        #Live runs also add to the daily alerts' digests, so the daily run only has to send them
+        if not options['daily']:
+            accumulate_digests()
+
         time_elapsed = datetime.datetime.utcnow().replace(tzinfo=utc) - time_started
         time_elapsed = str(time_elapsed).split(':')
 
-        recipients = ''
-        for message in messages:
-            recipients += message.to[0] + ','
-            
         final_msg = 'INFO - %s - %s sendemails took %s. Sent %s email(s) to %s.'
         final_msg = (final_msg % (time_started,
                                   'Daily' if options['daily'] else 'Live',
                                   time_elapsed[1] + ' minutes and ' + time_elapsed[2] + ' second(s)',
-                                  str(len(messages)),
+                                  str(messages_count),
                                   recipients if recipients else 'no one'))
         logger.info(final_msg)
                                   
 
         # self.stdout.write('%s|"totals"|"%s"|%s|"%s"|"%s"' % (time_started, 'daily' if options['daily'] else 'live',
-                            # str(len(messages)), 
+                            # str(messages_count), 
                             # time_elapsed[1] + ' minutes and ' + time_elapsed[2] + ' second(s)',
                             # recipients))
         
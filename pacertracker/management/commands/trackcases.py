@@ -5,8 +5,6 @@ import time
 import re
 import requests
 import html
-import uuid
-import hashlib
 import logging
 
 from concurrent import futures
@@ -19,15 +17,25 @@ from requests.packages.urllib3.util.retry import Retry
 
 from django.core.management.base import BaseCommand
 from django.core.management import call_command
+from django.db import connection, models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
 from django.db.utils import IntegrityError, OperationalError
 
 import pacertracker
+from pacertracker.entryids import get_entry_id, get_legacy_entry_id
+from pacertracker.health import (get_feed_health, save_feed_health, is_breaker_open, get_timeout,
+                                 get_retries, record_success, record_failure)
 from pacertracker.models import Court, Case, Entry
-from pacertracker.search_indexes import CaseIndex
+from pacertracker.recent import save_recent_entries
+from pacertracker.search import get_search_backend, get_search_vector
 
 utc = datetime.timezone.utc
 logger = logging.getLogger(__name__)
 
+#First key of the advisory lock held while a court's entries are saved, the court id being the second
+ENTRY_LOCK = 7301
+
 def requests_retry_session(
     retries=2,
     backoff_factor=0.1,
@@ -48,19 +56,21 @@ def requests_retry_session(
     
     return session
 
-def download_feed(court, feeds_path):
+def download_feed(court, feeds_path, timeout=30, retries=2):
     """
-    Downloads court feeds
+    Downloads court feeds and returns the seconds it took
     """
-    response = requests_retry_session().get(
+    start = timeit.default_timer()
+    response = requests_retry_session(retries=retries).get(
         court.feed_url,
-        timeout=30
+        timeout=timeout
     )
+    latency = timeit.default_timer() - start
     
     with open('%s/%s - %s.xml' % (feeds_path, court.name, court.get_type_display()), 'w') as out:
         out.write(response.text)
     
-    return None
+    return latency
     
 def get_tzinfos():
     #Necessary for dateutil parser
@@ -172,6 +182,66 @@ def get_entry_info(entry):
         return description, None, None
 
 
+def get_case_activity(entries):
+    """
+    Returns the updates to the entry counts and last entry times of the cases of newly saved entries
+    """
+    counts, last_filed, last_captured = {}, {}, {}
+    for entry in entries:
+        counts[entry.case_id] = counts.get(entry.case_id, 0) + 1
+        last_filed[entry.case_id] = max(last_filed.get(entry.case_id, entry.time_filed), entry.time_filed)
+        last_captured[entry.case_id] = max(last_captured.get(entry.case_id, entry.captured_time), entry.captured_time)
+
+    get_values = lambda values, output_field, default=None: models.Case(
+        *[models.When(id=case_id, then=Value(value)) for case_id, value in values.items()],
+        default=Value(default), output_field=output_field)
+    # Greatest skips nulls on PostgreSQL, so a case's first entry sets its times
+    return {'entry_count': F('entry_count') + get_values(counts, models.IntegerField(), 0),
+            'last_filed': Greatest('last_filed', get_values(last_filed, models.DateTimeField())),
+            'last_captured': Greatest('last_captured', get_values(last_captured, models.DateTimeField()))}
+
+
+def lock_courts(court_ids):
+    """
+    Makes any other run saving entries of these courts wait until this transaction ends
+
+    Once the entry table is partitioned, its primary key is (id, captured_time), so
+    it no longer stops two runs from saving the same entry. Entry ids include the
+    court, so runs saving the same entry always wait on the same lock.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        # Always in the same order, so two runs cannot each hold a lock the other wants
+        for court_id in sorted(set(court_ids)):
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [ENTRY_LOCK, court_id])
+
+
+def save_entries(entries, cases):
+    """
+    Saves new entries and their recent entries, and updates their cases, in one transaction
+
+    Entries another run saved first are left out, and the ones saved are returned.
+    The cases' updated_time, full-text search vector (in case the title changed),
+    entry counts and last entry times are all set in one statement.
+    """
+    with transaction.atomic():
+        lock_courts([case.court_id for case in cases])
+        saved = set(Entry.objects.filter(id__in=[entry.id for entry in entries]).values_list('id', flat=True))
+        entries = [entry for entry in entries if entry.id not in saved]
+        if not entries:
+            return entries
+
+        Entry.objects.bulk_create(entries)
+        save_recent_entries(entries, dict([(case.id, case) for case in cases]))
+        Case.objects.filter(id__in=[case.id for case in cases]).update(
+            updated_time=datetime.datetime.utcnow().replace(tzinfo=utc),
+            search_vector=get_search_vector(),
+            **get_case_activity(entries))
+
+    return entries
+
+
 def save_everything(last_entries_saved, entries_to_save, total_entries_duplicate, total_cases, total_entries):
     #############
     # Save the cases and entries
@@ -191,11 +261,12 @@ def save_everything(last_entries_saved, entries_to_save, total_entries_duplicate
     
     if entries_to_save:
         # Find the entries that already exist
-        returned_entries = list(Entry.objects.filter(id__in=entry_ids).select_related('case'
-                                ).values_list('id', flat=True))
+        returned_entries = set(Entry.objects.filter(id__in=entry_ids + [x[13] for x in entries_to_save]
+                                                    ).values_list('id', flat=True))
         
         # Eliminate any entry with identical field values
-        indices_to_delete = [i for i, x in enumerate(entries_to_save) if x[11] in returned_entries]
+        indices_to_delete = [i for i, x in enumerate(entries_to_save)
+                             if x[11] in returned_entries or x[13] in returned_entries]
         entries_to_save = [x for i, x in enumerate(entries_to_save) if i not in indices_to_delete]
         total_entries_duplicate += len(indices_to_delete)
         for x in entries_to_save:
@@ -250,23 +321,19 @@ def save_everything(last_entries_saved, entries_to_save, total_entries_duplicate
                                                 website=new_entry[9], time_filed=new_entry[10],
                                                 id=new_entry[11])
             
-            Entry.objects.bulk_create(entries_to_save)
-            total_entries += len(entries_to_save)
-            
-            # Get the ids of saved cases so you can update their updated_time
-            case_ids = [x.id for x in saved_cases]
-            while case_ids:
-                try:
-                    Case.objects.filter(id__in=case_ids).update(updated_time=datetime.datetime.utcnow().replace(tzinfo=utc))
-                    case_ids = None
-                except OperationalError:
-                    error_msg = 'WARNING - %s - Trackcases experienced OperationalError when setting updated time of cases, trying again.'
-                    error_msg = (error_msg % (datetime.datetime.utcnow().replace(tzinfo=utc)
-                                 ))
-                    logger.warning(error_msg)
-                    time.sleep(.1)
-                    Case.objects.filter(id__in=case_ids).update(updated_time=datetime.datetime.utcnow().replace(tzinfo=utc))
-                    case_ids = None
+            # Alerts find entries through the recent entry table and the cases count them,
+            # so all of them are saved together or not at all
+            try:
+                entries_saved = save_entries(entries_to_save, saved_cases)
+            except OperationalError:
+                error_msg = 'WARNING - %s - Trackcases experienced OperationalError when saving entries, trying again.'
+                error_msg = (error_msg % (datetime.datetime.utcnow().replace(tzinfo=utc)
+                             ))
+                logger.warning(error_msg)
+                time.sleep(.1)
+                entries_saved = save_entries(entries_to_save, saved_cases)
+            total_entries_duplicate += len(entries_to_save) - len(entries_saved)
+            total_entries += len(entries_saved)
      
     return last_entries_saved, total_entries_duplicate, total_cases, total_entries
 
@@ -289,20 +356,26 @@ class Command(BaseCommand):
         courts_broken = 0
         courts_old = 0
         
-        #Get courts list
-        courts = Court.objects.filter(has_feed=True).order_by('id')
+        #Get courts list, leaving out feeds that failed repeatedly until it is time to try them again
+        courts = list(Court.objects.filter(has_feed=True).order_by('id'))
+        healths = get_feed_health(courts)
+        courts_skipped = len([c for c in courts if is_breaker_open(healths[c.id], time_started)])
+        courts = [c for c in courts if not is_breaker_open(healths[c.id], time_started)]
         
         #Get or create the path for storing the feeds
         feeds_path = pacertracker.__path__[0].replace('\\','/') + '/feeds'
         if not os.path.exists(feeds_path):
             os.makedirs(feeds_path)
 
-        #For saving the courts that don't fail when downloading
+        #For saving the courts that don't fail when downloading, and how long they took
         downloaded_courts = []
+        latencies = {}
         
-        #Download the court feeds
+        #Download the court feeds, with timeouts based on how long each usually takes
         with futures.ThreadPoolExecutor(max_workers=30) as executor:
-            feed_download = dict((executor.submit(download_feed, court, feeds_path), court)
+            feed_download = dict((executor.submit(download_feed, court, feeds_path,
+                                                  get_timeout(healths[court.id]),
+                                                  get_retries(healths[court.id])), court)
                         for court in courts)
             
             for future in futures.as_completed(feed_download):
@@ -313,17 +386,20 @@ class Command(BaseCommand):
                                  court.get_type_display() + ': ' + court.name,
                                  future.exception()))
                     logger.error(error_msg)
+                    record_failure(healths[court.id], time_started, future.exception())
                     courts_broken += 1
                 else:
                     downloaded_courts.append(court)
+                    latencies[court.id] = future.result()
 
         #Log download time
         download_time = timeit.default_timer() - download_start
-        info_msg = 'INFO - %s - Trackcases downloaded %s courts in %s seconds, %s were broken and %s were stale.'
+        info_msg = 'INFO - %s - Trackcases downloaded %s courts in %s seconds, %s were broken, %s were skipped after repeated failures and %s were stale.'
         info_msg = (info_msg % (time_started,
                     str(len(downloaded_courts)),
                     download_time,
                     str(courts_broken),
+                    str(courts_skipped),
                     str(courts_old)
                     ))
         logger.info(info_msg)
@@ -361,6 +437,7 @@ class Command(BaseCommand):
                              court.get_type_display() + ': ' + court.name
                              ))
                 logger.error(error_msg)
+                record_failure(healths[court.id], time_started, 'No feed or an empty feed.')
                 courts_broken += 1
 
                 continue
@@ -374,10 +451,13 @@ class Command(BaseCommand):
                              court.get_type_display() + ': ' + court.name
                              ))
                 logger.error(error_msg)
+                record_failure(healths[court.id], time_started, 'No last build date.')
 
                 courts_broken += 1
                 continue
 
+            record_success(healths[court.id], time_started, latencies[court.id], time_updated)
+
             # Checking that the last_updated time has a TZ
             try:
                 compare = court.last_updated >= time_updated
@@ -479,11 +559,12 @@ class Command(BaseCommand):
                     is_date_filed = False
 
                 #Getting ready to check for cases/entries and for saving the cases/entries
-                entry_id = case_website + description + str(doc_number) + str(doc_website) + str(time_filed)
-                entry_id = uuid.UUID(hashlib.md5(entry_id.encode('utf-8')).hexdigest())
+                entry_id = get_entry_id(case_id, court.id, description, doc_number, doc_website, time_filed)
+                #Entries saved before ids were time ordered are only found by their old id
+                legacy_id = get_legacy_entry_id(case_website, description, doc_number, doc_website, time_filed)
                 entries_to_save.append((court, title, case_number, name, type, is_date_filed, 
                                         case_website, description, doc_number, doc_website, time_filed, 
-                                        entry_id, case_id))
+                                        entry_id, case_id, legacy_id))
                 
                 feed_times.append(timeit.default_timer() - feed_start)
                 
@@ -518,11 +599,13 @@ class Command(BaseCommand):
             feed_times.append(timeit.default_timer() - feed_start)
             
         
+        save_feed_health(list(healths.values()))
+        
         ##########
-        # Add everything to the Solr index!
+        # Add everything to the Solr index! (The Postgres backend is already up to date.)
         #########
         index_start = timeit.default_timer()
-        call_command('update_index', start_date=time_started.isoformat(), verbosity=0)
+        get_search_backend().update_index(time_started)
         index_time = timeit.default_timer() - index_start
 
         ###########
@@ -562,9 +645,10 @@ class Command(BaseCommand):
                     time_ended, 
                     str(total_cases), 
                     str(total_entries)))
-        logger.info('INFO - %s - Trackcases found %s broken courts and %s stale courts.' % (
+        logger.info('INFO - %s - Trackcases found %s broken courts, %s skipped courts and %s stale courts.' % (
                     time_ended, 
                     str(courts_broken), 
+                    str(courts_skipped), 
                     str(courts_old)))
         logger.info('INFO - %s - Trackcases found %s old entries, %s duplicate entries and %s broken entries.' % (
                     time_ended, 
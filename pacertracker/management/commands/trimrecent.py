@@ -0,0 +1,29 @@
+import datetime
+import logging
+
+from django.core.management.base import BaseCommand
+
+from pacertracker.recent import fill_recent_entries, get_recent_cutoff, get_recent_days, trim_recent_entries
+
+utc = datetime.timezone.utc
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    args = 'No args.'
+    help = 'Remove entries older than RECENT_ENTRIES_DAYS from the recent entry table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fill', action='store_true', default=False,
+                            help='Also add any entries captured since then that the table is missing, '
+                                 'after RECENT_ENTRIES_DAYS is raised.')
+
+    def handle(self, *args, **options):
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        cutoff = get_recent_cutoff(now)
+
+        removed = trim_recent_entries(cutoff)
+        added = fill_recent_entries(cutoff) if options['fill'] else 0
+
+        logger.info('INFO - %s - Trimrecent removed %s and added %s recent entries, keeping %s days.' % (
+                    now, removed, added, get_recent_days()))
@@ -0,0 +1,47 @@
+from pacertracker.models import Case, Entry
+from pacertracker.recent import get_recent_entries
+from pacertracker.search import get_search_backend
+
+
+def get_alert_matches(alert, since):
+    """
+    Finds what an alert matches since a given time
+
+    Returns a queryset of the matching cases and a queryset of their entries.
+    At most 160 cases are taken from the case search backend.
+    """
+    #Start by filtering to cases in courts selected
+    court_list = list(alert.courts.values_list('id', flat=True))
+    search = get_search_backend()
+    #The small table of recently captured entries stands in for the entry table, unless
+    #the alert was last checked before its oldest entries
+    recent = get_recent_entries(since)
+
+    #Only get cases or entries if they were captured after the last time this alert was searched.
+    if alert.only_new_cases:
+        #Send alerts for any new cases in the database, even if the case wasn't just filed
+        #this is necessary because courts may not publish the typical first filing in a case, such as
+        #a complaint. Or, the first public filing after a seal is lifted may not be a complaint.
+        case_ids = search.case_ids(court_list, alert.words, alert.district_court_filter,
+                                   captured_since=since)
+        cases = Case.objects.filter(id__in=case_ids)
+    else:
+        #Updated time is set after any entries are saved. So, this will alert to any cases with entries that have
+        #been saved since the last time the alert was checked, even if the alert is checked during a trackcases run
+        case_ids = search.case_ids(court_list, alert.words, alert.district_court_filter,
+                                   updated_since=since)
+        if recent is not None:
+            cases = Case.objects.filter(id__in=recent.filter(case__in=case_ids).values('case'))
+        else:
+            cases = Case.objects.filter(id__in=Entry.objects.filter(captured_time__gte=since, case__in=case_ids)
+                                        .values('case'))
+
+    #Entries are never captured before their case, so bounding them by time lets
+    #PostgreSQL skip all but the newest partitions of a partitioned entry table
+    entries = Entry.objects.filter(captured_time__gte=since)
+    if recent is not None:
+        entries = entries.filter(id__in=recent.filter(case__in=case_ids).values('entry_id'))
+    else:
+        entries = entries.filter(case__in=case_ids)
+
+    return cases, entries
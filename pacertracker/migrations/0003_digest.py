@@ -0,0 +1,32 @@
+# Generated by Django 3.2.13 on 2026-10-19 01:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacertracker', '0002_courtgroup_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='digest_checked',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Daily alerts only. Time up to which matches have been added to the digest.', null=True),
+        ),
+        migrations.CreateModel(
+            name='Digest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_count', models.IntegerField(default=0, help_text='New entries found for the case.')),
+                ('entry_ids', models.JSONField(blank=True, default=list, help_text='Ids of the most recently filed new entries, newest first.')),
+                ('alert', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pacertracker.alert')),
+                ('case', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pacertracker.case')),
+            ],
+            options={
+                'unique_together': {('alert', 'case')},
+            },
+        ),
+    ]
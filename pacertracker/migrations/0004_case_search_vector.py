@@ -0,0 +1,29 @@
+# Generated by Django 3.2.13 on 2026-10-19 01:33
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacertracker', '0003_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='case',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, help_text='Full-text index of the title, used when CASE_SEARCH_BACKEND is postgres.', null=True),
+        ),
+        # Fill the vectors before building the index, which is much faster than the other way around
+        migrations.RunSQL(
+            "UPDATE pacertracker_case SET search_vector = to_tsvector('english', title);",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='case',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='case_search_vector_idx'),
+        ),
+    ]
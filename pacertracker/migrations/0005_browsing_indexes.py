@@ -0,0 +1,24 @@
+# Generated by Django 3.2.13 on 2026-10-19 01:39
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking the case and entry tables against trackcases
+    atomic = False
+
+    dependencies = [
+        ('pacertracker', '0004_case_search_vector'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='case',
+            index=models.Index(fields=['court', 'updated_time', 'id'], name='case_court_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='entry',
+            index=models.Index(fields=['case', 'time_filed', 'id'], name='entry_case_filed_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.13 on 2026-10-19 01:42
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the index without locking the entry table against trackcases
+    atomic = False
+
+    dependencies = [
+        ('pacertracker', '0005_browsing_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='entry',
+            index=models.Index(fields=['captured_time', 'id'], name='entry_captured_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.13 on 2026-10-19 01:43
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the index without locking the case table against trackcases
+    atomic = False
+
+    dependencies = [
+        ('pacertracker', '0006_entry_captured_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='case',
+            index=models.Index(fields=['captured_time'], name='case_captured_idx'),
+        ),
+    ]
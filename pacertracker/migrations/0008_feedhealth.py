@@ -0,0 +1,32 @@
+# Generated by Django 3.2.13 on 2026-10-19 01:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacertracker', '0007_case_captured_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedHealth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('results', models.JSONField(blank=True, default=list, help_text='Whether each recent download worked, oldest first.')),
+                ('latencies', models.JSONField(blank=True, default=list, help_text='Seconds taken by each recent successful download, oldest first.')),
+                ('consecutive_failures', models.IntegerField(default=0)),
+                ('last_success', models.DateTimeField(blank=True, null=True)),
+                ('last_failure', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.CharField(blank=True, max_length=500)),
+                ('last_good_build', models.DateTimeField(blank=True, help_text="Build date of the last feed that could be read, from the court's clock.", null=True)),
+                ('next_attempt', models.DateTimeField(blank=True, help_text='Trackcases skips the feed until then.', null=True)),
+                ('court', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='health', to='pacertracker.court')),
+            ],
+            options={
+                'verbose_name_plural': 'feed health',
+            },
+        ),
+    ]
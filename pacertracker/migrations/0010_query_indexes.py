@@ -0,0 +1,98 @@
+# Generated by Django 3.2.13 on 2026-10-19 02:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+def is_partitioned(schema_editor, model):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+        return cursor.fetchone()[0] == 'p'
+
+
+class AddPartitionedIndexConcurrently(AddIndexConcurrently):
+    """
+    Builds an index concurrently, a partition at a time if partitionentries has partitioned the table
+    """
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if (not self.allow_migrate_model(schema_editor.connection.alias, model) or
+                not is_partitioned(schema_editor, model)):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+        # An index made on only the partitioned table is valid once each partition's is attached
+        quote = schema_editor.quote_name
+        table = model._meta.db_table
+        sql = str(self.index.create_sql(model, schema_editor))
+        schema_editor.execute(sql.replace(' ON ', ' ON ONLY ', 1))
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass',
+                           [table])
+            partitions = [row[0] for row in cursor.fetchall()]
+        for partition in partitions:
+            name = '%s_%s' % (self.index.name, partition[len(table) + 1:])
+            schema_editor.execute(sql.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+                                     .replace(quote(self.index.name), quote(name), 1)
+                                     .replace(quote(table), quote(partition), 1))
+            schema_editor.execute('ALTER INDEX %s ATTACH PARTITION %s' % (quote(self.index.name), quote(name)))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if (not self.allow_migrate_model(schema_editor.connection.alias, model) or
+                not is_partitioned(schema_editor, model)):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        schema_editor.remove_index(model, self.index)
+
+
+def drop_index(model_name, field_name, to):
+    """
+    Returns operations dropping the index Django gave a foreign key, without touching its constraint
+    """
+    def get_index(apps, schema_editor):
+        model = apps.get_model('pacertracker', model_name)
+        column = model._meta.get_field(field_name).column
+        return model, schema_editor._create_index_name(model._meta.db_table, [column])
+
+    def forwards(apps, schema_editor):
+        model, name = get_index(apps, schema_editor)
+        concurrently = '' if is_partitioned(schema_editor, model) else 'CONCURRENTLY '
+        schema_editor.execute('DROP INDEX %sIF EXISTS %s' % (concurrently, schema_editor.quote_name(name)))
+
+    def backwards(apps, schema_editor):
+        model, name = get_index(apps, schema_editor)
+        schema_editor.execute(schema_editor._create_index_sql(model, fields=[model._meta.get_field(field_name)]))
+
+    return migrations.SeparateDatabaseAndState(
+        database_operations=[migrations.RunPython(forwards, backwards)],
+        state_operations=[migrations.AlterField(
+            model_name=model_name,
+            name=field_name,
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=to),
+        )],
+    )
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking the entry and alert tables against trackcases and sendemails
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pacertracker', '0009_case_updated_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='alert',
+            index=models.Index(fields=['live_updates', 'user', 'words'], name='alert_live_user_idx'),
+        ),
+        AddPartitionedIndexConcurrently(
+            model_name='entry',
+            index=models.Index(fields=['case', 'captured_time'], name='entry_case_captured_idx'),
+        ),
+        # The foreign keys' own indexes are the start of case_court_updated_idx and entry_case_filed_idx
+        drop_index('case', 'court', 'pacertracker.court'),
+        drop_index('entry', 'case', 'pacertracker.case'),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.13 on 2026-10-19 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacertracker', '0010_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='case',
+            name='entry_count',
+            field=models.IntegerField(default=0, editable=False, help_text='Entries saved for the case.'),
+        ),
+        migrations.AddField(
+            model_name='case',
+            name='last_captured',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the most recent entry was saved.', null=True),
+        ),
+        migrations.AddField(
+            model_name='case',
+            name='last_filed',
+            field=models.DateTimeField(blank=True, editable=False, help_text="When the most recently filed entry was filed, according to the court's clock.", null=True),
+        ),
+        # Count the entries already saved, which trackcases keeps up to date from now on
+        migrations.RunSQL(
+            """
+            UPDATE pacertracker_case c SET entry_count = e.entry_count, last_filed = e.last_filed,
+                                           last_captured = e.last_captured
+            FROM (SELECT case_id, count(*) AS entry_count, max(time_filed) AS last_filed,
+                         max(captured_time) AS last_captured
+                  FROM pacertracker_entry GROUP BY case_id) e
+            WHERE c.id = e.case_id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
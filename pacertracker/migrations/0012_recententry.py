@@ -0,0 +1,54 @@
+# Generated by Django 3.2.13 on 2026-10-19 03:05
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_recent_entries(apps, schema_editor):
+    """
+    Copies the entries captured within RECENT_ENTRIES_DAYS, which alerts will read from now on
+    """
+    since = (datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc) -
+             datetime.timedelta(days=getattr(settings, 'RECENT_ENTRIES_DAYS', 7)))
+    schema_editor.execute("""
+        INSERT INTO pacertracker_recententry (entry_id, case_id, court_id, case_type, time_filed, captured_time)
+        SELECT e.id, e.case_id, c.court_id, c.type, e.time_filed, e.captured_time
+        FROM pacertracker_entry e JOIN pacertracker_case c ON c.id = e.case_id WHERE e.captured_time >= %s
+        """, [since])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacertracker', '0011_case_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecentEntry',
+            fields=[
+                ('entry_id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('case_type', models.CharField(choices=[('1CV', 'Civil'), ('2CR', 'Criminal'), ('3BK', 'Bankruptcy'), ('4AP', 'Appeals'), ('5MD', 'Multi-District Litigation'), ('6VC', 'Vaccine'), ('7CG', 'Congressional Record')], editable=False, max_length=3)),
+                ('time_filed', models.DateTimeField(editable=False)),
+                ('captured_time', models.DateTimeField(editable=False)),
+                ('case', models.ForeignKey(db_constraint=False, db_index=False, editable=False, on_delete=django.db.models.deletion.DO_NOTHING, to='pacertracker.case')),
+                ('court', models.ForeignKey(db_constraint=False, db_index=False, editable=False, on_delete=django.db.models.deletion.DO_NOTHING, to='pacertracker.court')),
+            ],
+            options={
+                'verbose_name_plural': 'recent entries',
+            },
+        ),
+        # Fill the table before building its indexes, which is much faster than the other way around
+        migrations.RunPython(fill_recent_entries, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recententry',
+            index=models.Index(fields=['captured_time', 'entry_id'], name='recent_captured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recententry',
+            index=models.Index(fields=['case', 'captured_time'], name='recent_case_captured_idx'),
+        ),
+    ]
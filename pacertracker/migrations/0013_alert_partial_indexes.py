@@ -0,0 +1,28 @@
+# Generated by Django 3.2.13 on 2026-10-19 03:40
+
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking the alert table against sendemails
+    atomic = False
+
+    dependencies = [
+        ('pacertracker', '0012_recententry'),
+    ]
+
+    operations = [
+        RemoveIndexConcurrently(
+            model_name='alert',
+            name='alert_live_user_idx',
+        ),
+        AddIndexConcurrently(
+            model_name='alert',
+            index=models.Index(condition=models.Q(live_updates=True), fields=['user', 'words'], name='alert_live_user_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='alert',
+            index=models.Index(condition=models.Q(live_updates=False), fields=['user', 'words'], name='alert_daily_user_idx'),
+        ),
+    ]
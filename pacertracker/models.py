@@ -2,6 +2,8 @@ import uuid
 
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 class Alert(models.Model):
     #The blank choice is needed for the alerts page form
@@ -17,6 +19,17 @@ class Alert(models.Model):
     only_new_cases = models.BooleanField(default=False)
     live_updates = models.BooleanField(default=False)
     last_checked = models.DateTimeField(auto_now_add=True, editable=False)
+    digest_checked = models.DateTimeField(editable=False, blank=True, null=True,
+        help_text='Daily alerts only. Time up to which matches have been added to the digest.')
+
+    class Meta:
+        # Live and daily runs each read only their own alerts, so each has a smaller index
+        indexes = [
+            models.Index(fields=['user', 'words'], name='alert_live_user_idx',
+                         condition=models.Q(live_updates=True)),
+            models.Index(fields=['user', 'words'], name='alert_daily_user_idx',
+                         condition=models.Q(live_updates=False)),
+        ]
 
     def __str__(self):
         return self.user.username + ' - '+ self.words
@@ -51,6 +64,31 @@ class Court(models.Model):
         return (self.type, self.name)
 
 
+class FeedHealth(models.Model):
+    """
+    Recent results of downloading a court's feed, used to back off from broken feeds.
+    """
+    court = models.OneToOneField('Court', on_delete=models.CASCADE, related_name='health')
+    results = models.JSONField(default=list, blank=True,
+        help_text='Whether each recent download worked, oldest first.')
+    latencies = models.JSONField(default=list, blank=True,
+        help_text='Seconds taken by each recent successful download, oldest first.')
+    consecutive_failures = models.IntegerField(default=0)
+    last_success = models.DateTimeField(blank=True, null=True)
+    last_failure = models.DateTimeField(blank=True, null=True)
+    last_error = models.CharField(max_length=500, blank=True)
+    last_good_build = models.DateTimeField(blank=True, null=True,
+        help_text='Build date of the last feed that could be read, from the court\'s clock.')
+    next_attempt = models.DateTimeField(blank=True, null=True,
+        help_text='Trackcases skips the feed until then.')
+
+    class Meta:
+        verbose_name_plural = 'feed health'
+
+    def __str__(self):
+        return str(self.court)
+
+
 class CourtGroup(models.Model):
     user = models.ForeignKey(User, editable=False, on_delete=models.CASCADE)
     name = models.CharField(max_length=75)
@@ -71,7 +109,8 @@ class Case(models.Model):
         ('7CG', 'Congressional Record'),
     )
     id = models.BigIntegerField(primary_key=True, editable=False) # CHANGE THIS TO PRIMARY KEY AND THEN MODIFY CODE
-    court = models.ForeignKey('Court', on_delete=models.CASCADE)
+    # Indexed as the start of case_court_updated_idx
+    court = models.ForeignKey('Court', on_delete=models.CASCADE, db_index=False)
     title = models.CharField(max_length=500)
     number = models.CharField(max_length=50)
     name = models.CharField(max_length=500)
@@ -81,6 +120,21 @@ class Case(models.Model):
     updated_time = models.DateTimeField(auto_now=True)
     is_date_filed = models.BooleanField(default=False, 
         help_text='Is captured_time the date (but not the time) case was filed? Note: time is used for filtering.')
+    search_vector = SearchVectorField(editable=False, blank=True, null=True,
+        help_text='Full-text index of the title, used when CASE_SEARCH_BACKEND is postgres.')
+    entry_count = models.IntegerField(default=0, editable=False, help_text='Entries saved for the case.')
+    last_filed = models.DateTimeField(editable=False, blank=True, null=True,
+        help_text='When the most recently filed entry was filed, according to the court\'s clock.')
+    last_captured = models.DateTimeField(editable=False, blank=True, null=True,
+        help_text='When the most recent entry was saved.')
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='case_search_vector_idx'),
+            models.Index(fields=['court', 'updated_time', 'id'], name='case_court_updated_idx'),
+            models.Index(fields=['captured_time'], name='case_captured_idx'),
+            models.Index(fields=['updated_time', 'id'], name='case_updated_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -88,7 +142,8 @@ class Case(models.Model):
 
 class Entry(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    case = models.ForeignKey('Case', on_delete=models.CASCADE)
+    # Indexed as the start of entry_case_filed_idx
+    case = models.ForeignKey('Case', on_delete=models.CASCADE, db_index=False)
     time_filed = models.DateTimeField(help_text='According to court\'s clock.', editable=False)
     captured_time = models.DateTimeField(auto_now_add=True, editable=False)
     description = models.CharField(max_length=500)
@@ -97,7 +152,53 @@ class Entry(models.Model):
 
     class Meta:
         verbose_name_plural = 'entries'
+        indexes = [
+            models.Index(fields=['case', 'time_filed', 'id'], name='entry_case_filed_idx'),
+            models.Index(fields=['captured_time', 'id'], name='entry_captured_idx'),
+            models.Index(fields=['case', 'captured_time'], name='entry_case_captured_idx'),
+        ]
 
     def __str__(self):
         return self.description
 
+
+class RecentEntry(models.Model):
+    """
+    The keys of an entry captured in the last few days, which alerts and the live feed search instead of Entry.
+    """
+    entry_id = models.UUIDField(primary_key=True, editable=False)
+    # Rows are trimmed by age, not kept in step with their case, so nothing is checked on insert
+    case = models.ForeignKey('Case', on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                             editable=False)
+    court = models.ForeignKey('Court', on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                              editable=False)
+    case_type = models.CharField(max_length=3, choices=Case.CASE_TYPES, editable=False)
+    time_filed = models.DateTimeField(editable=False)
+    captured_time = models.DateTimeField(editable=False)
+
+    class Meta:
+        verbose_name_plural = 'recent entries'
+        indexes = [
+            models.Index(fields=['captured_time', 'entry_id'], name='recent_captured_idx'),
+            models.Index(fields=['case', 'captured_time'], name='recent_case_captured_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.entry_id)
+
+
+class Digest(models.Model):
+    """
+    A case matched by a daily alert since its last email, accumulated during the day.
+    """
+    alert = models.ForeignKey('Alert', on_delete=models.CASCADE)
+    case = models.ForeignKey('Case', on_delete=models.CASCADE)
+    entry_count = models.IntegerField(default=0, help_text='New entries found for the case.')
+    entry_ids = models.JSONField(default=list, blank=True,
+        help_text='Ids of the most recently filed new entries, newest first.')
+
+    class Meta:
+        unique_together = ('alert', 'case')
+
+    def __str__(self):
+        return str(self.alert) + ' - ' + str(self.case_id)
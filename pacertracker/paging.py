@@ -0,0 +1,102 @@
+import json
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connection
+from django.http import Http404
+from django.utils.functional import cached_property
+
+utc = datetime.timezone.utc
+epoch = datetime.datetime(1970, 1, 1, tzinfo=utc)
+
+#Estimated counts below this are replaced by an exact count, which is cheap at that size
+EXACT_COUNT_BELOW = 10000
+
+
+def get_cursor(obj, time_field, id_field='id'):
+    """
+    Returns the cursor pointing just past an object, as microseconds and an id
+    """
+    delta = getattr(obj, time_field) - epoch
+    microseconds = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return '%d.%s' % (microseconds, getattr(obj, id_field))
+
+
+def parse_cursor(model, cursor, id_field='id'):
+    """
+    Returns the time and id in a cursor, raising Http404 if it is not valid
+    """
+    try:
+        microseconds, pk = cursor.split('.', 1)
+        timestamp = epoch + datetime.timedelta(microseconds=int(microseconds))
+        pk = model._meta.get_field(id_field).to_python(pk)
+    except (ValueError, OverflowError, ValidationError):
+        raise Http404('Invalid page.')
+
+    return timestamp, pk
+
+
+def get_keyset_page(queryset, time_field, cursor=None, page_size=50, id_field='id'):
+    """
+    Returns a page of objects, newest first, and the cursor for the next page
+
+    Instead of an OFFSET, each page seeks past the last (time, id) of the one before
+    with a row comparison, which an index on the two fields (after any equality
+    filters) answers directly however deep the page. No rows are counted; one extra
+    row is fetched to tell whether there is a next page.
+    """
+    model = queryset.model
+    queryset = queryset.order_by('-' + time_field, '-' + id_field)
+
+    if cursor:
+        timestamp, pk = parse_cursor(model, cursor, id_field)
+        qn = connection.ops.quote_name
+        table = qn(model._meta.db_table)
+        queryset = queryset.extra(
+            where=['(%s.%s, %s.%s) < (%%s, %%s)' % (
+                   table, qn(model._meta.get_field(time_field).column),
+                   table, qn(model._meta.get_field(id_field).column))],
+            params=[timestamp, pk])
+
+    objects = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(objects) > page_size:
+        objects = objects[:page_size]
+        next_cursor = get_cursor(objects[-1], time_field, id_field)
+
+    return objects, next_cursor
+
+
+def get_estimated_count(queryset):
+    """
+    Returns the number of rows PostgreSQL's planner expects a queryset to return
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginates with the planner's estimate of the number of rows instead of COUNT(*)
+
+    Counting hundreds of millions of entries takes minutes, while the estimate
+    comes from table statistics. Small results are still counted exactly. The
+    last pages of a large result may turn out to be empty.
+    """
+    @cached_property
+    def count(self):
+        if connection.vendor != 'postgresql' or not hasattr(self.object_list, 'query'):
+            return super().count
+
+        estimate = get_estimated_count(self.object_list)
+        if estimate < EXACT_COUNT_BELOW:
+            return super().count
+
+        return estimate
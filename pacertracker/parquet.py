@@ -0,0 +1,122 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+#Rows in each row group, which is also the most rows held in memory at once
+ROW_GROUP_SIZE = 100000
+COMPRESSION = 'zstd'
+
+TIMESTAMP = pa.timestamp('us', tz='UTC')
+UUID = pa.binary(16)
+
+#Columns of each table, named as in the CSV archives
+court_schema = pa.schema([('id', pa.int32()),
+                          ('name', pa.string()),
+                          ('type', pa.string()),
+                          ('has_feed', pa.bool_()),
+                          ('publishes_all', pa.bool_()),
+                          ('filing_types', pa.string()),
+                          ('feed_url', pa.string()),
+                          ('website', pa.string()),
+                          ('last_updated', TIMESTAMP)])
+case_schema = pa.schema([('id', pa.int64()),
+                         ('number', pa.string()),
+                         ('name', pa.string()),
+                         ('type', pa.string()),
+                         ('website', pa.string()),
+                         ('captured_time', TIMESTAMP),
+                         ('is_date_filed', pa.bool_()),
+                         ('court_id', pa.int32()),
+                         ('updated_time', TIMESTAMP)])
+entry_schema = pa.schema([('id', UUID),
+                          ('time_filed', TIMESTAMP),
+                          ('captured_time', TIMESTAMP),
+                          ('description', pa.string()),
+                          ('number', pa.int32()),
+                          ('website', pa.string()),
+                          ('case_id', pa.int64())])
+
+#Columns with few distinct values in each row group, which are dictionary encoded
+case_dictionary = ['type', 'court_id']
+entry_dictionary = ['description', 'number', 'case_id']
+
+
+def get_table(schema, rows):
+    """
+    Returns rows from values_list() as an Arrow table
+    """
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if field.type == UUID:
+            values = [value.bytes for value in values]
+        arrays.append(pa.array(values, type=field.type))
+
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def get_temp_filename(filename):
+    #Dataset readers skip files starting with a dot
+    return os.path.join(os.path.dirname(filename), '.%s.tmp' % os.path.basename(filename))
+
+
+def get_writer(filename, schema, dictionary):
+    return pq.ParquetWriter(get_temp_filename(filename), schema,
+                            use_dictionary=dictionary, compression=COMPRESSION)
+
+
+def write_file(filename, schema, rows, dictionary=True):
+    """
+    Writes rows to one Parquet file, a row group at a time
+    """
+    writer = get_writer(filename, schema, dictionary)
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= ROW_GROUP_SIZE:
+                writer.write_table(get_table(schema, batch))
+                batch = []
+        if batch:
+            writer.write_table(get_table(schema, batch))
+    finally:
+        writer.close()
+    os.replace(get_temp_filename(filename), filename)
+
+
+def write_partitioned(path, schema, rows, part_name, dictionary=True, time_field='captured_time'):
+    """
+    Writes rows, oldest first, to a new part file in each year/month partition they fall in
+
+    Row groups are written as rows come off the iterator, so memory does not grow
+    with the number of rows. Part files only get their name once every one of them
+    is complete. Returns the files written and the last row.
+    """
+    time_index = schema.names.index(time_field)
+    files, writer, partition, batch, last_row = [], None, None, [], None
+    try:
+        for row in rows:
+            row_partition = 'year=%d/month=%02d' % (row[time_index].year, row[time_index].month)
+            if batch and (row_partition != partition or len(batch) >= ROW_GROUP_SIZE):
+                writer.write_table(get_table(schema, batch))
+                batch = []
+            if row_partition != partition:
+                if writer:
+                    writer.close()
+                partition = row_partition
+                os.makedirs(os.path.join(path, partition), exist_ok=True)
+                files.append(os.path.join(path, partition, part_name))
+                writer = get_writer(files[-1], schema, dictionary)
+            batch.append(row)
+            last_row = row
+
+        if batch:
+            writer.write_table(get_table(schema, batch))
+    finally:
+        if writer:
+            writer.close()
+
+    for filename in files:
+        os.replace(get_temp_filename(filename), filename)
+
+    return files, last_row
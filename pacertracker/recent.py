@@ -0,0 +1,66 @@
+import datetime
+
+from django.conf import settings
+from django.db import connection
+
+from pacertracker.models import Case, Entry, RecentEntry
+
+utc = datetime.timezone.utc
+
+
+def get_recent_days():
+    return getattr(settings, 'RECENT_ENTRIES_DAYS', 7)
+
+
+def get_recent_cutoff(now=None):
+    """
+    Returns the time from which every captured entry is in the recent entry table
+    """
+    now = now or datetime.datetime.utcnow().replace(tzinfo=utc)
+    return now - datetime.timedelta(days=get_recent_days())
+
+
+def get_recent_entries(since):
+    """
+    Returns the recent entries captured since a time, or None if some of them may have been trimmed
+    """
+    if since < get_recent_cutoff():
+        return None
+    return RecentEntry.objects.filter(captured_time__gte=since)
+
+
+def save_recent_entries(entries, cases):
+    """
+    Adds newly saved entries to the recent entry table, given their cases by id
+    """
+    RecentEntry.objects.bulk_create([RecentEntry(entry_id=entry.id, case_id=entry.case_id,
+                                                 court_id=cases[entry.case_id].court_id,
+                                                 case_type=cases[entry.case_id].type,
+                                                 time_filed=entry.time_filed,
+                                                 captured_time=entry.captured_time) for entry in entries],
+                                    ignore_conflicts=True)
+
+
+def fill_recent_entries(since):
+    """
+    Adds the entries captured since a time that are missing from the recent entry table
+
+    Returns how many were added.
+    """
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO %s (entry_id, case_id, court_id, case_type, time_filed, captured_time)
+            SELECT e.id, e.case_id, c.court_id, c.type, e.time_filed, e.captured_time
+            FROM %s e JOIN %s c ON c.id = e.case_id WHERE e.captured_time >= %%s
+            ON CONFLICT DO NOTHING
+            """ % (quote(RecentEntry._meta.db_table), quote(Entry._meta.db_table), quote(Case._meta.db_table)),
+            [since])
+        return cursor.rowcount
+
+
+def trim_recent_entries(cutoff):
+    """
+    Removes the entries captured before cutoff from the recent entry table, and returns how many there were
+    """
+    return RecentEntry.objects.filter(captured_time__lt=cutoff).delete()[0]
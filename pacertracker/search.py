@@ -0,0 +1,151 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, Window
+
+from haystack.query import SearchQuerySet
+
+from pacertracker.models import Case
+
+#Text search configuration used for Case.search_vector
+SEARCH_CONFIG = 'english'
+#Solr's NOT and ! before a word, which websearch_to_tsquery writes as -
+NOT_OPERATOR = re.compile(r'(^|\s)(?:NOT|!)\s+')
+#Solr's AND and &&, which websearch_to_tsquery leaves out between words anyway
+AND_OPERATOR = re.compile(r'(^|\s)(?:AND|&&)(?=\s|$)')
+
+
+def get_lookup_result(pk, title, court_type, court_name):
+    """
+    Returns a case lookup hit in the form of a serialized case with a natural court key
+    """
+    return {'model': 'pacertracker.case',
+            'pk': int(pk),
+            'fields': {'title': title, 'court': [court_type, court_name]}}
+
+
+def get_search_query(words):
+    """
+    Returns alert words as a full-text query, understanding the Solr syntax alerts use
+
+    Quoted phrases, OR and - (or NOT) work the way they do with Solr.
+    """
+    return SearchQuery(get_websearch_words(words), config=SEARCH_CONFIG, search_type='websearch')
+
+
+def get_websearch_words(words):
+    """
+    Returns alert words rewritten in the syntax websearch_to_tsquery understands
+    """
+    return AND_OPERATOR.sub(r'\1', NOT_OPERATOR.sub(r'\1-', words))
+
+
+def get_search_vector():
+    """
+    Returns the expression used to fill Case.search_vector
+    """
+    return SearchVector('title', config=SEARCH_CONFIG)
+
+
+class HaystackCaseSearch(object):
+    """
+    Searches cases through the Haystack index (Solr).
+    """
+    def case_ids(self, courts, words='', exclude_type='', captured_since=None,
+                 updated_since=None, limit=160):
+        cases = SearchQuerySet().models(Case).filter(court__in=courts)
+
+        if words:
+            cases = cases.filter(content=words)
+        if exclude_type:
+            cases = cases.exclude(type=exclude_type)
+        if captured_since:
+            cases = cases.filter(captured_time__gte=captured_since)
+        if updated_since:
+            cases = cases.filter(updated_time__gte=updated_since)
+
+        return list(cases.order_by('type').values_list('pk', flat=True)[:limit])
+
+    def lookup(self, words, courts, exclude_type='', limit=30):
+        cases = SearchQuerySet().models(Case).filter(content=words, court__in=courts)
+        if exclude_type:
+            cases = cases.exclude(type=exclude_type)
+
+        #Slicing runs the query, which also returns the hit count, and the stored
+        #fields mean no case has to be loaded from the database
+        results = [get_lookup_result(q.pk, q.title, q.court_type, q.court_name) for q in cases[:limit]]
+
+        return results, cases.count()
+
+    def has_terms(self, words):
+        #Which words Solr leaves out depends on its schema, so none are assumed to count
+        return False
+
+    def update_index(self, start_date):
+        call_command('update_index', start_date=start_date.isoformat(), verbosity=0)
+
+
+class PostgresCaseSearch(object):
+    """
+    Searches cases through the full-text index on Case.search_vector.
+
+    The vectors are filled by trackcases whenever it saves a case, so there is
+    no separate index to update.
+    """
+    def search(self, courts, words='', exclude_type=''):
+        cases = Case.objects.filter(court__in=courts)
+
+        if words:
+            cases = cases.filter(search_vector=get_search_query(words))
+        if exclude_type:
+            cases = cases.exclude(type=exclude_type)
+
+        return cases
+
+    def case_ids(self, courts, words='', exclude_type='', captured_since=None,
+                 updated_since=None, limit=160):
+        cases = self.search(courts, words, exclude_type)
+
+        if captured_since:
+            cases = cases.filter(captured_time__gte=captured_since)
+        if updated_since:
+            cases = cases.filter(updated_time__gte=updated_since)
+
+        return list(cases.order_by('type').values_list('id', flat=True)[:limit])
+
+    def lookup(self, words, courts, exclude_type='', limit=30):
+        cases = self.search(courts, words, exclude_type)
+
+        #The window count gives the total number of hits in the same query
+        cases = cases.annotate(total=Window(Count('id'))).values_list(
+                               'id', 'title', 'court__type', 'court__name', 'total')[:limit]
+        results, count = [], 0
+        for pk, title, court_type, court_name, count in cases:
+            results.append(get_lookup_result(pk, title, court_type, court_name))
+
+        return results, count
+
+    def has_terms(self, words):
+        """
+        Returns whether any of the words are searched for, rather than left out like "the"
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT numnode(websearch_to_tsquery(%s::regconfig, %s))',
+                           [SEARCH_CONFIG, get_websearch_words(words)])
+            return cursor.fetchone()[0] > 0
+
+    def update_index(self, start_date):
+        pass
+
+
+def get_search_backend():
+    """
+    Returns the case search backend chosen by the CASE_SEARCH_BACKEND setting
+    """
+    if getattr(settings, 'CASE_SEARCH_BACKEND', 'haystack') == 'postgres':
+        return PostgresCaseSearch()
+
+    return HaystackCaseSearch()
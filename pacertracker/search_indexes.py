@@ -3,9 +3,13 @@ from haystack import indexes
 from pacertracker.models import Case
 
 #For sendemails, we need court, title, type, is_date_filed, captured_time
+#For the case lookup, we need title and the court's natural key, stored so no objects are loaded
 class CaseIndex(indexes.SearchIndex, indexes.Indexable):
     text = indexes.CharField(document=True, model_attr='title')
+    title = indexes.CharField(model_attr='title', indexed=False)
     court = indexes.IntegerField(model_attr='court__id')
+    court_type = indexes.CharField(model_attr='court__type', indexed=False)
+    court_name = indexes.CharField(model_attr='court__name', indexed=False)
     captured_time = indexes.DateTimeField(model_attr='captured_time')
     updated_time = indexes.DateTimeField(model_attr='updated_time')
     type = indexes.CharField(model_attr='type')
@@ -14,5 +18,8 @@ class CaseIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return Case
         
+    def index_queryset(self, using=None):
+        return self.get_model().objects.select_related('court')
+
     def get_updated_field(self):
         return "updated_time"
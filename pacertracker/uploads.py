@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import datetime
+import logging
+
+from concurrent import futures
+
+from django.conf import settings
+
+utc = datetime.timezone.utc
+logger = logging.getLogger(__name__)
+
+
+def get_md5(filename):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+class InternetArchiveTarget(object):
+    """
+    Uploads files to an Internet Archive item
+    """
+    def __init__(self, identifier, access_key, secret_key):
+        self.identifier = identifier
+        self.access_key = access_key
+        self.secret_key = secret_key
+
+    def upload(self, name, filename, md5):
+        from internetarchive import upload
+
+        # verify sends the MD5 with the file, and the upload is refused if what arrived does not match
+        for response in upload(self.identifier, files={name: filename}, verify=True,
+                               access_key=self.access_key, secret_key=self.secret_key):
+            response.raise_for_status()
+
+
+class LocalDirectoryTarget(object):
+    """
+    Copies files to a local directory, standing in for the Internet Archive
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def upload(self, name, filename, md5):
+        destination = os.path.join(self.path, name)
+        if not os.path.exists(os.path.dirname(destination)):
+            os.makedirs(os.path.dirname(destination))
+        shutil.copyfile(filename, destination + '.tmp')
+        if get_md5(destination + '.tmp') != md5:
+            os.remove(destination + '.tmp')
+            raise IOError('The copy of %s does not match it.' % name)
+        os.replace(destination + '.tmp', destination)
+
+
+def get_upload_target(path=None):
+    """
+    Returns the target chosen by the ARCHIVE_UPLOAD_DIR setting, or the Internet Archive
+    """
+    path = path or getattr(settings, 'ARCHIVE_UPLOAD_DIR', None)
+    if path:
+        return LocalDirectoryTarget(path)
+
+    return InternetArchiveTarget(settings.IA_IDENTIFIER, settings.IA_ACCESS_KEY, settings.IA_SECRET_KEY)
+
+
+class UploadManager(object):
+    """
+    Uploads the files that changed since they were last uploaded, in parallel and with retries
+
+    A manifest records the MD5 of each file as it was last uploaded, so unchanged
+    files are skipped and a run that fails part way only leaves the rest to
+    upload. Files whose size and modification time match the manifest are not
+    read again to check them. A file is only added to the manifest once the
+    target has checked that what it received has the file's MD5.
+    """
+    def __init__(self, target, manifest_filename, workers=None, retries=None, backoff=None):
+        self.target = target
+        self.manifest_filename = manifest_filename
+        self.workers = workers or getattr(settings, 'ARCHIVE_UPLOAD_WORKERS', 4)
+        self.retries = retries if retries is not None else getattr(settings, 'ARCHIVE_UPLOAD_RETRIES', 3)
+        self.backoff = backoff if backoff is not None else getattr(settings, 'ARCHIVE_UPLOAD_BACKOFF', 5)
+        self.manifest = {}
+        if os.path.exists(manifest_filename):
+            with open(manifest_filename) as file:
+                self.manifest = json.load(file)
+
+    def save_manifest(self):
+        with open(self.manifest_filename + '.tmp', 'w') as out:
+            json.dump(self.manifest, out, indent=1, sort_keys=True)
+        os.replace(self.manifest_filename + '.tmp', self.manifest_filename)
+
+    def get_changes(self, files):
+        """
+        Returns the files that differ from the manifest, with their MD5, size and modification time
+        """
+        changes = {}
+        for name, filename in files.items():
+            stat = os.stat(filename)
+            uploaded = self.manifest.get(name)
+            if uploaded and uploaded['size'] == stat.st_size and uploaded['mtime'] == stat.st_mtime:
+                continue
+            md5 = get_md5(filename)
+            if uploaded and uploaded['md5'] == md5:
+                # Touched but not changed, so remember when it was last seen
+                uploaded['mtime'] = stat.st_mtime
+                continue
+            changes[name] = {'md5': md5, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+        return changes
+
+    def upload_file(self, name, filename, md5):
+        for attempt in range(self.retries + 1):
+            try:
+                return self.target.upload(name, filename, md5)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning('WARNING - %s - Upload of %s failed, trying again. - %s' % (
+                               datetime.datetime.utcnow().replace(tzinfo=utc), name, e))
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def upload(self, files):
+        """
+        Uploads files, a list of paths or a dict of paths keyed by name, and returns the
+        names of those uploaded, those skipped and those that failed
+        """
+        if not isinstance(files, dict):
+            files = dict([(os.path.basename(f), f) for f in files])
+
+        changes = self.get_changes(files)
+        uploaded, failed = [], []
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            jobs = dict([(executor.submit(self.upload_file, name, files[name], changes[name]['md5']), name)
+                         for name in sorted(changes)])
+            for job in futures.as_completed(jobs):
+                name = jobs[job]
+                if job.exception() is not None:
+                    failed.append(name)
+                    logger.error('ERROR - %s - Upload of %s failed. - %s' % (
+                                 datetime.datetime.utcnow().replace(tzinfo=utc), name, job.exception()))
+                    continue
+                self.manifest[name] = dict(changes[name],
+                                           uploaded=datetime.datetime.utcnow().replace(tzinfo=utc).isoformat())
+                uploaded.append(name)
+                self.save_manifest()
+
+        self.save_manifest()
+        skipped = [name for name in files if name not in changes]
+
+        return sorted(uploaded), sorted(skipped), sorted(failed)
@@ -14,6 +14,10 @@ urlpatterns = [
 	url(r'^alerts/', views.alerts, name='alerts'),
     url(r'^groups/', views.groups, name='groups'),
 	url(r'^lookup/$', views.case_lookup, name='lookup'),
+	url(r'^live/$', views.live_entries, name='live_entries'),
+	url(r'^courts/$', views.courts, name='courts'),
+	url(r'^courts/(?P<court_id>\d+)/$', views.court_cases, name='court_cases'),
+	url(r'^cases/(?P<case_id>\d+)/$', views.case_docket, name='case_docket'),
 	url(r'^change_password/', views.change_password, name='change_password'),
 	url(r'^password/reset/$',
         PasswordResetView.as_view(success_url='/password/reset/done/',
@@ -1,21 +1,31 @@
 # Create your views here.
 import sys
-from django.core import serializers
+import hashlib
 import simplejson
 
-from django.http import HttpResponse, HttpResponseRedirect
+from django.conf import settings
+from django.core.cache import cache
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotModified
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control
 from django.templatetags.static import static
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import auth
 from django.contrib.auth.models import User
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Prefetch, Q
 from django.forms.models import modelformset_factory
 from django.forms import CheckboxSelectMultiple
 
-from haystack.query import SearchQuerySet
-from haystack.inputs import Clean
-
 from pacertracker.forms import PasswordReset, AlertForm, CourtSelectMultiple
-from pacertracker.models import Alert, Court, CourtGroup, Case
+from pacertracker.models import Alert, Court, CourtGroup, Case, Entry
+from pacertracker.livefeed import live_feed, get_subscription_alerts
+from pacertracker.paging import get_keyset_page
+from pacertracker.search import get_search_backend
+
+#Cases or entries shown on each page of the browsing pages
+BROWSE_PAGE_SIZE = 50
 
 def index(request):
     #Prepare user list needed by login shortcut
@@ -33,9 +43,13 @@ def alerts(request):
 
     AlertFormSet = modelformset_factory(Alert, form=AlertForm, extra=1, max_num=100, can_delete=True)
 
+    # Courts are prefetched so forms do not each query their own
+    alerts = Alert.objects.filter(user=request.user).prefetch_related(
+        Prefetch('courts', queryset=Court.objects.only('id')))
+
     if request.method == 'POST':
         alert_form = AlertFormSet(request.POST, 
-                                        queryset=Alert.objects.filter(user=request.user))
+                                        queryset=alerts)
         if alert_form.is_valid():
             instances = alert_form.save(commit=False)
             for instance in instances:
@@ -47,17 +61,16 @@ def alerts(request):
             
             return redirect('alerts')
     else:
-       alert_form = AlertFormSet(queryset=Alert.objects.filter(user=request.user).order_by('id'))
+       alert_form = AlertFormSet(queryset=alerts.order_by('id'))
         
+    # Each group's court ids are aggregated in the same query as the groups
     court_groups = []
-    court_group = {}
-    for group in CourtGroup.objects.filter(user=request.user).order_by('name'):
-        court_group['id'] = group.id
-        court_group['name'] = group.name
-        court_group['court_array'] = str(list(group.courts.values_list('id', flat = True))
-                                         ).replace('[','').replace(']','').replace(',','')
-        court_groups.append(court_group)
-        court_group = {}
+    for group in CourtGroup.objects.filter(user=request.user).order_by('name').annotate(
+                     court_ids=ArrayAgg('courts__id', filter=Q(courts__isnull=False))
+                     ).values('id', 'name', 'court_ids'):
+        court_groups.append({'id': group['id'],
+                             'name': group['name'],
+                             'court_array': ' '.join([str(x) for x in sorted(group['court_ids'] or [])])})
     
     context = {
         'formset' : alert_form,
@@ -66,31 +79,74 @@ def alerts(request):
         }
     return render(request, 'pacertracker/alerts.html', context)
     
+def get_court_ids(value):
+    """
+    Returns the distinct court ids in a comma separated list, sorted, leaving out any that are not numbers
+    """
+    court_ids = set()
+    for court_id in value.split(','):
+        try:
+            court_ids.add(int(court_id))
+        except ValueError:
+            continue
+    return sorted(court_ids)
+
+def get_lookup_cache_key(value, courts, exclude_type):
+    key = '%s|%s|%s' % (value, ','.join([str(x) for x in courts]), exclude_type)
+    return 'pacertracker:lookup:' + hashlib.md5(key.encode('utf-8')).hexdigest()
+
 def case_lookup(request):
     # Default return list
     data = ''
+    etag = None
+    timeout = getattr(settings, 'CASE_LOOKUP_CACHE_TIMEOUT', 60)
     if request.method == "GET":
         if 'query' in request.GET and 'courts' in request.GET:
-            value = request.GET[u'query']
-            courts = request.GET[u'courts'].split(',')
+            value = ' '.join(request.GET[u'query'].split())
+            courts = get_court_ids(request.GET[u'courts'])
             # Ignore blank queries or no courts
-            if len(value) > 0 and (len(courts) > 0 and len(courts[0]) > 0):
-                cases = SearchQuerySet().filter(content=value, court__in=courts)
+            if len(value) > 0 and len(courts) > 0:
                 if 'type' in request.GET and (request.GET[u'type'] == '1CV' 
                     or request.GET[u'type'] == '2CR'):
-                    cases = cases.exclude(type=request.GET[u'type'])
-                results = simplejson.loads(
-                    serializers.serialize(
-                        'json', [q.object for q in cases[:30]], 
-                                fields=('title','court'), 
-                                use_natural_foreign_keys=True, 
-                                use_natural_primary_keys=True))
-                data = {}
-                data['results'] = results
-                data['count'] = cases.count()
-                data = simplejson.dumps(data)
-
-    return HttpResponse(data, content_type='application/json')
+                    exclude_type = request.GET[u'type']
+                else:
+                    exclude_type = ''
+                
+                # Responses are cached briefly because this is called as the user types.
+                # All words must match, so if the words typed so far found nothing,
+                # adding more words will not find anything either (unless they use search syntax,
+                # or the words so far were all left out of the search, like "the").
+                words = value.split(' ')
+                cache_keys = [get_lookup_cache_key(' '.join(words[:i]), courts, exclude_type) 
+                              for i in range(1, len(words) + 1)]
+                if not all([x.isalnum() and x not in ('AND', 'OR', 'NOT') for x in words]):
+                    cache_keys = cache_keys[-1:]
+                cached = cache.get_many(cache_keys)
+                
+                if cache_keys[-1] in cached:
+                    data, etag, count = cached[cache_keys[-1]]
+                else:
+                    search = get_search_backend()
+                    if any([x[2] == 0 for x in cached.values()]):
+                        results, count = [], 0
+                    else:
+                        results, count = search.lookup(value, courts, exclude_type)
+                    data = simplejson.dumps({'results': results, 'count': count})
+                    etag = '"%s"' % hashlib.md5(data.encode('utf-8')).hexdigest()
+                    # The count is only cached for longer queries to rely on if the words were searched for
+                    if count == 0 and not search.has_terms(value):
+                        count = None
+                    cache.set(cache_keys[-1], (data, etag, count), timeout)
+
+    if etag and etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(data, content_type='application/json')
+    if etag:
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=timeout)
+
+    return response
     
 def groups(request):
     if not request.user.is_authenticated:
@@ -104,9 +160,13 @@ def groups(request):
                                              can_delete=True,
                                              widgets={'courts': CourtSelectMultiple()},)
 
+    # Courts are prefetched so forms do not each query their own
+    court_groups = CourtGroup.objects.filter(user=request.user).order_by('id').prefetch_related(
+        Prefetch('courts', queryset=Court.objects.only('id')))
+
     if request.method == 'POST':
         formset = CourtGroupFormSet(request.POST, 
-                                    queryset=CourtGroup.objects.filter(user=request.user).order_by('id'))
+                                    queryset=court_groups)
         if formset.is_valid():
             instances = formset.save(commit=False)
             for instance in instances:
@@ -118,12 +178,69 @@ def groups(request):
             
             return redirect('alerts')
     else:
-       formset = CourtGroupFormSet(queryset=CourtGroup.objects.filter(user=request.user).order_by('id'))
+       formset = CourtGroupFormSet(queryset=court_groups)
     
     return render(request, 'pacertracker/group_form.html', 
                   {'formset': formset}
                   )
     
+def courts(request):
+    if not request.user.is_authenticated:
+        return redirect('index')
+
+    return render(request, 'pacertracker/courts.html',
+                  {'courts': Court.objects.all()})
+
+def court_cases(request, court_id):
+    if not request.user.is_authenticated:
+        return redirect('index')
+
+    court = get_object_or_404(Court, id=court_id)
+    #Most recently updated cases first, seeking past the cursor of the previous page
+    cases, next_cursor = get_keyset_page(
+        Case.objects.filter(court=court).only('id', 'title', 'number', 'type', 'captured_time',
+                                              'updated_time', 'entry_count', 'last_filed'),
+        'updated_time', request.GET.get('before'), BROWSE_PAGE_SIZE)
+
+    return render(request, 'pacertracker/court_cases.html',
+                  {'court': court,
+                   'cases': cases,
+                   'next_cursor': next_cursor,
+                   'is_first_page': not request.GET.get('before')})
+
+def case_docket(request, case_id):
+    if not request.user.is_authenticated:
+        return redirect('index')
+
+    case = get_object_or_404(Case.objects.select_related('court').defer('search_vector'), id=case_id)
+    #Most recently filed entries first, seeking past the cursor of the previous page
+    entries, next_cursor = get_keyset_page(Entry.objects.filter(case=case),
+                                           'time_filed', request.GET.get('before'), BROWSE_PAGE_SIZE)
+
+    return render(request, 'pacertracker/case_docket.html',
+                  {'case': case,
+                   'entries': entries,
+                   'next_cursor': next_cursor,
+                   'is_first_page': not request.GET.get('before')})
+
+def get_live_feed_alerts(request):
+    if not request.user.is_authenticated:
+        return None
+
+    return get_subscription_alerts(request.user)
+
+async def live_entries(request):
+    #The session and alerts are loaded synchronously, the stream itself is not
+    alerts = await sync_to_async(get_live_feed_alerts)(request)
+    if alerts is None:
+        return redirect('index')
+
+    response = StreamingHttpResponse(live_feed.stream(alerts), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    #Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 def change_password(request):
     if not request.user.is_authenticated:
         return redirect('index')
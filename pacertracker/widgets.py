@@ -0,0 +1,218 @@
+import uuid
+
+from django.core.cache import cache
+from django.forms import CheckboxSelectMultiple
+from django.forms.widgets import CheckboxInput
+from django.utils.encoding import force_str
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+from pacertracker.models import Court
+
+#The court picker markup is built once with these in place of each form's name and id
+PICKER_NAME = '__court_picker_name__'
+PICKER_ID = '__court_picker_id__'
+PICKER_VERSION_KEY = 'pacertracker:court_picker_version'
+
+#Built court picker markup, for the version in the cache
+court_picker = {'version': None, 'segments': None}
+
+
+def get_court_image(court):
+    if court['type'] == 'D' and not court['publishes_all'] and court['has_feed']:
+        return ('<i class="fa fa-institution text-danger" title="' +
+                conditional_escape(force_str(court['filing_types'])) + '"></i>')
+    elif court['type'] == 'D' and not court['has_feed']:
+        return '<i class="fa fa-institution court-disabled"></i>'
+    elif court['type'] == 'D':
+        return '<i class="fa fa-institution"></i>'
+    elif court['type'] == 'B' and not court['publishes_all'] and court['has_feed']:
+        return ('<i class="fa fa-usd text-danger" title="' +
+                conditional_escape(force_str(court['filing_types'])) + '"></i>')
+    elif court['type'] == 'B' and not court['has_feed']:
+        return '<i class="fa fa-usd court-disabled"></i>'
+    elif court['type'] == 'B':
+        return '<i class="fa fa-usd"></i>'
+
+
+def invalidate_court_picker():
+    """
+    Makes every process rebuild the court picker the next time it is rendered
+
+    Call this whenever courts are added or changed without saving them one by one.
+    """
+    cache.set(PICKER_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def court_changed(sender, update_fields=None, **kwargs):
+    """
+    Invalidates the court picker when a court is saved or deleted, connected in apps.py
+    """
+    # Trackcases saves last_updated after every feed, which the picker does not show
+    if update_fields and set(update_fields) == set(['last_updated']):
+        return
+    invalidate_court_picker()
+
+
+def render_checkboxes(attrs, court_id):
+    """
+    Returns a court's checkbox, unchecked and checked
+    """
+    return (CheckboxInput(attrs, check_test=lambda value: False).render(PICKER_NAME, court_id),
+            CheckboxInput(attrs, check_test=lambda value: True).render(PICKER_NAME, court_id))
+
+
+def build_court_picker(widget_attrs):
+    """
+    Builds the court picker markup that is the same for every form
+
+    Returns a list of segments. Strings are static markup. Tuples hold a court's
+    id and its markup with the checkbox unchecked and checked.
+    """
+    attrs = {'id': PICKER_ID}
+    #Set up the final_attrs, which will be used in setting id for the checkbox
+    final_attrs = dict(widget_attrs, **attrs)
+
+    div = "<div class='col-lg-3 col-md-4 col-sm-6 col-xs-12'>"
+
+    #Start the html output
+    # output = [u'<div class="row courts">']
+    output = []
+
+    #Start counting the field ids
+    field_id = 0
+
+    #Establish district and bankruptcy images
+    district_img = '<i class="fa fa-institution"></i>'
+    bank_img = '<i class="fa fa-usd"></i>'
+
+    #Start the first column, containing district and bankruptcy courts
+    # output.append(u'<div class="col-sm-4">')
+    output.append(u'<div class="col-xs-12"><h4>District (' + district_img + ') and Bankruptcy Courts (' + bank_img + ')</h4></div>')
+    output.append(u'<div class="col-xs-12 court-legend"><span class="text-danger" style=""><i class="fa fa-institution"></i> Courts in red</span> do not publish all of their filings. They may not alert you as soon as a new case is filed.</div>')
+    output.append(u'<div class="col-xs-12 court-legend"><span class="court-disabled"><i class="fa fa-institution"></i>Courts in gray</span> do not publish any filings. They will not generate any alerts, but you can select them if you suspect this may change.</div>')
+
+    #Note: there are 94 district courts and 94 bankruptcy courts.
+    #So, the first column will have 47 and second will have 47.
+    #has_feed, type, id, name
+    courts = list(Court.objects.order_by('name', '-type').values())
+    for court in courts:
+        if court['type'] == 'B' or court['type'] == 'D':
+            if not court['has_feed']:
+                final_attrs = dict(final_attrs, name='courts', id='%s_%s' % (attrs['id'], field_id),
+                    title='Court does not publish data.')
+                final_attrs['class'] = 'courtbox'
+            else:
+                final_attrs = dict(final_attrs, name='courts', id='%s_%s' % (attrs['id'], field_id), title='')
+
+                if court['type'] == 'D':
+                    final_attrs['class'] = 'courtbox district'
+                else:
+                    final_attrs['class'] = 'courtbox'
+
+            rendered_cbs = render_checkboxes(final_attrs, force_str(court['id']))
+
+            if court['type'] == 'D':
+                option_label = conditional_escape(force_str(court['name']))
+                output.append((force_str(court['id']),) + tuple(
+                              [div + u'%s %s' % (get_court_image(court), cb) for cb in rendered_cbs]))
+            else:
+                output.append((force_str(court['id']),) + tuple(
+                              [u' %s %s %s</div>' % (get_court_image(court), cb, option_label) for cb in rendered_cbs]))
+
+            field_id += 1
+
+    output.append(u'<div class="col-xs-12"><h4>National Courts</h4></div>')
+
+    for court in courts:
+        if court['type'] not in ['B', 'D', 'A']:
+            if not court['has_feed']:
+                final_attrs = dict(final_attrs, id='%s_%s' % (attrs['id'], field_id),
+                    title='Court does not publish data.')
+            else:
+                final_attrs = dict(final_attrs, id='%s_%s' % (attrs['id'], field_id), title='')
+
+            rendered_cbs = render_checkboxes(final_attrs, force_str(court['id']))
+
+            option_label = conditional_escape(force_str(court['name']))
+            if not court['publishes_all'] and court['has_feed']:
+                option_label = ('<span class="text-danger" title="' +
+                                conditional_escape(force_str(court['filing_types']))
+                                + '">' + option_label + '</span>')
+            elif not court['has_feed']:
+                option_label = ('<span class="court-disabled" title="' +
+                                conditional_escape(force_str(court['filing_types']))
+                                + '">' + option_label + '</span>')
+            output.append((force_str(court['id']),) + tuple(
+                          [div + u'%s %s</div>' % (cb, option_label) for cb in rendered_cbs]))
+
+            field_id += 1
+
+    output.append(u'<div class="col-xs-12"><h4>Appeals Courts</h4></div>')
+
+    for court in courts:
+        if court['type'] == 'A':
+            if not court['has_feed']:
+                final_attrs = dict(final_attrs, id='%s_%s' % (attrs['id'], field_id),
+                    title='Court does not publish data.')
+            else:
+                final_attrs = dict(final_attrs, id='%s_%s' % (attrs['id'], field_id), title='')
+
+            rendered_cbs = render_checkboxes(final_attrs, force_str(court['id']))
+
+            option_label = conditional_escape(force_str(court['name']))
+            if not court['publishes_all'] and court['has_feed']:
+                option_label = ('<span class="text-danger" title="' +
+                                conditional_escape(force_str(court['filing_types']))
+                                + '">' + option_label + '</span>')
+            elif not court['has_feed']:
+                option_label = ('<span class="court-disabled" title="' +
+                                conditional_escape(force_str(court['filing_types']))
+                                + '">' + option_label + '</span>')
+            output.append((force_str(court['id']),) + tuple(
+                          [div + u'%s %s</div>' % (cb, option_label) for cb in rendered_cbs]))
+
+            field_id += 1
+
+    return output
+
+
+def get_court_picker(widget_attrs):
+    version = cache.get(PICKER_VERSION_KEY)
+    if version is None:
+        invalidate_court_picker()
+        version = cache.get(PICKER_VERSION_KEY)
+
+    if court_picker['version'] != version or court_picker['segments'] is None:
+        court_picker['segments'] = build_court_picker(widget_attrs)
+        court_picker['version'] = version
+
+    return court_picker['segments']
+
+
+class CourtSelectMultiple(CheckboxSelectMultiple):
+    """
+    Checkboxes for every court, grouped by type
+
+    The markup for the courts is built once per process and rebuilt when courts
+    change (see invalidate_court_picker). Rendering a form only checks the boxes
+    and fills in its name and ids, so it does not query the database.
+    """
+    def render(self, name, value, attrs=None, choices=(), renderer=None):
+        #If no courts are selected for this alert, make value a blank list
+        if value is None: value = []
+        # Normalize values to strings so the right boxes are checked
+        str_values = set([force_str(v) for v in value])
+
+        output = []
+        for segment in get_court_picker(self.attrs):
+            if isinstance(segment, tuple):
+                output.append(segment[2] if segment[0] in str_values else segment[1])
+            else:
+                output.append(segment)
+
+        output = u'\n'.join(output)
+        output = output.replace(PICKER_NAME, conditional_escape(name))
+        output = output.replace(PICKER_ID, conditional_escape((attrs or {}).get('id', '')))
+
+        return mark_safe(output)